@@ -0,0 +1,133 @@
+import os
+import platform
+import resource
+import subprocess
+import threading
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+import httpx
+import numpy as np
+
+#shared pieces of the ingest/summary benchmarks: the HTTP client, peak RSS, latency percentiles and the result metadata
+
+#the app in this process through ASGI (its own pool, caches and startup), or a running server when url is given
+@asynccontextmanager
+async def open_client(url: Optional[str]) -> AsyncIterator[httpx.AsyncClient]:
+    if url:
+        async with httpx.AsyncClient(base_url=url, timeout=None) as client:
+            yield client
+        return
+    from asgi_lifespan import LifespanManager
+    from main import app
+    async with LifespanManager(app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None) as client:
+            yield client
+
+page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+def current_rss() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * page_size
+    except OSError:
+        return None
+
+#highest RSS of this process while the block runs, sampled from a thread since ru_maxrss can't be reset between runs
+class RssSampler:
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak: Optional[int] = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+
+    def sample(self) -> None:
+        while True:
+            rss = current_rss()
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+            if self.stopped.wait(self.interval):
+                return
+
+    def __enter__(self) -> "RssSampler":
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stopped.set()
+        self.thread.join()
+        #no /proc, e.g. macOS: the process-wide high-water mark instead (bytes there, kilobytes on Linux)
+        if self.peak is None:
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            self.peak = maxrss if platform.system() == "Darwin" else maxrss * 1024
+
+def latency_summary(latencies_ms: Sequence[float]) -> Dict[str, Any]:
+    if not latencies_ms:
+        return {"count": 0}
+    p50, p95, p99 = np.percentile(latencies_ms, [50, 95, 99])
+    return {
+        "count": len(latencies_ms),
+        "mean_ms": round(float(np.mean(latencies_ms)), 3),
+        "p50_ms": round(float(p50), 3),
+        "p95_ms": round(float(p95), 3),
+        "p99_ms": round(float(p99), 3),
+        "max_ms": round(float(np.max(latencies_ms)), 3),
+    }
+
+#name;dur=12.3, ... back into {name: milliseconds}
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    timings = {}
+    for entry in (header or "").split(","):
+        name, _, duration = entry.strip().partition(";dur=")
+        if name and duration:
+            timings[name] = float(duration)
+    return timings
+
+def git_revision() -> Dict[str, Any]:
+    def git(*args: str) -> Optional[str]:
+        try:
+            return subprocess.run(["git", *args], capture_output=True, text=True, check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {"commit": git("rev-parse", "HEAD"), "dirty": bool(status) if status is not None else None}
+
+#what the numbers were measured on, stored next to them so two result files can be told apart
+def run_metadata(parameters: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git": git_revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "parameters": parameters,
+    }
+
+#nested results as {dotted.path: number}
+def flatten(results: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{path}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = float(value)
+    return flat
+
+def higher_is_better(path: str) -> bool:
+    return path.endswith("per_second")
+
+#metrics compared between two result files, throughputs are better higher, latencies and memory lower
+compared_suffixes = ("rows_per_second", "requests_per_second", "p50_ms", "p95_ms", "p99_ms", "peak_rss_bytes")
+
+#relative change of every compared metric, a regression is a change for the worse by more than threshold (0.1 = 10%)
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    before, after = flatten(baseline.get("results", {})), flatten(current.get("results", {}))
+    rows = []
+    for path in sorted(set(before) & set(after)):
+        if not path.endswith(compared_suffixes) or not before[path]:
+            continue
+        change = (after[path] - before[path]) / before[path]
+        worse = -change if higher_is_better(path) else change
+        rows.append({"metric": path, "baseline": before[path], "current": after[path], "change": round(change, 4), "regression": worse > threshold})
+    return rows
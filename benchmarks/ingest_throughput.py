@@ -0,0 +1,104 @@
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict
+from sqlalchemy import text
+from benchmarks.harness import RssSampler, open_client, parse_server_timing
+from benchmarks.synthetic import write_csv
+
+#end-to-end upload throughput: a synthetic CSV goes through POST /upload/ (multipart, parsing, the ingest mode, commit) like a client's file would
+#every mode gets a file of its own (seed + mode index), so each one inserts fresh rows instead of finding the previous mode's duplicates
+#docker compose exec app python3 -m benchmarks.ingest_throughput --rows 1000000 --modes insert,copy,sharded
+
+def add_dataset_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--skew", type=float, default=0.0, help="Zipf exponent of user/product popularity, 0 is uniform")
+    parser.add_argument("--recency", type=float, default=0.0, help="how much the timestamps lean towards the end of the range, 0 is uniform")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--url", help="benchmark a running server, e.g. http://localhost:8000, instead of the app in this process")
+
+def add_ingest_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--modes", default="insert,copy,sharded", help="comma separated upload modes")
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--truncate", action="store_true", help="empty transactions, users and products before every mode, only with the app in this process")
+
+#fixed start, so two runs of the same parameters upload the same rows
+dataset_start = datetime(2024, 1, 1)
+
+def dataset_options(args) -> Dict[str, Any]:
+    return {
+        "users": args.users, "products": args.products, "start": dataset_start, "days": args.days,
+        "skew": args.skew, "recency": args.recency, "duplicate_ratio": args.duplicate_ratio,
+    }
+
+async def truncate_tables() -> None:
+    from database import engine
+    from services.id_cache import clear_id_caches
+    from services.summary_cache import get_summary_cache
+    async with engine.begin() as conn:
+        await conn.execute(text("TRUNCATE user_daily_rollups, user_amount_sketches, amount_sketches, transactions, transaction_keys, users, products"))
+    clear_id_caches()
+    get_summary_cache().clear()
+
+async def run(args) -> Dict[str, Any]:
+    if args.truncate and args.url:
+        raise SystemExit("--truncate would leave the server's id caches stale, only use it without --url")
+    modes = [mode.strip() for mode in args.modes.split(",") if mode.strip()]
+    results: Dict[str, Any] = {}
+    with tempfile.TemporaryDirectory() as directory:
+        async with open_client(args.url) as client:
+            for index, mode in enumerate(modes):
+                path = Path(directory) / f"transactions_{mode}.csv"
+                started = time.perf_counter()
+                await asyncio.to_thread(write_csv, path, args.rows, seed=args.seed + index, **dataset_options(args))
+                generate_seconds = time.perf_counter() - started
+
+                if args.truncate:
+                    await truncate_tables()
+
+                with RssSampler() as rss, path.open("rb") as file:
+                    started = time.perf_counter()
+                    response = await client.post(
+                        "/upload/", params={"mode": mode, "shards": args.shards},
+                        files={"file": (path.name, file, "text/csv")},
+                    )
+                    seconds = time.perf_counter() - started
+                response.raise_for_status()
+
+                results[mode] = {
+                    "generate_seconds": round(generate_seconds, 3),
+                    "file_bytes": path.stat().st_size,
+                    "seconds": round(seconds, 3),
+                    "rows_per_second": round(args.rows / seconds, 1),
+                    #only this process, so not the server's when --url is used
+                    "peak_rss_bytes": None if args.url else rss.peak,
+                    "server_timing_ms": parse_server_timing(response.headers.get("Server-Timing")),
+                    "upload": response.json(),
+                }
+                print("ingest", mode, json.dumps(results[mode]), flush=True)
+                path.unlink()
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Upload throughput of POST /upload/ per ingest mode")
+    add_dataset_arguments(parser)
+    add_ingest_arguments(parser)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
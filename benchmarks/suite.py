@@ -0,0 +1,58 @@
+import argparse
+import asyncio
+import json
+import sys
+from typing import Any, Dict
+from benchmarks import ingest_throughput, summary_latency
+from benchmarks.harness import compare, run_metadata
+
+#ingest throughput then summary latency on the data it loaded, written as one JSON file with the commit and parameters they ran with
+#two files from different commits are compared with --compare, metrics that got worse by more than --threshold are marked as regressions
+#docker compose exec app python3 -m benchmarks.suite --rows 1000000 --truncate --output bench/$(git rev-parse --short HEAD).json
+#docker compose exec app python3 -m benchmarks.suite --rows 1000000 --truncate --compare bench/<baseline>.json --fail-on-regression
+
+async def run(args) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    if not args.skip_ingest:
+        results["ingest"] = await ingest_throughput.run(args)
+    if not args.skip_summary:
+        results["summary"] = await summary_latency.run(args)
+    return results
+
+def print_comparison(rows) -> None:
+    print(f"{'metric':<48} {'baseline':>14} {'current':>14} {'change':>9}")
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(f"{row['metric']:<48} {row['baseline']:>14.3f} {row['current']:>14.3f} {row['change']:>+9.1%}{flag}")
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Ingest and summary benchmarks, saved as JSON for comparison between commits")
+    ingest_throughput.add_dataset_arguments(parser)
+    ingest_throughput.add_ingest_arguments(parser)
+    summary_latency.add_summary_arguments(parser)
+    parser.add_argument("--skip-ingest", action="store_true", help="only the summary benchmark, on the data already in the database")
+    parser.add_argument("--skip-summary", action="store_true")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="results JSON of an earlier run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative change for the worse counted as a regression (default 0.1)")
+    parser.add_argument("--fail-on-regression", action="store_true", help="exit with status 1 if --compare finds a regression")
+    args = parser.parse_args()
+
+    parameters = {key: value for key, value in vars(args).items() if key not in ("output", "compare", "fail_on_regression")}
+    report = {**run_metadata(parameters), "results": asyncio.run(run(args))}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    print(json.dumps(report, indent=2))
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        rows = compare(baseline, report, args.threshold)
+        print(f"compared with {baseline.get('git', {}).get('commit')} ({baseline.get('created_at')})")
+        print_comparison(rows)
+        if args.fail_on_regression and any(row["regression"] for row in rows):
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
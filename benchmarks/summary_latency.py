@@ -0,0 +1,84 @@
+import argparse
+import asyncio
+import json
+import time
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+import numpy as np
+from benchmarks.harness import latency_summary, open_client
+from benchmarks.ingest_throughput import add_dataset_arguments, dataset_start
+from benchmarks.synthetic import pick_ids
+
+#GET /summary/{user_id} under concurrent clients, against whatever data is in the database (e.g. loaded by benchmarks.ingest_throughput with the same --users/--days)
+#users are picked with the same --skew as the generated data, so popular users are asked for more often, as they would be
+#docker compose exec app python3 -m benchmarks.summary_latency --requests 5000 --concurrency 32
+
+def add_summary_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--warmup", type=int, default=200, help="requests sent first and left out of the latencies")
+    parser.add_argument("--window-days", type=int, default=30, help="length of a random start/end window inside the data, 0 for the whole history")
+
+def request_params(rng: np.random.Generator, count: int, args) -> List[tuple[int, Dict[str, str]]]:
+    user_ids = pick_ids(rng, count, args.users, args.skew).tolist()
+    if not args.window_days:
+        return [(user_id, {}) for user_id in user_ids]
+    #start at any second of the data range, so both edges usually fall inside a day
+    offsets = rng.integers(0, max(1, (args.days - args.window_days) * 86_400), size=count).tolist()
+    params = []
+    for user_id, offset in zip(user_ids, offsets):
+        start = dataset_start + timedelta(seconds=offset)
+        params.append((user_id, {"start": start.isoformat(sep=" "), "end": (start + timedelta(days=args.window_days)).isoformat(sep=" ")}))
+    return params
+
+async def run(args) -> Dict[str, Any]:
+    rng = np.random.default_rng(args.seed)
+    warmup = request_params(rng, args.warmup, args)
+    measured = request_params(rng, args.requests, args)
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+
+    async with open_client(args.url) as client:
+        #every client takes the next request off the shared list until it is empty
+        async def worker(requests: List[tuple[int, Dict[str, str]]], record: Optional[List[float]]) -> None:
+            while requests:
+                user_id, params = requests.pop()
+                started = time.perf_counter()
+                response = await client.get(f"/summary/{user_id}", params=params)
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                if record is not None:
+                    record.append(elapsed_ms)
+                    statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+
+        await asyncio.gather(*(worker(warmup, None) for _ in range(args.concurrency)))
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(measured, latencies) for _ in range(args.concurrency)))
+        seconds = time.perf_counter() - started
+
+    results = {
+        "concurrency": args.concurrency,
+        "window_days": args.window_days,
+        "seconds": round(seconds, 3),
+        "requests_per_second": round(len(latencies) / seconds, 1) if seconds else None,
+        #404 is a user without transactions in the window, still a complete answer
+        "statuses": statuses,
+        **latency_summary(latencies),
+    }
+    print("summary", json.dumps(results), flush=True)
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Latency of GET /summary/{user_id} under concurrent clients")
+    add_dataset_arguments(parser)
+    add_summary_arguments(parser)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
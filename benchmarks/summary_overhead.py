@@ -0,0 +1,127 @@
+import argparse
+import asyncio
+import json
+import time
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+import numpy as np
+from sqlalchemy import select, func, union_all, cast, BigInteger
+from database import ReadSessionLocal
+from models.models import Transaction, UserDailyRollup
+from services.summary_services import split_window, summary_query, window_parameters
+from benchmarks.harness import latency_summary
+from benchmarks.ingest_throughput import dataset_start
+from benchmarks.synthetic import pick_ids
+
+#per-call Python overhead of the /summary query, the way it used to be built against the fixed shapes of services/summary_services:
+#  dynamic   a new select per request, its WHERE depending on which of start/end were given (the old summary_statement), session.execute
+#  cached    the fixed select with bound window parameters through session.execute, one compiled-cache entry and one prepared statement
+#  fixed     the same statement through FixedStatement.execute, compiled once, exec_driver_sql per call
+#every call goes to the database, on one session, one call at a time; cpu_us_per_call is this process's CPU time (time.process_time),
+#which is the Python side only, the wall latencies include the round trip and the query itself
+#docker compose exec app python3 -m benchmarks.summary_overhead --calls 5000
+
+#the pre-fixed-shape builder, kept here only as the baseline
+def dynamic_summary_statement(user_id: int, start: Optional[datetime], end: Optional[datetime]):
+    rollup_start, rollup_end, raw_ranges = split_window(start, end)
+    parts = []
+    if not (rollup_start and rollup_end and rollup_start >= rollup_end):
+        conditions = [UserDailyRollup.user_id == user_id]
+        if rollup_start:
+            conditions.append(UserDailyRollup.bucket >= rollup_start)
+        if rollup_end:
+            conditions.append(UserDailyRollup.bucket < rollup_end)
+        parts.append(select(
+            func.sum(UserDailyRollup.transaction_count).label("total"),
+            func.sum(UserDailyRollup.amount_sum).label("amount_sum"),
+            func.min(UserDailyRollup.amount_min).label("min_amount"),
+            func.max(UserDailyRollup.amount_max).label("max_amount"),
+        ).where(*conditions))
+    for raw_start, raw_end in raw_ranges:
+        conditions = [Transaction.user_id == user_id]
+        if raw_start:
+            conditions.append(Transaction.timestamp >= raw_start)
+        if raw_end:
+            conditions.append(Transaction.timestamp < raw_end)
+        parts.append(select(
+            func.count().label("total"),
+            func.sum(Transaction.transaction_amount).label("amount_sum"),
+            func.min(Transaction.transaction_amount).label("min_amount"),
+            func.max(Transaction.transaction_amount).label("max_amount"),
+        ).where(*conditions))
+    summary = union_all(*parts).subquery()
+    total = func.sum(summary.c.total)
+    return select(
+        cast(func.coalesce(total, 0), BigInteger).label("total"),
+        func.min(summary.c.min_amount).label("min_amount"),
+        func.max(summary.c.max_amount).label("max_amount"),
+        (func.sum(summary.c.amount_sum) / func.nullif(total, 0)).label("mean_amount"),
+    )
+
+async def run_dynamic(session, user_id, start, end):
+    return (await session.execute(dynamic_summary_statement(user_id, start, end))).one()
+
+async def run_cached(session, user_id, start, end):
+    return (await session.execute(summary_query.statement, {"user_id": user_id, **window_parameters(start, end)})).one()
+
+async def run_fixed(session, user_id, start, end):
+    return (await summary_query.execute(session, user_id=user_id, **window_parameters(start, end))).one()
+
+variants: Dict[str, Callable] = {"dynamic": run_dynamic, "cached": run_cached, "fixed": run_fixed}
+
+#a mix of the window shapes callers send: none, start only, end only, both (at any second, so the edges fall inside a day)
+def request_params(rng: np.random.Generator, count: int, args) -> List[tuple[int, Optional[datetime], Optional[datetime]]]:
+    user_ids = pick_ids(rng, count, args.users, args.skew).tolist()
+    offsets = rng.integers(0, max(1, (args.days - args.window_days) * 86_400), size=count).tolist()
+    shapes = rng.integers(0, 4, size=count).tolist()
+    params = []
+    for user_id, offset, shape in zip(user_ids, offsets, shapes):
+        start = dataset_start + timedelta(seconds=offset)
+        end = start + timedelta(days=args.window_days)
+        params.append((user_id, start if shape & 1 else None, end if shape & 2 else None))
+    return params
+
+async def run_variant(name: str, params, warmup: int) -> Dict[str, Any]:
+    execute = variants[name]
+    latencies: List[float] = []
+    async with ReadSessionLocal() as session:
+        for user_id, start, end in params[:warmup]:
+            await execute(session, user_id, start, end)
+        cpu_started = time.process_time()
+        for user_id, start, end in params[warmup:]:
+            started = time.perf_counter()
+            await execute(session, user_id, start, end)
+            latencies.append((time.perf_counter() - started) * 1000)
+        cpu = time.process_time() - cpu_started
+    return {"cpu_us_per_call": round(cpu / len(latencies) * 1e6, 1) if latencies else None, **latency_summary(latencies)}
+
+async def run(args) -> Dict[str, Any]:
+    rng = np.random.default_rng(args.seed)
+    params = request_params(rng, args.warmup + args.calls, args)
+    results = {}
+    for name in args.variants.split(","):
+        results[name] = await run_variant(name, params, args.warmup)
+        print(name, json.dumps(results[name]), flush=True)
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Per-call Python overhead of the summary query, dynamic select vs fixed statement shapes")
+    parser.add_argument("--calls", type=int, default=5000)
+    parser.add_argument("--warmup", type=int, default=500, help="calls made first and left out, they fill the compiled and prepared statement caches")
+    parser.add_argument("--variants", default="dynamic,cached,fixed", help="comma separated, of dynamic, cached, fixed")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--window-days", type=int, default=30)
+    parser.add_argument("--skew", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
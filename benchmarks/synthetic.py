@@ -0,0 +1,118 @@
+import argparse
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterator
+import numpy as np
+from services.csv_parser import ParsedBatch, headers
+
+#synthetic transactions built straight as columnar numpy batches, no per-row Python objects
+#same shape the upload parser produces, so a batch can be COPYed with ParsedBatch.copy_payload or written out as an upload CSV
+#python3 -m benchmarks.synthetic --rows 1000000 --skew 1.1 --duplicate-ratio 0.01 --output transactions.csv
+
+hex_digits = np.frombuffer(b"0123456789abcdef", dtype=np.uint8)
+#where the 32 hex digits go in the 36 characters of a uuid string, the rest are dashes
+uuid_hex_positions = np.array([i for i in range(36) if i not in (8, 13, 18, 23)])
+
+#ids 1..count, uniform for skew 0, otherwise Zipf-like: id k is picked with weight 1 / k ** skew, so a few users/products get most of the rows
+def pick_ids(rng: np.random.Generator, rows: int, count: int, skew: float) -> np.ndarray:
+    if skew <= 0:
+        return rng.integers(1, count + 1, size=rows, dtype=np.int32)
+    weights = 1.0 / np.arange(1, count + 1) ** skew
+    cumulative = np.cumsum(weights)
+    picked = np.searchsorted(cumulative, rng.random(rows) * cumulative[-1], side="right")
+    return (np.minimum(picked, count - 1) + 1).astype(np.int32)
+
+def generate_batch(
+    rng: np.random.Generator,
+    rows: int,
+    users: int = 1000,
+    products: int = 500,
+    start: datetime = datetime(2024, 1, 1),
+    days: int = 365,
+    skew: float = 0.0,
+    recency: float = 0.0,
+    duplicate_ratio: float = 0.0,
+) -> ParsedBatch:
+    transaction_id = rng.integers(0, 256, size=(rows, 16), dtype=np.uint8)
+    #version 4 / variant bits, so the ids look like uuid4
+    transaction_id[:, 6] = (transaction_id[:, 6] & 0x0F) | 0x40
+    transaction_id[:, 8] = (transaction_id[:, 8] & 0x3F) | 0x80
+    #that share of rows repeats the transaction_id of another row of the batch, the upload keeps the first one
+    if duplicate_ratio > 0:
+        repeated = rng.random(rows) < duplicate_ratio
+        originals = np.flatnonzero(~repeated)
+        if len(originals):
+            transaction_id[repeated] = transaction_id[rng.choice(originals, size=int(repeated.sum()))]
+    #recency 0 spreads rows evenly over the days, higher values pile them up towards the end of the range
+    position = rng.random(rows) ** (1.0 / (1.0 + recency))
+    offsets = (position * (days * 86_400_000_000)).astype(np.int64).astype("timedelta64[us]")
+    return ParsedBatch(
+        transaction_id=transaction_id,
+        user_id=pick_ids(rng, rows, users, skew),
+        product_id=pick_ids(rng, rows, products, skew),
+        timestamp=np.datetime64(start, "us") + offsets,
+        #5.00 to 500.00
+        amount_cents=rng.integers(500, 50_001, size=rows, dtype=np.int64),
+        line_numbers=np.arange(rows, dtype=np.int64),
+    )
+
+def generate_batches(rows: int, batch_rows: int, seed: int = 0, **options) -> Iterator[ParsedBatch]:
+    rng = np.random.default_rng(seed)
+    for start in range(0, rows, batch_rows):
+        yield generate_batch(rng, min(batch_rows, rows - start), **options)
+
+#the batch as upload CSV lines without the header, the uuid and timestamp columns are formatted with numpy
+def to_csv(batch: ParsedBatch) -> bytes:
+    nibbles = np.empty((len(batch), 32), dtype=np.uint8)
+    nibbles[:, 0::2] = batch.transaction_id >> 4
+    nibbles[:, 1::2] = batch.transaction_id & 0x0F
+    uuids = np.full((len(batch), 36), ord("-"), dtype=np.uint8)
+    uuids[:, uuid_hex_positions] = hex_digits[nibbles]
+    #YYYY-MM-DD HH:MM:SS.ffffff, the format the parser's fast path reads
+    timestamps = np.datetime_as_string(batch.timestamp, unit="us").astype("S26")
+    timestamps.view(np.uint8).reshape(-1, 26)[:, 10] = ord(" ")
+    lines = [
+        f"{transaction_id},{user_id},{product_id},{timestamp},{cents // 100}.{cents % 100:02d}\n"
+        for transaction_id, user_id, product_id, timestamp, cents in zip(
+            uuids.view("S36").ravel().astype(str).tolist(),
+            batch.user_id.tolist(),
+            batch.product_id.tolist(),
+            timestamps.astype(str).tolist(),
+            batch.amount_cents.tolist(),
+        )
+    ]
+    return "".join(lines).encode()
+
+#writes the header and rows batch by batch, so memory stays at one batch whatever the row count
+def write_csv(path: str | Path, rows: int, batch_rows: int = 100_000, seed: int = 0, **options) -> int:
+    with Path(path).open("wb") as file:
+        file.write((",".join(headers) + "\n").encode())
+        for batch in generate_batches(rows, batch_rows, seed=seed, **options):
+            file.write(to_csv(batch))
+    return rows
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Write a synthetic transactions CSV in the upload format")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--start", type=datetime.fromisoformat, help="first day of the range, default --days before now")
+    parser.add_argument("--skew", type=float, default=0.0, help="Zipf exponent of user/product popularity, 0 is uniform")
+    parser.add_argument("--recency", type=float, default=0.0, help="how much the timestamps lean towards the end of the range, 0 is uniform")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0, help="share of rows that repeat the transaction_id of another row")
+    parser.add_argument("--batch-rows", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="dummy_transactions.csv")
+    args = parser.parse_args()
+
+    start = args.start or datetime.now().replace(microsecond=0) - timedelta(days=args.days)
+    write_csv(
+        args.output, args.rows, args.batch_rows, args.seed,
+        users=args.users, products=args.products, start=start, days=args.days,
+        skew=args.skew, recency=args.recency, duplicate_ratio=args.duplicate_ratio,
+    )
+    print(f"wrote {args.rows} rows to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+import argparse
+import asyncio
+import io
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict
+import numpy as np
+from sqlalchemy import text
+from database import engine
+from benchmarks.synthetic import generate_batches
+
+#compares the standard and compact (TRANSACTIONS_LAYOUT=compact) transactions layouts on the same synthetic rows:
+#ingest throughput of the upload merge statement, on-disk size, and latency of the summary edge scan (user + time window)
+#runs in a scratch schema that is dropped afterwards, the app's tables are not touched
+#docker compose exec app python3 -m benchmarks.transactions_layout --rows 1000000
+
+schema = "bench_layout"
+
+layouts = {
+    "standard": [
+        "CREATE TABLE {table} (id serial PRIMARY KEY, transaction_id uuid NOT NULL UNIQUE, user_id integer NOT NULL, product_id integer NOT NULL, "
+        "timestamp timestamp NOT NULL, transaction_amount numeric(12, 2) NOT NULL)",
+        "CREATE INDEX ON {table} (user_id)",
+        "CREATE INDEX ON {table} (product_id)",
+        "CREATE INDEX ON {table} (timestamp)",
+        "CREATE INDEX ON {table} (user_id, timestamp)",
+        "CREATE INDEX ON {table} (product_id, timestamp)",
+    ],
+    "compact": [
+        "CREATE TABLE {table} (transaction_id uuid PRIMARY KEY, user_id integer NOT NULL, product_id integer NOT NULL, "
+        "timestamp timestamp NOT NULL, transaction_amount numeric(12, 2) NOT NULL)",
+        "CREATE INDEX ON {table} (user_id, timestamp) INCLUDE (transaction_amount)",
+        "CREATE INDEX ON {table} (product_id, timestamp)",
+    ],
+}
+
+staging = f"{schema}.staging"
+
+summary_query = (
+    "SELECT count(*), sum(transaction_amount), min(transaction_amount), max(transaction_amount) FROM {table} "
+    "WHERE user_id = :user_id AND timestamp >= :start AND timestamp < :end"
+)
+
+async def load(table: str, args) -> float:
+    elapsed = 0.0
+    for batch in generate_batches(args.rows, args.batch_rows, seed=args.seed, users=args.users, products=args.products):
+        async with engine.begin() as conn:
+            await conn.execute(text(f"TRUNCATE {staging}"))
+            driver_connection = (await conn.get_raw_connection()).driver_connection
+            await driver_connection.copy_to_table(
+                "staging", schema_name=schema, source=io.BytesIO(batch.copy_payload()),
+                columns=["transaction_id", "user_id", "product_id", "timestamp", "amount_cents"], format="binary",
+            )
+            #the same statement shape merge_staging publishes with
+            started = time.perf_counter()
+            await conn.execute(text(
+                f"INSERT INTO {table} (transaction_id, user_id, product_id, timestamp, transaction_amount) "
+                f"SELECT transaction_id, user_id, product_id, timestamp, amount_cents / 100.0 FROM {staging} "
+                "ON CONFLICT (transaction_id) DO NOTHING"
+            ))
+            elapsed += time.perf_counter() - started
+    return elapsed
+
+async def measure_queries(table: str, args) -> Dict[str, Any]:
+    rng = np.random.default_rng(args.seed + 1)
+    sql = text(summary_query.format(table=table))
+    latencies = []
+    async with engine.connect() as conn:
+        #partial days at a window edge, the part of /summary that still reads transactions
+        for _ in range(args.queries):
+            start = datetime(2024, 1, 1) + timedelta(days=int(rng.integers(0, 360)), hours=int(rng.integers(0, 24)))
+            params = {"user_id": int(rng.integers(1, args.users + 1)), "start": start, "end": start + timedelta(days=7)}
+            started = time.perf_counter()
+            await conn.execute(sql, params)
+            latencies.append((time.perf_counter() - started) * 1000)
+        plan = (await conn.execute(text(f"EXPLAIN (FORMAT JSON) {summary_query.format(table=table)}"), params)).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    node = plan[0]["Plan"]
+    while node.get("Plans") and node["Node Type"] not in ("Index Only Scan", "Index Scan", "Bitmap Heap Scan", "Seq Scan"):
+        node = node["Plans"][0]
+    return {
+        "p50_ms": round(statistics.median(latencies), 3),
+        "p95_ms": round(float(np.percentile(latencies, 95)), 3),
+        "scan": node["Node Type"],
+    }
+
+async def run(args) -> Dict[str, Any]:
+    results: Dict[str, Any] = {"rows": args.rows, "users": args.users, "products": args.products, "layouts": {}}
+    async with engine.begin() as conn:
+        await conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        await conn.execute(text(f"CREATE SCHEMA {schema}"))
+        await conn.execute(text(
+            f"CREATE UNLOGGED TABLE {staging} (transaction_id uuid NOT NULL, user_id integer NOT NULL, product_id integer NOT NULL, "
+            "timestamp timestamp NOT NULL, amount_cents bigint NOT NULL)"
+        ))
+    try:
+        for name, statements in layouts.items():
+            table = f"{schema}.transactions_{name}"
+            async with engine.begin() as conn:
+                for statement in statements:
+                    await conn.execute(text(statement.format(table=table)))
+            elapsed = await load(table, args)
+            #the visibility map has to be set for index-only scans, same as after autovacuum in production
+            async with engine.connect() as conn:
+                conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                await conn.execute(text(f"VACUUM ANALYZE {table}"))
+                heap, indexes = (await conn.execute(text(f"SELECT pg_relation_size('{table}'), pg_indexes_size('{table}')"))).one()
+            results["layouts"][name] = {
+                "ingest_seconds": round(elapsed, 3),
+                "rows_per_second": round(args.rows / elapsed, 1) if elapsed else None,
+                "heap_bytes": heap,
+                "index_bytes": indexes,
+                "total_bytes": heap + indexes,
+                "summary_edge_scan": await measure_queries(table, args),
+            }
+            print(name, json.dumps(results["layouts"][name]), flush=True)
+    finally:
+        async with engine.begin() as conn:
+            await conn.execute(text(f"DROP SCHEMA IF EXISTS {schema} CASCADE"))
+        await engine.dispose()
+    return results
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare the standard and compact transactions layouts")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--products", type=int, default=500)
+    parser.add_argument("--batch-rows", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,10 @@
-import csv
-import random
-from pathlib import Path
-from faker import Faker
+from datetime import datetime, timedelta
+from benchmarks.synthetic import write_csv
 TRANSACTIONS = 1_000_000
 # TRANSACTIONS = 10
-HEADERS = ["transaction_id", "user_id", "product_id", "timestamp",
-"transaction_amount"]
-# Initialize Faker
-fake = Faker()
-# Open the CSV file for writing
-with Path("dummy_transactions.csv").open(mode="w", newline="") as file:
-# with Path("test_data.csv").open(mode="w", newline="") as file:
-    writer = csv.DictWriter(file, fieldnames=HEADERS)
-    writer.writeheader()
-    # Generate dummy data
-    for _ in range(TRANSACTIONS):
-        writer.writerow(
-        {
-            "transaction_id": fake.uuid4(),
-            "user_id": fake.random_int(min=1, max=1000),
-            "product_id": fake.random_int(min=1, max=500),
-            "timestamp": fake.date_time_between(start_date="-1y",
-            end_date="now"),
-            "transaction_amount": round(random.uniform(5.0, 500.0), 2),
-        })
\ No newline at end of file
+#columnar generator instead of Faker row by row, seconds instead of minutes for 1M rows
+#same columns and ranges as before: users 1-1000, products 1-500, the last year, amounts 5.00-500.00
+#for skew, duplicates and other sizes: python3 -m benchmarks.synthetic --help
+start = datetime.now().replace(microsecond=0) - timedelta(days=365)
+write_csv("dummy_transactions.csv", TRANSACTIONS, users=1000, products=500, start=start, days=365)
+# write_csv("test_data.csv", TRANSACTIONS, users=1000, products=500, start=start, days=365)
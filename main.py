@@ -1,15 +1,41 @@
 from fastapi import FastAPI
-from database import init_models
-from routers import upload, summary
+from database import init_models, AsyncSessionLocal
+from services.id_cache import id_cache_warm, warm_id_caches
+from services.jobs import import_jobs
+from services.compression import GzipRequestMiddleware
+from services.metrics import MetricsMiddleware, metrics_enabled
+from routers import upload, summary, transactions, metrics, debug
 
 app = FastAPI()
 
+#request latency per route for /metrics, added first so it runs inside the gzip middleware and sees the matched route
+if metrics_enabled:
+    app.add_middleware(MetricsMiddleware)
+
+#request bodies sent with Content-Encoding: gzip are inflated as they are read
+app.add_middleware(GzipRequestMiddleware)
+
 #this function runs once at app startup, create tables from models (due to init_models)
 @app.on_event("startup")
 async def startup():
     await init_models()
+    #optional, otherwise the user/product id caches fill lazily as uploads commit
+    if id_cache_warm:
+        async with AsyncSessionLocal() as session:
+            await warm_id_caches(session)
+
+#background imports still running are cancelled, their transactions roll back
+@app.on_event("shutdown")
+async def shutdown():
+    await import_jobs.cancel_all()
 
 #upload.router is the APIRouter object defined in routers/upload.py
 app.include_router(upload.router, prefix="/upload", tags=["upload"])
 
-app.include_router(summary.router, prefix="/summary", tags=["summary"])
\ No newline at end of file
+app.include_router(summary.router, prefix="/summary", tags=["summary"])
+
+app.include_router(transactions.router, prefix="/transactions", tags=["transactions"])
+
+app.include_router(metrics.router, tags=["metrics"])
+
+app.include_router(debug.router, prefix="/debug", tags=["debug"])
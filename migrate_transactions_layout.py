@@ -0,0 +1,72 @@
+import argparse
+import asyncio
+from sqlalchemy import text
+from database import engine
+
+#converts an existing (unpartitioned) transactions table between the standard and compact layouts, see TRANSACTIONS_LAYOUT in models/models.py
+#stop the app first, the table is locked for the whole migration, then start it again with the matching TRANSACTIONS_LAYOUT
+#docker compose exec app python3 migrate_transactions_layout.py compact
+
+to_compact = [
+    "ALTER TABLE transactions DROP CONSTRAINT transactions_pkey",
+    "ALTER TABLE transactions DROP COLUMN id",
+    #the unique index becomes the primary key index
+    "ALTER TABLE transactions DROP CONSTRAINT transactions_transaction_id_key, ADD CONSTRAINT transactions_pkey PRIMARY KEY (transaction_id)",
+    #covered by ix_transactions_user_ts / ix_transactions_product_ts
+    "DROP INDEX ix_transactions_user_id, ix_transactions_product_id, ix_transactions_timestamp",
+    "DROP INDEX ix_transactions_user_ts",
+    "CREATE INDEX ix_transactions_user_ts ON transactions (user_id, timestamp) INCLUDE (transaction_amount)",
+]
+
+to_standard = [
+    "ALTER TABLE transactions DROP CONSTRAINT transactions_pkey",
+    #numbers the existing rows, in physical order
+    "ALTER TABLE transactions ADD COLUMN id serial",
+    "ALTER TABLE transactions ADD CONSTRAINT transactions_pkey PRIMARY KEY (id), ADD CONSTRAINT transactions_transaction_id_key UNIQUE (transaction_id)",
+    "CREATE INDEX ix_transactions_user_id ON transactions (user_id)",
+    "CREATE INDEX ix_transactions_product_id ON transactions (product_id)",
+    "CREATE INDEX ix_transactions_timestamp ON transactions (timestamp)",
+    "DROP INDEX ix_transactions_user_ts",
+    "CREATE INDEX ix_transactions_user_ts ON transactions (user_id, timestamp)",
+]
+
+async def current_layout(conn) -> str:
+    relkind = (await conn.execute(text("SELECT relkind::text FROM pg_class WHERE oid = 'transactions'::regclass"))).scalar_one()
+    if relkind == "p":
+        raise SystemExit("transactions is partitioned, only unpartitioned tables are migrated by this script")
+    has_id = (await conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = 'transactions' AND column_name = 'id')"
+    ))).scalar_one()
+    return "standard" if has_id else "compact"
+
+async def migrate(layout: str, vacuum_full: bool) -> None:
+    try:
+        await migrate_table(layout, vacuum_full)
+    finally:
+        await engine.dispose()
+
+async def migrate_table(layout: str, vacuum_full: bool) -> None:
+    async with engine.begin() as conn:
+        if await current_layout(conn) == layout:
+            print(f"transactions already uses the {layout} layout")
+            return
+        for statement in to_compact if layout == "compact" else to_standard:
+            print(statement)
+            await conn.execute(text(statement))
+
+    #DROP COLUMN only hides the column, the space comes back when the table is rewritten
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        statement = "VACUUM (FULL, ANALYZE) transactions" if vacuum_full else "VACUUM ANALYZE transactions"
+        print(statement)
+        await conn.execute(text(statement))
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Convert the transactions table between the standard and compact layouts")
+    parser.add_argument("layout", choices=["standard", "compact"])
+    parser.add_argument("--no-vacuum-full", action="store_true", help="skip rewriting the table, the dropped id column keeps its space until then")
+    args = parser.parse_args()
+    asyncio.run(migrate(args.layout, not args.no_vacuum_full))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import asyncio
+from logging.config import fileConfig
+from alembic import context
+from sqlalchemy import pool, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import create_async_engine
+from database import DATABASE_URL, Base
+import models.models
+
+config = context.config
+
+#from the command line only, the app keeps its own logging when it migrates at startup
+if config.config_file_name is not None and config.attributes.get("configure_logger", True):
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+#several workers may start at once, only one migrates, the others wait and then find the database at head
+migration_lock_key = "hashtext('alembic_migrations')"
+
+#alembic upgrade head --sql, prints the SQL instead of running it
+def run_migrations_offline() -> None:
+    context.configure(
+        url=DATABASE_URL,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+        transaction_per_migration=True,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+def do_run_migrations(connection: Connection) -> None:
+    #session-level lock, it outlives the commit and every migration's own transaction
+    connection.execute(text(f"SELECT pg_advisory_lock({migration_lock_key})"))
+    connection.commit()
+    try:
+        #one transaction per revision, so a revision can step out of it with autocommit_block for CREATE INDEX CONCURRENTLY
+        context.configure(connection=connection, target_metadata=target_metadata, transaction_per_migration=True)
+        with context.begin_transaction():
+            context.run_migrations()
+    finally:
+        connection.execute(text(f"SELECT pg_advisory_unlock({migration_lock_key})"))
+        connection.commit()
+
+#its own engine without pooling, alembic runs in its own event loop, not the app's
+async def run_async_migrations() -> None:
+    connectable = create_async_engine(DATABASE_URL, poolclass=pool.NullPool)
+    async with connectable.connect() as connection:
+        await connection.run_sync(do_run_migrations)
+    await connectable.dispose()
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    asyncio.run(run_async_migrations())
@@ -0,0 +1,55 @@
+from typing import List, Optional, Sequence
+from alembic import context, op
+from sqlalchemy import text
+
+#index changes on large tables without blocking writes: CREATE/DROP INDEX CONCURRENTLY, outside the revision's transaction
+#a concurrent build that fails (e.g. a deadlock or a cancelled migration) leaves an INVALID index behind, it is dropped and rebuilt on the next run
+#a partitioned table can't be indexed concurrently as a whole, so each partition is built concurrently and attached to an index created ON ONLY the parent
+
+#relkind is a "char", which asyncpg returns as bytes, so it is selected as ::text before comparing
+def scalar(sql: str, **params):
+    return op.get_bind().execute(text(sql), params).scalar()
+
+def partitions(table: str) -> List[str]:
+    result = op.get_bind().execute(text("SELECT inhrelid::regclass::text FROM pg_inherits WHERE inhparent = to_regclass(:table) ORDER BY 1"), {"table": table})
+    return list(result.scalars())
+
+def index_definition(name: str, table: str, columns: Sequence[str], include: Optional[Sequence[str]], unique: bool, concurrently: bool, only: bool = False) -> str:
+    include_clause = f" INCLUDE ({', '.join(include)})" if include else ""
+    return (
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS {name} "
+        f"ON {'ONLY ' if only else ''}{table} ({', '.join(columns)}){include_clause}"
+    )
+
+#drop what a failed concurrent build left behind, returns True if a valid index of that name already exists
+def drop_if_invalid(name: str) -> bool:
+    valid = scalar("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:name)", name=name)
+    if valid is False:
+        op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    return bool(valid)
+
+def create_index_concurrently(name: str, table: str, columns: Sequence[str], include: Optional[Sequence[str]] = None, unique: bool = False) -> None:
+    with op.get_context().autocommit_block():
+        if context.is_offline_mode():
+            op.execute(index_definition(name, table, columns, include, unique, concurrently=True))
+            return
+        if scalar("SELECT relkind::text FROM pg_class WHERE oid = to_regclass(:table)", table=table) != "p":
+            if not drop_if_invalid(name):
+                op.execute(index_definition(name, table, columns, include, unique, concurrently=True))
+            return
+        #the parent index stays invalid until every partition's index is attached, then it becomes valid by itself
+        op.execute(index_definition(name, table, columns, include, unique, concurrently=False, only=True))
+        for partition in partitions(table):
+            partition_index = f"{partition}_{name}"[:63]
+            if not drop_if_invalid(partition_index):
+                op.execute(index_definition(partition_index, partition, columns, include, unique, concurrently=True))
+            if not scalar("SELECT EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(:index))", index=partition_index):
+                op.execute(f"ALTER INDEX {name} ATTACH PARTITION {partition_index}")
+
+def drop_index_concurrently(name: str) -> None:
+    with op.get_context().autocommit_block():
+        #an index of a partitioned table can only be dropped as a whole, which is quick but takes a short exclusive lock
+        if not context.is_offline_mode() and scalar("SELECT relkind::text FROM pg_class WHERE oid = to_regclass(:name)", name=name) == "I":
+            op.execute(f"DROP INDEX IF EXISTS {name}")
+            return
+        op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
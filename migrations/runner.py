@@ -0,0 +1,40 @@
+import os
+from pathlib import Path
+from typing import Optional
+from alembic import command
+from alembic.config import Config
+from alembic.script import ScriptDirectory
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+#MIGRATE_ON_STARTUP=0, the app refuses to start on a database behind head instead of migrating it, e.g. when a deploy step runs alembic upgrade head
+migrate_on_startup = os.getenv("MIGRATE_ON_STARTUP", "1") == "1"
+
+alembic_ini = Path(__file__).resolve().parent.parent / "alembic.ini"
+
+def alembic_config() -> Config:
+    config = Config(str(alembic_ini))
+    config.attributes["configure_logger"] = False
+    return config
+
+#read from the migration scripts, no database access
+def head_revision() -> Optional[str]:
+    return ScriptDirectory.from_config(alembic_config()).get_current_head()
+
+#None for a database that was never migrated
+async def current_revision(conn: AsyncConnection) -> Optional[str]:
+    if (await conn.execute(text("SELECT to_regclass('alembic_version')"))).scalar() is None:
+        return None
+    return (await conn.execute(text("SELECT version_num FROM alembic_version"))).scalar()
+
+#a database created before migrations existed has the baseline tables but no alembic_version
+async def unversioned_schema(conn: AsyncConnection) -> bool:
+    return (await conn.execute(text("SELECT to_regclass('users') IS NOT NULL"))).scalar()
+
+#blocking, alembic runs its own event loop, call these with asyncio.to_thread
+def upgrade_to_head() -> None:
+    command.upgrade(alembic_config(), "head")
+
+#records the baseline revision without running it, the later revisions are applied by upgrade_to_head
+def stamp_baseline() -> None:
+    command.stamp(alembic_config(), "0001")
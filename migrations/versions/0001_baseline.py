@@ -0,0 +1,78 @@
+"""baseline schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from models.models import transactions_partitioned, transactions_compact
+
+#the schema as init_models used to create it with Base.metadata.create_all, including the TRANSACTIONS_PARTITIONED / TRANSACTIONS_LAYOUT variants
+#a database created before migrations existed already has these tables, init_models stamps it with this revision instead of running it (migrations/runner.py)
+
+revision: str = "0001"
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table("users", sa.Column("id", sa.Integer(), primary_key=True, autoincrement=False))
+    op.create_index("ix_users_id", "users", ["id"])
+
+    op.create_table("products", sa.Column("id", sa.Integer(), primary_key=True, autoincrement=False))
+    op.create_index("ix_products_id", "products", ["id"])
+
+    columns = [] if transactions_compact else [sa.Column("id", sa.Integer(), primary_key=True, autoincrement=True)]
+    op.create_table(
+        "transactions",
+        *columns,
+        sa.Column("transaction_id", PG_UUID(as_uuid=True), nullable=False, primary_key=transactions_compact, unique=not (transactions_partitioned or transactions_compact)),
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="RESTRICT"), nullable=False),
+        sa.Column("product_id", sa.Integer(), sa.ForeignKey("products.id", ondelete="RESTRICT"), nullable=False),
+        sa.Column("timestamp", sa.DateTime(timezone=False), nullable=False, primary_key=transactions_partitioned),
+        sa.Column("transaction_amount", sa.Numeric(12, 2), nullable=False),
+        **({"postgresql_partition_by": "RANGE (timestamp)"} if transactions_partitioned else {}),
+    )
+    if not transactions_compact:
+        op.create_index("ix_transactions_user_id", "transactions", ["user_id"])
+        op.create_index("ix_transactions_product_id", "transactions", ["product_id"])
+        op.create_index("ix_transactions_timestamp", "transactions", ["timestamp"])
+    op.create_index("ix_transactions_user_ts", "transactions", ["user_id", "timestamp"], postgresql_include=["transaction_amount"] if transactions_compact else [])
+    op.create_index("ix_transactions_product_ts", "transactions", ["product_id", "timestamp"])
+
+    if transactions_partitioned:
+        op.execute("CREATE TABLE transactions_default PARTITION OF transactions DEFAULT")
+
+    op.create_table("transaction_keys", sa.Column("transaction_id", PG_UUID(as_uuid=True), primary_key=True))
+
+    op.create_table(
+        "user_daily_rollups",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="RESTRICT"), primary_key=True),
+        sa.Column("bucket", sa.DateTime(timezone=False), primary_key=True),
+        sa.Column("transaction_count", sa.BigInteger(), nullable=False),
+        sa.Column("amount_sum", sa.Numeric(20, 2), nullable=False),
+        sa.Column("amount_min", sa.Numeric(12, 2), nullable=False),
+        sa.Column("amount_max", sa.Numeric(12, 2), nullable=False),
+    )
+
+    op.create_table(
+        "upload_sessions",
+        sa.Column("id", PG_UUID(as_uuid=True), primary_key=True),
+        sa.Column("status", sa.String(16), nullable=False),
+        sa.Column("received_bytes", sa.BigInteger(), nullable=False),
+        sa.Column("next_line", sa.BigInteger(), nullable=False),
+        sa.Column("pending", sa.LargeBinary(), nullable=False),
+        sa.Column("staged_rows", sa.BigInteger(), nullable=False),
+        sa.Column("created_at", sa.DateTime(timezone=False), nullable=False, server_default=sa.func.now()),
+        sa.Column("updated_at", sa.DateTime(timezone=False), nullable=False, server_default=sa.func.now()),
+    )
+
+
+def downgrade() -> None:
+    for table in ["upload_sessions", "user_daily_rollups", "transaction_keys", "transactions", "products", "users"]:
+        op.drop_table(table)
@@ -0,0 +1,26 @@
+"""drop ix_users_id and ix_products_id, duplicates of the primary key indexes
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+from migrations.indexes import create_index_concurrently, drop_index_concurrently
+
+#User.id and Product.id were declared with index=True on top of primary_key=True, so every new id was written to two identical indexes
+
+revision: str = "0002"
+down_revision: Union[str, Sequence[str], None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    drop_index_concurrently("ix_users_id")
+    drop_index_concurrently("ix_products_id")
+
+
+def downgrade() -> None:
+    create_index_concurrently("ix_users_id", "users", ["id"])
+    create_index_concurrently("ix_products_id", "products", ["id"])
@@ -0,0 +1,44 @@
+"""user_amount_sketches and amount_sketches, for approx=true summaries, one row per month holding all its sketch bins
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17 00:00:00
+
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import ARRAY
+
+#filled from the existing transactions on the next startup with AMOUNT_SKETCHES=1, see services.sketches.backfill_sketches
+
+revision: str = "0003"
+down_revision: Union[str, Sequence[str], None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def sketch_columns(sum_precision: int) -> list:
+    return [
+        sa.Column("bucket", sa.DateTime(timezone=False), primary_key=True),
+        sa.Column("bins", ARRAY(sa.Integer()), nullable=False),
+        sa.Column("counts", ARRAY(sa.BigInteger()), nullable=False),
+        sa.Column("transaction_count", sa.BigInteger(), nullable=False),
+        sa.Column("amount_sum", sa.Numeric(sum_precision, 2), nullable=False),
+        sa.Column("amount_min", sa.Numeric(12, 2), nullable=False),
+        sa.Column("amount_max", sa.Numeric(12, 2), nullable=False),
+    ]
+
+
+def upgrade() -> None:
+    op.create_table(
+        "user_amount_sketches",
+        sa.Column("user_id", sa.Integer(), sa.ForeignKey("users.id", ondelete="RESTRICT"), primary_key=True),
+        *sketch_columns(20),
+    )
+    op.create_table("amount_sketches", *sketch_columns(24))
+
+
+def downgrade() -> None:
+    op.drop_table("amount_sketches")
+    op.drop_table("user_amount_sketches")
@@ -3,14 +3,26 @@ from datetime import datetime
 from decimal import Decimal
 # from ..database import Base
 from database import Base
-from sqlalchemy.dialects.postgresql import UUID as PG_UUID
-from sqlalchemy import Integer, Numeric, DateTime, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID, ARRAY
+from sqlalchemy import Integer, BigInteger, Numeric, DateTime, ForeignKey, Index, String, LargeBinary, func
 import uuid
+import os
+
+#TRANSACTIONS_PARTITIONED=1: transactions is range-partitioned by month on timestamp, see services/partitions.py
+#decided when the table is created, an existing table is not converted
+transactions_partitioned = os.getenv("TRANSACTIONS_PARTITIONED", "0") == "1"
+
+#TRANSACTIONS_LAYOUT=compact: transaction_id is the primary key instead of a serial id, and the single-column indexes covered by the composite ones are left out
+#less to write per row on ingest and a smaller table, migrate_transactions_layout.py converts an existing table
+transactions_layout = os.getenv("TRANSACTIONS_LAYOUT", "standard")
+if transactions_layout not in ("standard", "compact"):
+    raise ValueError(f"Unknown TRANSACTIONS_LAYOUT: {transactions_layout}")
+transactions_compact = transactions_layout == "compact"
 
 #Base is for database schema + ORM
 class User(Base):
     __tablename__ = "users"
-    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False, index=True)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
     #one user has many transactions, collection on the parent side
     transactions: Mapped[list["Transaction"]] = relationship(
         back_populates="user"
@@ -18,7 +30,7 @@ class User(Base):
 
 class Product(Base):
     __tablename__ = "products"
-    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False, index=True)
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=False)
     transactions: Mapped[list["Transaction"]] = relationship(
         back_populates="product"
     )
@@ -27,14 +39,18 @@ class Product(Base):
 class Transaction(Base):
     __tablename__ = "transactions"
 
-    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    if not transactions_compact:
+        id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
 
     #better to use uuid.UUID, rather than str, as it gives beter type safety, validation, and efficiency and ensure globally unique ID
     transaction_id: Mapped[uuid.UUID] = mapped_column(
         #postgreSQL UUID column type, and as_uuid=True, SqlAlchemy will automatically convert DB values into real Python uuid.UUID objects
         PG_UUID(as_uuid=True),
         default=uuid.uuid4,
-        unique=True,
+        #compact: the primary key, so the unique index is the primary key index
+        primary_key=transactions_compact,
+        #a unique index on a partitioned table must contain the partition key, so when partitioned uniqueness is enforced by transaction_keys instead
+        unique=not (transactions_partitioned or transactions_compact),
         #unique already creates index, no need for separate index
         # index=True,
         nullable=False,
@@ -43,19 +59,22 @@ class Transaction(Base):
     user_id: Mapped[int] = mapped_column(
         #to avoid accidental data loss, using with RESTRICT, instead of using Cascade
         ForeignKey("users.id", ondelete="RESTRICT"),
-        index=True,
+        #compact: ix_transactions_user_ts leads with user_id and serves the same lookups
+        index=not transactions_compact,
         nullable=False,
     )
     product_id: Mapped[int] = mapped_column(
         #to avoid accidental data loss, using with RESTRICT, instead of using Cascade
         ForeignKey("products.id", ondelete="RESTRICT"),
-        index=True,
+        index=not transactions_compact,
         nullable=False,
     )
 
     # timestamp: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True, nullable=False)
     #assuming assume timezone for now, since the csv data doesn't provide timezone info. If timezone info is provided in future, can change to timezone=True
-    timestamp: Mapped[datetime] = mapped_column(DateTime(timezone=False), index=True, nullable=False)
+    #part of the primary key when partitioned, the primary key must contain the partition key
+    #compact: no index of its own, windows without a user or product (top products) scan the table, or only the months they cover when partitioned
+    timestamp: Mapped[datetime] = mapped_column(DateTime(timezone=False), index=not transactions_compact, nullable=False, primary_key=transactions_partitioned)
     transaction_amount: Mapped[Decimal] = mapped_column(Numeric(12, 2), nullable=False)
 
     #on the child table (Transaction), the reference to its parent (user, product) is always a single object, not a list, so no need for list[], it's a scalar ref
@@ -66,7 +85,86 @@ class Transaction(Base):
     #     Index("ix_transactions_user_ts", "user_id", "timestamp"),
     # )
     #composite index on (user_id, timestamp) and (product_id, timestamp) to optimise queries filtering by user or product within a time range
+    #partitioned: every index is created on each monthly partition, and range queries on timestamp only visit the months they cover
+    #compact: transaction_amount is carried in ix_transactions_user_ts, so the summary edge scans are index-only once the table is vacuumed
     __table_args__ = (
-        Index("ix_transactions_user_ts", "user_id", "timestamp"),
+        Index("ix_transactions_user_ts", "user_id", "timestamp", postgresql_include=["transaction_amount"] if transactions_compact else []),
         Index("ix_transactions_product_ts", "product_id", "timestamp"),
+        {"postgresql_partition_by": "RANGE (timestamp)"} if transactions_partitioned else {},
+    )
+
+#every transaction_id ever inserted, only used when transactions is partitioned
+#uploads claim their ids here with INSERT ... ON CONFLICT DO NOTHING first and only insert the rows they claimed, so duplicates are still detected across all months
+class TransactionKey(Base):
+    __tablename__ = "transaction_keys"
+
+    transaction_id: Mapped[uuid.UUID] = mapped_column(PG_UUID(as_uuid=True), primary_key=True)
+
+#pre-aggregated stats per user per day, maintained incrementally by the upload path from the rows it actually inserted
+#the summary endpoint answers from whole days here, and only scans raw transactions for the partial days at the start/end edges
+class UserDailyRollup(Base):
+    __tablename__ = "user_daily_rollups"
+
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey("users.id", ondelete="RESTRICT"),
+        primary_key=True,
     )
+    #start of the day, date_trunc('day', timestamp), no timezone, same as Transaction.timestamp
+    bucket: Mapped[datetime] = mapped_column(DateTime(timezone=False), primary_key=True)
+    transaction_count: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    #wider than transaction_amount, a day of sums can exceed numeric(12, 2)
+    amount_sum: Mapped[Decimal] = mapped_column(Numeric(20, 2), nullable=False)
+    amount_min: Mapped[Decimal] = mapped_column(Numeric(12, 2), nullable=False)
+    amount_max: Mapped[Decimal] = mapped_column(Numeric(12, 2), nullable=False)
+
+#mergeable sketch of the amounts per user per month (see services/sketches.py), maintained by the upload path like the rollups
+#one row per sketch: its non-empty bins and their counts as two arrays in bin order, count/sum/min/max of a window are exact sums over its rows,
+#the bins give approximate percentiles, served by approx=true on /summary
+class UserAmountSketch(Base):
+    __tablename__ = "user_amount_sketches"
+
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey("users.id", ondelete="RESTRICT"),
+        primary_key=True,
+    )
+    #start of the month, date_trunc('month', timestamp)
+    bucket: Mapped[datetime] = mapped_column(DateTime(timezone=False), primary_key=True)
+    bins: Mapped[list[int]] = mapped_column(ARRAY(Integer), nullable=False)
+    counts: Mapped[list[int]] = mapped_column(ARRAY(BigInteger), nullable=False)
+    transaction_count: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    amount_sum: Mapped[Decimal] = mapped_column(Numeric(20, 2), nullable=False)
+    amount_min: Mapped[Decimal] = mapped_column(Numeric(12, 2), nullable=False)
+    amount_max: Mapped[Decimal] = mapped_column(Numeric(12, 2), nullable=False)
+
+#the same sketch over all users per month, so /summary/all?approx=true reads one row per month whatever the number of users and transactions
+class AmountSketch(Base):
+    __tablename__ = "amount_sketches"
+
+    bucket: Mapped[datetime] = mapped_column(DateTime(timezone=False), primary_key=True)
+    bins: Mapped[list[int]] = mapped_column(ARRAY(Integer), nullable=False)
+    counts: Mapped[list[int]] = mapped_column(ARRAY(BigInteger), nullable=False)
+    transaction_count: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    #a month of all users' amounts, wider than the per-user sums
+    amount_sum: Mapped[Decimal] = mapped_column(Numeric(24, 2), nullable=False)
+    amount_min: Mapped[Decimal] = mapped_column(Numeric(12, 2), nullable=False)
+    amount_max: Mapped[Decimal] = mapped_column(Numeric(12, 2), nullable=False)
+
+#resumable chunked upload, see services/upload_sessions.py
+#each acknowledged chunk is parsed and COPYed into the session's own staging table in the same transaction that moves received_bytes forward,
+#so after a failure the client resumes from received_bytes and nothing is staged twice
+class UploadSession(Base):
+    __tablename__ = "upload_sessions"
+
+    id: Mapped[uuid.UUID] = mapped_column(PG_UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    #open, committed
+    status: Mapped[str] = mapped_column(String(16), nullable=False, default="open")
+    #bytes of the file acknowledged so far, the next chunk must start here
+    received_bytes: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    #line number of the first line in pending, 1 until the header has been checked
+    next_line: Mapped[int] = mapped_column(BigInteger, nullable=False, default=1)
+    #trailing bytes of the last chunk that don't make a complete line yet
+    pending: Mapped[bytes] = mapped_column(LargeBinary, nullable=False, default=b"")
+    staged_rows: Mapped[int] = mapped_column(BigInteger, nullable=False, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=False), nullable=False, server_default=func.now())
+    updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=False), nullable=False, server_default=func.now())
+
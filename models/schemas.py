@@ -1,6 +1,6 @@
 from datetime import datetime
 from decimal import Decimal
-from typing import Optional
+from typing import Optional, List
 from pydantic import BaseModel, Field, ConfigDict, field_serializer
 from decimal import Decimal, ROUND_HALF_UP
 
@@ -21,6 +21,42 @@ class UploadData(BaseModel):
     duplicates_ignored: int = Field(ge=0)
 
 
+#state of a resumable upload session, offset is where the next chunk must start
+class UploadSessionStatus(BaseModel):
+    model_config = ConfigDict(from_attributes=True, extra="forbid")
+    upload_id: str
+    status: str
+    offset: int = Field(ge=0)
+    staged_rows: int = Field(ge=0)
+    created_at: datetime
+    updated_at: datetime
+
+
+#background import job, result is set once it has succeeded, error once it has failed
+class ImportJobStatus(BaseModel):
+    model_config = ConfigDict(from_attributes=True, extra="forbid")
+    job_id: str
+    status: str
+    mode: str
+    rows_parsed: int = Field(ge=0)
+    rows_written: int = Field(ge=0)
+    rows_inserted: int = Field(ge=0)
+    duplicates_ignored: int = Field(ge=0)
+    rows_per_second: float = Field(ge=0)
+    created_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    result: Optional[UploadData] = None
+    error: Optional[str] = None
+
+
+#amounts are returned as strings with exactly 2 decimal places
+def format_amount(value: Optional[Decimal]) -> Optional[str]:
+    if value is None:
+        return None
+    return format(value.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP), ".2f")
+
+
 class Summary(BaseModel):
     model_config = ConfigDict(from_attributes=True, extra="forbid")
     user_id: int
@@ -30,12 +66,145 @@ class Summary(BaseModel):
     mean: Optional[Decimal] = None
     maximum: Optional[Decimal] = None
     minimum: Optional[Decimal] = None
+    #approx=true only: percentiles of transaction_amount from the amount sketches, start_date/end_date are then widened to whole months
+    approximate: Optional[bool] = None
+    p50: Optional[Decimal] = None
+    p95: Optional[Decimal] = None
+    p99: Optional[Decimal] = None
 
-    @field_serializer("minimum", "maximum", "mean")
+    @field_serializer("minimum", "maximum", "mean", "p50", "p95", "p99")
+    def serialize_decimal(self, value: Optional[Decimal]) -> Optional[str]:
+        return format_amount(value)
+
+#all users at once, GET /summary/all
+class OverallSummary(BaseModel):
+    model_config = ConfigDict(from_attributes=True, extra="forbid")
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    transaction_count: int
+    mean: Optional[Decimal] = None
+    maximum: Optional[Decimal] = None
+    minimum: Optional[Decimal] = None
+    approximate: Optional[bool] = None
+    p50: Optional[Decimal] = None
+    p95: Optional[Decimal] = None
+    p99: Optional[Decimal] = None
+
+    @field_serializer("minimum", "maximum", "mean", "p50", "p95", "p99")
     def serialize_decimal(self, value: Optional[Decimal]) -> Optional[str]:
-        if value is None:
-            return None
-        return format(value.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP), ".2f")
+        return format_amount(value)
     
+class SummaryBatchRequest(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    #capped so one request can't turn into an unbounded scan
+    user_ids: List[int] = Field(min_length=1, max_length=1000)
+    #same formats as the start/end query params of GET /summary/{user_id}, end is exclusive
+    start: Optional[str] = None
+    end: Optional[str] = None
+    #served from the amount sketches, with percentiles, see GET /summary/{user_id}
+    approx: bool = False
+
+
+class SummaryBatch(BaseModel):
+    model_config = ConfigDict(from_attributes=True, extra="forbid")
+    #in request order, one per user with data
+    summaries: List[Summary]
+    #users with no data for the given filters, instead of failing the whole request with a 404
+    missing_user_ids: List[int]
+
+class SeriesBucket(BaseModel):
+    model_config = ConfigDict(from_attributes=True, extra="forbid")
+    #start of the day/week/month, the first and last buckets only cover the part inside start/end
+    bucket_start: datetime
+    transaction_count: int
+    mean: Optional[Decimal] = None
+    maximum: Optional[Decimal] = None
+    minimum: Optional[Decimal] = None
+
+    @field_serializer("minimum", "maximum", "mean")
+    def serialize_decimal(self, value: Optional[Decimal]) -> Optional[str]:
+        return format_amount(value)
+
+
+class SummarySeries(BaseModel):
+    model_config = ConfigDict(from_attributes=True, extra="forbid")
+    user_id: int
+    interval: str
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    #only periods with transactions, in time order
+    buckets: List[SeriesBucket]
+
+class ProductSummary(BaseModel):
+    model_config = ConfigDict(from_attributes=True, extra="forbid")
+    product_id: int
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    transaction_count: int
+    mean: Optional[Decimal] = None
+    maximum: Optional[Decimal] = None
+    minimum: Optional[Decimal] = None
+
+    @field_serializer("minimum", "maximum", "mean")
+    def serialize_decimal(self, value: Optional[Decimal]) -> Optional[str]:
+        return format_amount(value)
+
+
+class ProductRanking(BaseModel):
+    model_config = ConfigDict(from_attributes=True, extra="forbid")
+    product_id: int
+    transaction_count: int
+    revenue: Decimal
+
+    @field_serializer("revenue")
+    def serialize_decimal(self, value: Decimal) -> Optional[str]:
+        return format_amount(value)
+
+
+class TopProducts(BaseModel):
+    model_config = ConfigDict(from_attributes=True, extra="forbid")
+    by: str
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    #best first
+    products: List[ProductRanking]
+
+class TransactionItem(BaseModel):
+    model_config = ConfigDict(from_attributes=True, extra="forbid")
+    transaction_id: str
+    product_id: int
+    timestamp: datetime
+    transaction_amount: Decimal
+
+    @field_serializer("transaction_amount")
+    def serialize_decimal(self, value: Decimal) -> Optional[str]:
+        return format_amount(value)
+
+
+class TransactionPage(BaseModel):
+    model_config = ConfigDict(from_attributes=True, extra="forbid")
+    user_id: int
+    start_date: Optional[datetime] = None
+    end_date: Optional[datetime] = None
+    #oldest first
+    transactions: List[TransactionItem]
+    #pass as `after` to get the next page, missing on the last page
+    next_cursor: Optional[str] = None
+
+#a statement that went over SLOW_QUERY_MS, parameters are reduced to their types
+class SlowQueryEntry(BaseModel):
+    model_config = ConfigDict(from_attributes=True, extra="forbid")
+    id: int
+    captured_at: datetime
+    duration_ms: float
+    statement: str
+    parameters: List[str]
+    executemany: bool
+    #pending, analyzed (EXPLAIN ANALYZE, BUFFERS), explained (plan only, the statement writes), skipped or failed
+    plan_status: str
+    plan: Optional[str] = None
+    indexes: List[str]
+    plan_error: Optional[str] = None
+
 class ErrorResponse(BaseModel):
     detail: str
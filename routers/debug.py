@@ -0,0 +1,21 @@
+from typing import List
+from fastapi import APIRouter, HTTPException, Query
+from models.schemas import SlowQueryEntry, ErrorResponse
+from services.slow_queries import slow_queries_enabled, slow_query_log
+
+router = APIRouter()
+
+def check_enabled() -> None:
+    if not slow_queries_enabled:
+        raise HTTPException(status_code=404, detail="Slow query capture is disabled, set SLOW_QUERY_MS")
+
+#newest first, from this worker's ring buffer
+@router.get("/slow-queries", response_model=List[SlowQueryEntry], responses={404: {"model": ErrorResponse}})
+async def get_slow_queries(limit: int = Query(50, ge=1, le=1000)):
+    check_enabled()
+    return [SlowQueryEntry.model_validate(entry) for entry in slow_query_log.list(limit)]
+
+@router.delete("/slow-queries", status_code=204, responses={404: {"model": ErrorResponse}})
+async def clear_slow_queries():
+    check_enabled()
+    slow_query_log.clear()
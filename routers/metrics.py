@@ -0,0 +1,12 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+from services.metrics import metrics_enabled, render
+
+router = APIRouter()
+
+#Prometheus scrape target, METRICS_ENABLED=1
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=metrics_enabled)
+async def get_metrics():
+    if not metrics_enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled, set METRICS_ENABLED=1")
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4; charset=utf-8")
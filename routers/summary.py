@@ -1,11 +1,12 @@
 from datetime import datetime, date, time
-from typing import Optional
+from typing import Optional, Dict, Any, Literal
 from fastapi import APIRouter, HTTPException, Depends, Query
-from sqlalchemy import select, func
 from sqlalchemy.ext.asyncio import AsyncSession
-from database import get_session
-from models.models import Transaction
-from models.schemas import Summary
+from database import get_read_session
+from models.schemas import Summary, SummaryBatch, SummaryBatchRequest, SummarySeries, SeriesBucket, ProductSummary, ProductRanking, TopProducts, OverallSummary
+from services.summary_services import fetch_summary, fetch_batch_summary, fetch_series, fetch_product_summary, fetch_top_products, fetch_overall_summary
+from services.sketches import amount_sketches_enabled, approx_window, fetch_approx_summary, fetch_approx_batch_summary, fetch_approx_overall_summary
+from services.summary_cache import get_summary_cache
 
 router = APIRouter()
 
@@ -37,6 +38,105 @@ def parse_datetime(date_raw: str | datetime | date | None) -> Optional[datetime]
 
     raise HTTPException(status_code=422, detail="Invalid datetime input. Example formats: '2023-10-05' (date only),'2023-10-05T00:00:00' (date and time), a space instead of 'T' is also accepted. End date is exclusive")
 
+#check both dates and their order, shared by the summary endpoints
+def parse_window(start: Optional[str], end: Optional[str]) -> tuple[Optional[datetime], Optional[datetime]]:
+    parsed_start = parse_datetime(start)
+    parsed_end = parse_datetime(end)
+
+    #check validity of dates
+    if parsed_start and parsed_end and not (parsed_start < parsed_end):
+        raise HTTPException(status_code=422, detail="`end` must be greater than `start`")
+    return parsed_start, parsed_end
+
+approx_description = (
+    "Answer from the amount sketches: count/min/max/mean of the whole months the window touches, "
+    "plus approximate p50/p95/p99 of transaction_amount (within 1%).")
+
+#approx=true is refused when the upload path isn't maintaining the sketches
+def require_sketches() -> None:
+    if not amount_sketches_enabled:
+        raise HTTPException(status_code=400, detail="approx=true is not available, amount sketches are disabled (set AMOUNT_SKETCHES=1)")
+
+#hit/miss/eviction counters of this worker's summary cache
+@router.get("/cache/stats", response_model=Dict[str, Any])
+async def get_summary_cache_stats():
+    return get_summary_cache().stats()
+
+#many users, one shared window, one grouped query instead of one request per user
+#registered before /{user_id} so the paths can never be confused
+@router.post("/batch", response_model=SummaryBatch, response_model_exclude_none=True)
+async def get_summary_batch(
+    request: SummaryBatchRequest,
+    session: AsyncSession = Depends(get_read_session),
+):
+    parsed_start, parsed_end = parse_window(request.start, request.end)
+
+    #keep request order, drop repeats
+    user_ids = list(dict.fromkeys(request.user_ids))
+    if request.approx:
+        require_sketches()
+        results = await fetch_approx_batch_summary(session, user_ids, parsed_start, parsed_end)
+        parsed_start, parsed_end = approx_window(parsed_start, parsed_end)
+    else:
+        results = await fetch_batch_summary(session, user_ids, parsed_start, parsed_end)
+
+    summaries = []
+    missing_user_ids = []
+    for user_id in user_ids:
+        if user_id not in results:
+            missing_user_ids.append(user_id)
+            continue
+        total, min_amount, max_amount, mean_amount, *approximate = results[user_id]
+        summaries.append(Summary(
+            user_id=user_id,
+            start_date=parsed_start,
+            end_date=parsed_end,
+            transaction_count=total,
+            mean=mean_amount,
+            maximum=max_amount,
+            minimum=min_amount,
+            **({"approximate": True, **approximate[0]} if approximate else {}),
+        ))
+    return SummaryBatch(summaries=summaries, missing_user_ids=missing_user_ids)
+
+#all users at once, approx=true reads one sketch per month however many users and transactions there are
+#registered before /{user_id} so the paths can never be confused
+@router.get("/all", response_model=OverallSummary, response_model_exclude_none=True)
+async def get_overall_summary(
+    start: Optional[str] = Query(None, description=(
+    "ISO date or datetime. Examples: '2023-10-05' (date only),"
+    "'2023-10-05T00:00:00' (date and time). "
+    "A space instead of 'T' is also accepted.")),
+    end: Optional[str]   = Query(None, description=(
+    "ISO date or datetime. Examples: '2023-10-05' (date only),"
+    "'2023-10-05T00:00:00' (date and time)."
+    "A space instead of 'T' is also accepted. End is exclusive.")),
+    approx: bool = Query(False, description=approx_description),
+    session: AsyncSession = Depends(get_read_session),
+):
+    parsed_start, parsed_end = parse_window(start, end)
+
+    if approx:
+        require_sketches()
+        total, min_amount, max_amount, mean_amount, percentiles = await fetch_approx_overall_summary(session, parsed_start, parsed_end)
+        parsed_start, parsed_end = approx_window(parsed_start, parsed_end)
+    else:
+        total, min_amount, max_amount, mean_amount = await fetch_overall_summary(session, parsed_start, parsed_end)
+        percentiles = None
+
+    if total == 0:
+        raise HTTPException(status_code=404, detail="No data for given filters")
+
+    return OverallSummary(
+        start_date=parsed_start,
+        end_date=parsed_end,
+        transaction_count=total,
+        mean=mean_amount,
+        maximum=max_amount,
+        minimum=min_amount,
+        **({"approximate": True, **percentiles} if percentiles is not None else {}),
+    )
+
 #added response_model_exclude_none=True so null fields are not ommited
 @router.get("/{user_id}", response_model=Summary, response_model_exclude_none=True)
 async def get_summary(
@@ -49,43 +149,92 @@ async def get_summary(
     "ISO date or datetime. Examples: '2023-10-05' (date only),"
     "'2023-10-05T00:00:00' (date and time)."
     "A space instead of 'T' is also accepted. End is exclusive.")),
-    session: AsyncSession = Depends(get_session),
+    approx: bool = Query(False, description=approx_description),
+    session: AsyncSession = Depends(get_read_session),
 ):
 
-    parsed_start = parse_datetime(start)
-    parsed_end = parse_datetime(end)
+    parsed_start, parsed_end = parse_window(start, end)
 
-    #check validity of dates
-    if parsed_start and parsed_end and not (parsed_start < parsed_end):
-        raise HTTPException(status_code=422, detail="`end` must be greater than `start`")
-    
-    #build the conditions for query filter
-    conditions = [Transaction.user_id == user_id]
-    if parsed_start:
-        conditions.append(Transaction.timestamp >= parsed_start)
-    if parsed_end:
-        conditions.append(Transaction.timestamp < parsed_end)
+    if approx:
+        #whole months from the user's amount sketches, one row per month whatever the number of transactions
+        require_sketches()
+        total, min_amount, max_amount, mean_amount, percentiles = await fetch_approx_summary(session, user_id, parsed_start, parsed_end)
+        parsed_start, parsed_end = approx_window(parsed_start, parsed_end)
+    else:
+        #whole days come from the user_daily_rollups, only the partial days at the start/end edges are scanned from transactions
+        total, min_amount, max_amount, mean_amount = await fetch_summary(session, user_id, parsed_start, parsed_end)
+        percentiles = None
 
-    sql = select(
-        #SELECT COUNT(*) AS total FROM transactions; Knows it's transactions because of conditions = [Transaction.user_id == user_id]
-        func.count().label("total"),
+    if total == 0:
+        raise HTTPException(status_code=404, detail="No data for given filters")
 
-        func.min(Transaction.transaction_amount).label("min_amount"),
-        func.max(Transaction.transaction_amount).label("max_amount"),
-        func.avg(Transaction.transaction_amount).label("mean_amount"),
-    ).where(*conditions)
+    return Summary(
+        user_id=user_id,
+        start_date=parsed_start,
+        end_date=parsed_end,
+        transaction_count=total,
+        mean=mean_amount,
+        maximum=max_amount,
+        minimum=min_amount,
+        **({"approximate": True, **percentiles} if percentiles is not None else {}),
+    )
 
-    #result object
-    result = await session.execute(sql)
+#trend per day/week/month in one grouped query, instead of one /summary call per bucket
+@router.get("/{user_id}/series", response_model=SummarySeries, response_model_exclude_none=True)
+async def get_summary_series(
+    user_id: int,
+    interval: Literal["day", "week", "month"] = Query("day", description="Bucket size. Weeks start on Monday."),
+    start: Optional[str] = Query(None, description=(
+    "ISO date or datetime. Examples: '2023-10-05' (date only),"
+    "'2023-10-05T00:00:00' (date and time). "
+    "A space instead of 'T' is also accepted.")),
+    end: Optional[str]   = Query(None, description=(
+    "ISO date or datetime. Examples: '2023-10-05' (date only),"
+    "'2023-10-05T00:00:00' (date and time)."
+    "A space instead of 'T' is also accepted. End is exclusive.")),
+    session: AsyncSession = Depends(get_read_session),
+):
+    parsed_start, parsed_end = parse_window(start, end)
 
-    #return only one row (should only be one row) and if not, then crash
-    total, min_amount, max_amount, mean_amount = result.one()
+    rows = await fetch_series(session, user_id, interval, parsed_start, parsed_end)
 
-    if total == 0:
+    if not rows:
         raise HTTPException(status_code=404, detail="No data for given filters")
 
-    return Summary(
+    return SummarySeries(
         user_id=user_id,
+        interval=interval,
+        start_date=parsed_start,
+        end_date=parsed_end,
+        buckets=[
+            SeriesBucket(bucket_start=period, transaction_count=total, mean=mean_amount, maximum=max_amount, minimum=min_amount)
+            for period, total, min_amount, max_amount, mean_amount in rows
+        ],
+    )
+
+#same statistics as /summary/{user_id}, per product, served by ix_transactions_product_ts
+@router.get("/product/{product_id}", response_model=ProductSummary, response_model_exclude_none=True)
+async def get_product_summary(
+    product_id: int,
+    start: Optional[str] = Query(None, description=(
+    "ISO date or datetime. Examples: '2023-10-05' (date only),"
+    "'2023-10-05T00:00:00' (date and time). "
+    "A space instead of 'T' is also accepted.")),
+    end: Optional[str]   = Query(None, description=(
+    "ISO date or datetime. Examples: '2023-10-05' (date only),"
+    "'2023-10-05T00:00:00' (date and time)."
+    "A space instead of 'T' is also accepted. End is exclusive.")),
+    session: AsyncSession = Depends(get_read_session),
+):
+    parsed_start, parsed_end = parse_window(start, end)
+
+    total, min_amount, max_amount, mean_amount = await fetch_product_summary(session, product_id, parsed_start, parsed_end)
+
+    if total == 0:
+        raise HTTPException(status_code=404, detail="No data for given filters")
+
+    return ProductSummary(
+        product_id=product_id,
         start_date=parsed_start,
         end_date=parsed_end,
         transaction_count=total,
@@ -94,7 +243,29 @@ async def get_summary(
         minimum=min_amount,
     )
 
+#top N products in a window, ranked and limited in the DB
+@router.get("/products/top", response_model=TopProducts, response_model_exclude_none=True)
+async def get_top_products(
+    by: Literal["revenue", "count"] = Query("revenue", description="Rank by total transaction_amount or by number of transactions"),
+    limit: int = Query(10, ge=1, le=100),
+    start: Optional[str] = Query(None, description=(
+    "ISO date or datetime. Examples: '2023-10-05' (date only),"
+    "'2023-10-05T00:00:00' (date and time). "
+    "A space instead of 'T' is also accepted.")),
+    end: Optional[str]   = Query(None, description=(
+    "ISO date or datetime. Examples: '2023-10-05' (date only),"
+    "'2023-10-05T00:00:00' (date and time)."
+    "A space instead of 'T' is also accepted. End is exclusive.")),
+    session: AsyncSession = Depends(get_read_session),
+):
+    parsed_start, parsed_end = parse_window(start, end)
 
+    rows = await fetch_top_products(session, by, limit, parsed_start, parsed_end)
 
-
+    return TopProducts(
+        by=by,
+        start_date=parsed_start,
+        end_date=parsed_end,
+        products=[ProductRanking(product_id=product_id, transaction_count=total, revenue=revenue) for product_id, total, revenue in rows],
+    )
 
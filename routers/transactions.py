@@ -0,0 +1,67 @@
+from typing import Optional, Literal
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_read_session
+from models.schemas import TransactionPage, TransactionItem
+from routers.summary import parse_window
+from services.export import check_export_format, stream_export, media_types
+from services.transaction_services import fetch_transaction_page
+
+router = APIRouter()
+
+#one page of a user's transactions, oldest first, keyset-paginated so deep pages cost the same as the first
+@router.get("", response_model=TransactionPage, response_model_exclude_none=True)
+async def list_transactions(
+    user_id: int = Query(...),
+    after: Optional[str] = Query(None, description="next_cursor of the previous page"),
+    limit: int = Query(100, ge=1, le=1000),
+    start: Optional[str] = Query(None, description=(
+    "ISO date or datetime. Examples: '2023-10-05' (date only),"
+    "'2023-10-05T00:00:00' (date and time). "
+    "A space instead of 'T' is also accepted.")),
+    end: Optional[str]   = Query(None, description=(
+    "ISO date or datetime. Examples: '2023-10-05' (date only),"
+    "'2023-10-05T00:00:00' (date and time)."
+    "A space instead of 'T' is also accepted. End is exclusive.")),
+    session: AsyncSession = Depends(get_read_session),
+):
+    parsed_start, parsed_end = parse_window(start, end)
+
+    rows, next_cursor = await fetch_transaction_page(session, user_id, after, limit, parsed_start, parsed_end)
+
+    return TransactionPage(
+        user_id=user_id,
+        start_date=parsed_start,
+        end_date=parsed_end,
+        transactions=[
+            TransactionItem(transaction_id=str(row.transaction_id), product_id=row.product_id, timestamp=row.timestamp, transaction_amount=row.transaction_amount)
+            for row in rows
+        ],
+        next_cursor=next_cursor,
+    )
+
+#raw transactions, streamed in constant memory, the result set is never held in the app
+#the request's session is closed before the body is sent, so the export opens its own connection for as long as it streams
+@router.get("/export")
+async def export_transactions(
+    user_id: Optional[int] = Query(None),
+    product_id: Optional[int] = Query(None),
+    start: Optional[str] = Query(None, description=(
+    "ISO date or datetime. Examples: '2023-10-05' (date only),"
+    "'2023-10-05T00:00:00' (date and time). "
+    "A space instead of 'T' is also accepted.")),
+    end: Optional[str]   = Query(None, description=(
+    "ISO date or datetime. Examples: '2023-10-05' (date only),"
+    "'2023-10-05T00:00:00' (date and time)."
+    "A space instead of 'T' is also accepted. End is exclusive.")),
+    format: Literal["csv", "ndjson", "parquet"] = Query("csv", description="csv (COPY ... TO STDOUT), ndjson or parquet, all can be uploaded again as is"),
+):
+    parsed_start, parsed_end = parse_window(start, end)
+    check_export_format(format)
+
+    return StreamingResponse(
+        stream_export(format, user_id, product_id, parsed_start, parsed_end),
+        media_type=media_types[format],
+        headers={"Content-Disposition": f'attachment; filename="transactions.{format}"'},
+    )
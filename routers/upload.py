@@ -1,113 +1,133 @@
-import csv
-import io
-from typing import List, Dict, Any, Set
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
+import uuid
+from typing import Literal
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Query, Response, Request
+from fastapi.responses import JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
 from database import get_session
-from models.schemas import UploadData, ErrorResponse
-from services.upload_services import (
-    transform_row,
-    upsert_users,
-    upsert_products,
-    insert_transactions,
+from models.models import UploadSession
+from models.schemas import UploadData, UploadSessionStatus, ImportJobStatus, ErrorResponse
+from services.ingest import ingest_csv, max_shards
+from services.jobs import ImportJob, import_jobs, spool_upload
+from services.compression import check_upload_filename, open_upload
+from services.columnar import columnar_format
+from services.metrics import observe_upload
+from services.upload_sessions import (
+    upload_session_max_chunk_bytes,
+    create_upload_session,
+    get_upload_session,
+    append_upload_chunk,
+    commit_upload_session,
+    abort_upload_session,
 )
 
-#creates a router object so that can define endpoints 
+#creates a router object so that can define endpoints
 router = APIRouter()
 
-headers = ["transaction_id", "user_id", "product_id", "timestamp", "transaction_amount"]
-
-#number of rows to insert in one batch, for faster performance, for each insert operation
-batch_size = 2000
-    
-@router.post("/", response_model=UploadData, responses={400: {"model": ErrorResponse}})
+def job_status(job: ImportJob) -> ImportJobStatus:
+    return ImportJobStatus(
+        job_id=job.id,
+        status=job.status,
+        mode=job.mode,
+        rows_parsed=job.progress.rows_parsed,
+        rows_written=job.progress.rows_written,
+        rows_inserted=job.progress.rows_inserted,
+        duplicates_ignored=job.progress.duplicates_ignored,
+        rows_per_second=round(job.rows_per_second(), 1),
+        created_at=job.created_at,
+        started_at=job.started_at,
+        finished_at=job.finished_at,
+        result=job.result,
+        error=job.error,
+    )
+
+@router.post("/", response_model=UploadData, responses={202: {"model": ImportJobStatus}, 400: {"model": ErrorResponse}})
 async def upload_data(
+    #Response lets us set headers on the response FastAPI builds from the returned model
+    response: Response,
     #file is param name, UploadFile type hint to tell gastAPI is an uploaded file
     #File(...) tells FastAPI the source that this comes from a file upload in the request body
     #if didn’t use File(...), would have to manually dig the file out of the request body. FastAPI does that for us, acts as a marker
     file: UploadFile=File(...),
+    #insert: multi-row INSERT per batch, copy: binary COPY into a staging table, merged once at the end
+    #sharded: like copy, but split by transaction_id hash and COPYed concurrently on several connections, for very large files
+    mode: Literal["insert", "copy", "sharded"] = Query("insert", description="Ingest mode: 'insert' (batched INSERT), 'copy' (binary COPY into a staging table, then set-based merge) or 'sharded' (parallel COPY on several connections, published in one transaction)"),
+    shards: int = Query(4, ge=1, le=max_shards, description="Number of parallel connections for mode=sharded"),
+    #async is a keyword in python, hence the alias
+    run_async: bool = Query(False, alias="async", description="Return a job id straight away and import in the background, poll GET /upload/jobs/{job_id}"),
     #Depends(get_session) means before calling this endpoint, run get_session() and pass its return value in here
     session: AsyncSession = Depends(get_session),
 ):
-    if not file.filename.lower().endswith(".csv"):
-        raise HTTPException(status_code=400, detail="Only CSV files are supported")
-    
-
-    #wrap uploaded file for csv.DictReader, which expects a text stream
-    try:
-        #file.file is the underlying raw file object or binary stream
-        #TextIOWrapper wraps a binary stream (bytes) and turns it into a text stream (str)
-        text = io.TextIOWrapper(file.file, encoding="utf-8", newline="")
-        reader = csv.DictReader(text)
-    except Exception as error:
-        raise HTTPException(status_code=400, detail=f"Unable to read CSV. {error}")
-
-
-    #check the header
-    if reader.fieldnames is None:
-        raise HTTPException(status_code=400, detail="Missing CSV header")
-    
-    normalised_headers = [header.strip().lower() for header in reader.fieldnames]
-
-    if normalised_headers != headers:
-        raise HTTPException(status_code=400, detail=f"Invalid CSV header. Expected: {headers}, got: {normalised_headers}")
-
-    rows_inserted: int = 0
-    users_upserted: int = 0
-    duplicates_ignored: int = 0
-    products_upserted: int = 0
-    
-   #batch sets
-    user_ids_batch: Set[int] = set()
-    product_ids_batch: Set[int] = set()
-    transactions_batch: List[Dict[str, Any]] = []
-
-    async with session.begin():
-        for row in reader:
-            try:
-                transformed_row = transform_row(row)
-            except HTTPException as e:
-                raise HTTPException(status_code=400, detail=f"Error in row {reader.line_num}: {e.detail}")
-
-            user_ids_batch.add(transformed_row["user_id"])
-            product_ids_batch.add(transformed_row["product_id"])
-            transactions_batch.append(transformed_row)
-
-            if len(transactions_batch) >= batch_size:
-
-                #insert or update users, products and transactions in batches
-
-                users_upserted += await upsert_users(session, user_ids_batch)
-                products_upserted += await upsert_products(session, product_ids_batch)
-                #don't upsert transacitons, need to record duplicates ignored
-                inserted, duplicates = await insert_transactions(session, transactions_batch)
-                rows_inserted += inserted
-                duplicates_ignored += duplicates
-
-                user_ids_batch.clear()
-                product_ids_batch.clear()
-                transactions_batch.clear()
-
-        #insert any remaining rows in the last batch
-        if transactions_batch:
-            users_upserted += await upsert_users(session, user_ids_batch)
-            products_upserted += await upsert_products(session, product_ids_batch)
-            inserted, duplicates = await insert_transactions(session, transactions_batch)
-            rows_inserted += inserted
-            duplicates_ignored += duplicates
-
-        row_count = rows_inserted + duplicates_ignored
-        
-        #return uploade results based on schema
-        return UploadData(
-            row_count=row_count,
-            user_count=users_upserted,
-            product_count=products_upserted,
-            transaction_count=rows_inserted,
-            duplicates_ignored=duplicates_ignored,
-        )
-                    
-
-    
+    #.csv, or .csv.gz / .csv.zst decompressed on the fly, or Parquet/Arrow read as typed columns
+    check_upload_filename(file.filename)
+    format = columnar_format(file.filename) or "csv"
+
+    if run_async:
+        #spooled still compressed, the job decompresses as it reads
+        job = import_jobs.submit(await spool_upload(file.file), file.filename, mode, shards)
+        return JSONResponse(status_code=202, content=job_status(job).model_dump(mode="json"))
+
+    #file.file is the underlying raw binary stream, parsed in a worker thread while the previous chunk is written
+    result, timings = await ingest_csv(session, open_upload(file.filename, file.file), mode, shards=shards, format=format)
+
+    #per-stage timings of the pipeline, visible in browser dev tools and curl -i
+    response.headers["Server-Timing"] = timings.server_timing()
+    #the same timings and row counts into the /metrics histograms
+    observe_upload(mode, format, timings, result)
+    return result
+
+#progress of a background import, result holds the UploadData once it has succeeded
+@router.get("/jobs/{job_id}", response_model=ImportJobStatus, responses={404: {"model": ErrorResponse}})
+async def get_job(job_id: str):
+    job = import_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Import job not found")
+    return job_status(job)
+
+def session_status(upload: UploadSession) -> UploadSessionStatus:
+    return UploadSessionStatus(
+        upload_id=str(upload.id),
+        status=upload.status,
+        offset=upload.received_bytes,
+        staged_rows=upload.staged_rows,
+        created_at=upload.created_at,
+        updated_at=upload.updated_at,
+    )
+
+#resumable upload for very large files: create a session, PUT the file in consecutive byte ranges, then commit
+#each chunk is parsed and staged as it arrives, the body is read straight from the request, nothing is spooled to disk
+@router.post("/sessions", response_model=UploadSessionStatus, status_code=201)
+async def create_session(session: AsyncSession = Depends(get_session)):
+    upload = await create_upload_session(session)
+    return session_status(await get_upload_session(session, upload.id))
+
+#where to resume from after an interrupted PUT
+@router.get("/sessions/{upload_id}", response_model=UploadSessionStatus, responses={404: {"model": ErrorResponse}})
+async def get_session_status(upload_id: uuid.UUID, session: AsyncSession = Depends(get_session)):
+    return session_status(await get_upload_session(session, upload_id))
+
+#raw CSV bytes in the body, offset must equal the session's current offset, otherwise 409
+@router.put("/sessions/{upload_id}", response_model=UploadSessionStatus, responses={400: {"model": ErrorResponse}, 404: {"model": ErrorResponse}, 409: {"model": ErrorResponse}, 413: {"model": ErrorResponse}})
+async def put_session_chunk(
+    upload_id: uuid.UUID,
+    request: Request,
+    offset: int = Query(..., ge=0, description="Byte offset of this chunk in the file"),
+    session: AsyncSession = Depends(get_session),
+):
+    data = bytearray()
+    async for part in request.stream():
+        data += part
+        if len(data) > upload_session_max_chunk_bytes:
+            raise HTTPException(status_code=413, detail=f"Chunk larger than {upload_session_max_chunk_bytes} bytes")
+    upload = await append_upload_chunk(session, upload_id, offset, bytes(data))
+    return session_status(upload)
+
+#publish everything staged so far in one transaction, same result shape as a single upload
+@router.post("/sessions/{upload_id}/commit", response_model=UploadData, responses={400: {"model": ErrorResponse}, 404: {"model": ErrorResponse}, 409: {"model": ErrorResponse}})
+async def commit_session(upload_id: uuid.UUID, session: AsyncSession = Depends(get_session)):
+    return await commit_upload_session(session, upload_id)
+
+@router.delete("/sessions/{upload_id}", status_code=204, responses={404: {"model": ErrorResponse}, 409: {"model": ErrorResponse}})
+async def abort_session(upload_id: uuid.UUID, session: AsyncSession = Depends(get_session)):
+    await abort_upload_session(session, upload_id)
+    return Response(status_code=204)
 
-               
\ No newline at end of file
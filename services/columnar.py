@@ -0,0 +1,188 @@
+import os
+import uuid
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+import numpy as np
+from fastapi import HTTPException
+from services.csv_parser import ParsedBatch, headers, int32_max, parse_uuids, parse_ints, parse_timestamps, parse_amounts, parse_row_slow
+
+#Parquet and Arrow IPC uploads: read in record batches and turned into the same ParsedBatch the CSV parser produces, straight from the typed columns
+#expected types: transaction_id uuid / fixed_size_binary(16), user_id and product_id integers, timestamp a timestamp or date, transaction_amount decimal, integer or float
+#string columns are accepted too and go through the CSV parser's vectorised field parsers, so the same values are accepted with the same error messages
+#pyarrow is pinned in requirements.txt, without it (e.g. a trimmed local install) only these uploads are refused
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+#filename suffix -> format
+columnar_suffixes = {".parquet": "parquet", ".arrow": "arrow", ".ipc": "arrow"}
+
+#rows per record batch read from a Parquet file, Arrow files keep the batches they were written with
+record_batch_rows = int(os.getenv("COLUMNAR_BATCH_ROWS", "65536"))
+
+def columnar_format(filename: str) -> Optional[str]:
+    name = (filename or "").lower()
+    for suffix, format in columnar_suffixes.items():
+        if name.endswith(suffix):
+            return format
+    return None
+
+#column names of the file and an iterator over its record batches, runs in a worker thread
+def open_record_batches(stream: BinaryIO, format: str) -> Tuple[List[str], Iterator["pa.RecordBatch"]]:
+    if pa is None:
+        raise HTTPException(status_code=400, detail="Parquet/Arrow uploads need the pyarrow package installed on the server")
+    try:
+        if format == "parquet":
+            parquet_file = pq.ParquetFile(stream)
+            return parquet_file.schema_arrow.names, parquet_file.iter_batches(batch_size=record_batch_rows)
+        try:
+            reader = ipc.open_file(stream)
+            return reader.schema.names, (reader.get_batch(i) for i in range(reader.num_record_batches))
+        except pa.ArrowInvalid:
+            #not the random access format, try the streaming one
+            stream.seek(0)
+            reader = ipc.open_stream(stream)
+            return reader.schema.names, iter(reader)
+    except (pa.ArrowException, OSError) as error:
+        raise HTTPException(status_code=400, detail=f"Unable to read {format} file. {error}")
+
+#same rule as the CSV header: the five columns, in order, compared after strip + lower
+def check_columns(names: List[str]) -> None:
+    normalised_names = [name.strip().lower() for name in names]
+    if normalised_names != headers:
+        raise HTTPException(status_code=400, detail=f"Invalid columns. Expected: {headers}, got: {normalised_names}")
+
+#(buffer, starts, ends) of a string column, the layout the CSV field parsers work on
+def string_fields(array) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    array = array.cast(pa.large_string())
+    _, offsets, data = array.buffers()
+    offsets = np.frombuffer(offsets, dtype=np.int64)[array.offset:array.offset + len(array) + 1]
+    buf = np.frombuffer(data, dtype=np.uint8) if data is not None and data.size else np.zeros(1, dtype=np.uint8)
+    return buf, offsets[:-1], offsets[1:]
+
+def unsupported_type(name: str, array) -> HTTPException:
+    return HTTPException(status_code=400, detail=f"Unsupported type for column {name}: {array.type}")
+
+def uuid_column(name: str, array) -> Tuple[np.ndarray, np.ndarray]:
+    if isinstance(array.type, pa.BaseExtensionType):
+        array = array.storage
+    if pa.types.is_fixed_size_binary(array.type) and array.type.byte_width == 16:
+        values = np.frombuffer(array.buffers()[1], dtype=np.uint8)[array.offset * 16:(array.offset + len(array)) * 16]
+        return values.reshape(-1, 16).copy(), np.ones(len(array), dtype=bool)
+    if pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+        return parse_uuids(*string_fields(array))
+    raise unsupported_type(name, array)
+
+def int_column(name: str, array) -> Tuple[np.ndarray, np.ndarray]:
+    if pa.types.is_integer(array.type):
+        values = array.fill_null(0).to_numpy(zero_copy_only=False).astype(np.int64)
+        ok = (values >= -2**31) & (values <= int32_max)
+        return np.where(ok, values, 0).astype(np.int32), ok
+    if pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+        return parse_ints(*string_fields(array))
+    raise unsupported_type(name, array)
+
+def timestamp_column(name: str, array) -> Tuple[np.ndarray, np.ndarray]:
+    if pa.types.is_timestamp(array.type) or pa.types.is_date(array.type):
+        #tz-aware timestamps are taken in UTC, nanoseconds are truncated, timestamps are stored without timezone at microsecond precision
+        values = pc.cast(array, pa.timestamp("us"), safe=False).fill_null(0)
+        return values.to_numpy(zero_copy_only=False).astype("datetime64[us]"), np.ones(len(array), dtype=bool)
+    if pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+        return parse_timestamps(*string_fields(array))
+    raise unsupported_type(name, array)
+
+def amount_column(name: str, array) -> Tuple[np.ndarray, np.ndarray]:
+    if pa.types.is_integer(array.type):
+        values = array.fill_null(0).to_numpy(zero_copy_only=False)
+        #same bound as the float branch, checked before the cast, uint64 and large int64 amounts would wrap around
+        #compared on both sides rather than np.abs, which overflows for the smallest int64
+        ok = (values > -1e10) & (values < 1e10)
+        return np.where(ok, values, 0).astype(np.int64) * 100, ok
+    if pa.types.is_decimal(array.type):
+        #same rounding as Decimal.quantize(Decimal("0.01")) in transform_row, half to even
+        try:
+            rounded = pc.cast(pc.round(array.fill_null(0), ndigits=2, round_mode="half_to_even"), pa.decimal128(38, 2))
+        except pa.ArrowInvalid as error:
+            raise HTTPException(status_code=400, detail=f"Invalid transaction_amount. {error}")
+        #at scale 2 the unscaled value is the cents, stored as 128-bit little-endian two's complement
+        words = np.frombuffer(rounded.buffers()[1], dtype=np.int64)[rounded.offset * 2:(rounded.offset + len(rounded)) * 2].reshape(-1, 2)
+        cents, high = words[:, 0], words[:, 1]
+        #high word must be the sign extension of the low one, i.e. the value fits in 64 bits
+        return cents.copy(), high == (cents >> 63)
+    if pa.types.is_floating(array.type):
+        values = array.fill_null(0).to_numpy(zero_copy_only=False).astype(np.float64)
+        ok = np.isfinite(values) & (np.abs(values) < 1e10)
+        #rounded to cents, half to even
+        return np.rint(np.where(ok, values, 0) * 100).astype(np.int64), ok
+    if pa.types.is_string(array.type) or pa.types.is_large_string(array.type):
+        return parse_amounts(*string_fields(array))
+    raise unsupported_type(name, array)
+
+#values of one row as strings, for the slow path
+def row_fields(columns, i: int) -> List[str]:
+    fields = []
+    for column in columns:
+        value = column[i].as_py()
+        fields.append(str(uuid.UUID(bytes=value)) if isinstance(value, bytes) else str(value))
+    return fields
+
+#first_row numbers the rows of the batch, 1 for the first row of the file
+def parse_record_batch(record_batch, first_row: int) -> ParsedBatch:
+    columns = record_batch.columns
+    line_numbers = first_row + np.arange(record_batch.num_rows)
+
+    transaction_id, ok_uuid = uuid_column(headers[0], columns[0])
+    user_id, ok_user = int_column(headers[1], columns[1])
+    product_id, ok_product = int_column(headers[2], columns[2])
+    timestamp, ok_timestamp = timestamp_column(headers[3], columns[3])
+    amount_cents, ok_amount = amount_column(headers[4], columns[4])
+    ok = ok_uuid & ok_user & ok_product & ok_timestamp & ok_amount
+
+    missing = np.zeros(record_batch.num_rows, dtype=bool)
+    for column in columns:
+        if column.null_count:
+            missing |= column.is_null().to_numpy(zero_copy_only=False)
+
+    errors: List[Tuple[int, str]] = []
+    if not (ok & ~missing).all():
+        for i in np.flatnonzero(~ok | missing).tolist():
+            if missing[i]:
+                names = [name for name, column in zip(headers, columns) if not column[i].is_valid]
+                errors.append((int(line_numbers[i]), f"Missing value for {', '.join(names)}"))
+                continue
+            #same per-row parsing and messages as a CSV row
+            transformed_row, error = parse_row_slow(row_fields(columns, i))
+            if error is not None:
+                errors.append((int(line_numbers[i]), error))
+                continue
+            transaction_id[i] = np.frombuffer(transformed_row["transaction_id"].bytes, dtype=np.uint8)
+            user_id[i] = transformed_row["user_id"]
+            product_id[i] = transformed_row["product_id"]
+            timestamp[i] = np.datetime64(transformed_row["timestamp"], "us")
+            amount_cents[i] = int(transformed_row["transaction_amount"].scaleb(2))
+            ok[i] = True
+    ok &= ~missing
+
+    return ParsedBatch(
+        transaction_id=transaction_id[ok],
+        user_id=user_id[ok],
+        product_id=product_id[ok],
+        timestamp=timestamp[ok],
+        amount_cents=amount_cents[ok],
+        line_numbers=line_numbers[ok],
+        errors=errors,
+    )
+
+#ParsedBatch per record batch
+def iter_record_batches(record_batches: Iterator["pa.RecordBatch"]) -> Iterator[ParsedBatch]:
+    first_row = 1
+    try:
+        for record_batch in record_batches:
+            yield parse_record_batch(record_batch, first_row)
+            first_row += record_batch.num_rows
+    except (pa.ArrowException, OSError) as error:
+        #corrupt data past the footer/schema only shows up while reading
+        raise HTTPException(status_code=400, detail=f"Unable to read record batch. {error}")
@@ -0,0 +1,109 @@
+import gzip
+import io
+import zlib
+from typing import BinaryIO
+from fastapi import HTTPException
+
+#compressed uploads, decompressed incrementally as the parser reads, so the inflated CSV never exists in full on disk or in memory
+#.csv.gz uses the standard library, .csv.zst the zstandard package pinned in requirements.txt
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+#Parquet/Arrow are handled by services/columnar.py, they are compressed internally already
+upload_suffixes = (".csv", ".csv.gz", ".csv.zst", ".parquet", ".arrow", ".ipc")
+
+#decompressed bytes handed out per read of a gzip request body, bounds memory whatever the compression ratio
+request_chunk_bytes = 1024 * 1024
+
+#errors a corrupt or truncated stream can raise while reading
+decompress_errors = (OSError, EOFError, zlib.error) + ((zstandard.ZstdError,) if zstandard is not None else ())
+
+#same 400 as before for anything that is not a (compressed) CSV or a Parquet/Arrow file
+def check_upload_filename(filename: str) -> None:
+    if not (filename or "").lower().endswith(upload_suffixes):
+        raise HTTPException(status_code=400, detail="Only CSV files are supported (.csv, .csv.gz, .csv.zst), or Parquet/Arrow (.parquet, .arrow, .ipc)")
+
+#wraps a decompressing reader, a corrupt stream becomes a 400 instead of a 500
+class DecompressedStream(io.RawIOBase):
+    def __init__(self, reader: BinaryIO):
+        self.reader = reader
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        try:
+            data = self.reader.read(len(buffer))
+        except decompress_errors as error:
+            raise HTTPException(status_code=400, detail=f"Unable to decompress upload. {error}")
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self) -> None:
+        self.reader.close()
+        super().close()
+
+#binary stream of CSV bytes for the uploaded file, decompressed on the fly if the filename says so
+#closing the returned stream doesn't close stream, the caller still owns it
+def open_upload(filename: str, stream: BinaryIO) -> BinaryIO:
+    name = (filename or "").lower()
+    if name.endswith(".csv.gz"):
+        return io.BufferedReader(DecompressedStream(gzip.GzipFile(fileobj=stream, mode="rb")))
+    if name.endswith(".csv.zst"):
+        if zstandard is None:
+            raise HTTPException(status_code=400, detail=".csv.zst uploads need the zstandard package installed on the server")
+        return io.BufferedReader(DecompressedStream(zstandard.ZstdDecompressor().stream_reader(stream, closefd=False)))
+    return stream
+
+#ASGI middleware for request bodies sent with Content-Encoding: gzip, e.g. curl --data-binary @file.gz -H "Content-Encoding: gzip"
+#the body is inflated message by message as the endpoint reads it, in pieces of at most request_chunk_bytes
+class GzipRequestMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        encoding = dict(scope["headers"]).get(b"content-encoding", b"identity").strip().lower()
+        if encoding == b"identity":
+            return await self.app(scope, receive, send)
+        if encoding != b"gzip":
+            await send({"type": "http.response.start", "status": 415, "headers": [(b"content-type", b"application/json")]})
+            await send({"type": "http.response.body", "body": b'{"detail":"Unsupported Content-Encoding, only gzip is accepted"}'})
+            return
+
+        #length and encoding describe the compressed body, the app sees the decompressed one
+        headers = [(name, value) for name, value in scope["headers"] if name not in (b"content-encoding", b"content-length")]
+        scope = dict(scope, headers=headers)
+        #wbits 16 + MAX_WBITS: gzip header and trailer
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        compressed = b""
+        more_body = True
+        finished = False
+
+        async def receive_decompressed():
+            nonlocal compressed, more_body, finished
+            if finished:
+                return await receive()
+            while True:
+                try:
+                    if compressed:
+                        data = decompressor.decompress(compressed, request_chunk_bytes)
+                        compressed = decompressor.unconsumed_tail
+                        if data:
+                            return {"type": "http.request", "body": data, "more_body": True}
+                        continue
+                    if not more_body:
+                        finished = True
+                        return {"type": "http.request", "body": decompressor.flush(), "more_body": False}
+                except zlib.error as error:
+                    raise HTTPException(status_code=400, detail=f"Unable to decompress request body. {error}")
+                message = await receive()
+                if message["type"] != "http.request":
+                    return message
+                compressed = message.get("body", b"")
+                more_body = message.get("more_body", False)
+
+        await self.app(scope, receive_decompressed, send)
@@ -0,0 +1,190 @@
+import asyncio
+import io
+import json
+import os
+from datetime import datetime
+from typing import Any, AsyncIterator, List, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import select
+from database import ReadSessionLocal
+from models.models import Transaction
+from models.schemas import format_amount
+from services.upload_services import get_driver_connection
+
+#streaming export of raw transactions, memory stays constant whatever the number of rows
+#csv is produced by PostgreSQL itself with COPY ... TO STDOUT, ndjson and parquet are encoded from a server-side cursor, one partition of rows at a time
+#every format can be uploaded again as is (same columns, same timestamp and amount formats)
+#parquet uses pyarrow, pinned in requirements.txt like for Parquet uploads
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+#rows fetched from the server-side cursor per round-trip, also the Parquet row group size
+export_batch_rows = int(os.getenv("EXPORT_BATCH_ROWS", "10000"))
+#COPY output pieces that may wait for a slow client, when full COPY stops reading from the socket (backpressure)
+export_queue_depth = int(os.getenv("EXPORT_QUEUE_DEPTH", "16"))
+
+export_columns = ["transaction_id", "user_id", "product_id", "timestamp", "transaction_amount"]
+
+media_types = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+#the 400 has to happen before the response starts, a missing pyarrow can't be reported once streaming
+def check_export_format(format: str) -> None:
+    if format == "parquet" and pa is None:
+        raise HTTPException(status_code=400, detail="Parquet exports need the pyarrow package installed on the server")
+
+#filters for the COPY path, COPY can't take bind parameters so asyncpg substitutes them client side, with the server's own type encoding
+#served by ix_transactions_user_ts / ix_transactions_product_ts when user_id / product_id is given
+def export_query(user_id: Optional[int], product_id: Optional[int], start: Optional[datetime], end: Optional[datetime]) -> Tuple[str, List[Any]]:
+    conditions: List[str] = []
+    args: List[Any] = []
+    for condition, value in (("user_id = ${}", user_id), ("product_id = ${}", product_id), ("timestamp >= ${}", start), ("timestamp < ${}", end)):
+        if value is not None:
+            args.append(value)
+            conditions.append(condition.format(len(args)))
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"SELECT {', '.join(export_columns)} FROM transactions{where}", args
+
+#same filters for the cursor path
+def export_statement(user_id: Optional[int], product_id: Optional[int], start: Optional[datetime], end: Optional[datetime]):
+    conditions = []
+    if user_id is not None:
+        conditions.append(Transaction.user_id == user_id)
+    if product_id is not None:
+        conditions.append(Transaction.product_id == product_id)
+    if start:
+        conditions.append(Transaction.timestamp >= start)
+    if end:
+        conditions.append(Transaction.timestamp < end)
+    return select(
+        Transaction.transaction_id,
+        Transaction.user_id,
+        Transaction.product_id,
+        Transaction.timestamp,
+        Transaction.transaction_amount,
+    ).where(*conditions)
+
+#COPY (...) TO STDOUT WITH CSV HEADER, pieces are handed over through a bounded queue as asyncpg receives them
+async def stream_csv(user_id: Optional[int], product_id: Optional[int], start: Optional[datetime], end: Optional[datetime]) -> AsyncIterator[bytes]:
+    query, args = export_query(user_id, product_id, start, end)
+    queue: asyncio.Queue[bytes | bytearray | Exception | None] = asyncio.Queue(maxsize=export_queue_depth)
+
+    async with ReadSessionLocal() as session:
+        driver_connection = await get_driver_connection(session)
+
+        async def copy() -> None:
+            try:
+                await driver_connection.copy_from_query(query, *args, output=queue.put, format="csv", header=True)
+            except Exception as error:
+                await queue.put(error)
+                return
+            #None tells the reader the export is done
+            await queue.put(None)
+
+        task = asyncio.create_task(copy())
+        try:
+            while (item := await queue.get()) is not None:
+                if isinstance(item, Exception):
+                    raise item
+                #asyncpg hands out bytearray pieces, StreamingResponse only passes bytes/memoryview through and would try to .encode() them
+                yield bytes(item)
+        finally:
+            #client went away or COPY failed, stop reading from the server
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+#rows from a server-side cursor, export_batch_rows at a time
+async def stream_partitions(user_id: Optional[int], product_id: Optional[int], start: Optional[datetime], end: Optional[datetime]) -> AsyncIterator[List[Any]]:
+    statement = export_statement(user_id, product_id, start, end).execution_options(yield_per=export_batch_rows)
+    async with ReadSessionLocal() as session:
+        result = await session.stream(statement)
+        async for rows in result.partitions():
+            yield rows
+
+#one JSON object per line, timestamps and amounts as the same strings the CSV has
+def encode_ndjson(rows: List[Any]) -> bytes:
+    return "".join(
+        json.dumps({
+            "transaction_id": str(transaction_id),
+            "user_id": user_id,
+            "product_id": product_id,
+            "timestamp": str(timestamp),
+            "transaction_amount": format_amount(transaction_amount),
+        }) + "\n"
+        for transaction_id, user_id, product_id, timestamp, transaction_amount in rows
+    ).encode()
+
+async def stream_ndjson(user_id: Optional[int], product_id: Optional[int], start: Optional[datetime], end: Optional[datetime]) -> AsyncIterator[bytes]:
+    async for rows in stream_partitions(user_id, product_id, start, end):
+        yield encode_ndjson(rows)
+
+#file-like sink for ParquetWriter, the bytes written so far are taken out after every row group
+class ParquetSink(io.RawIOBase):
+    def __init__(self):
+        self.parts: List[bytes] = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def take(self) -> bytes:
+        data = b"".join(self.parts)
+        self.parts.clear()
+        return data
+
+#the types the Parquet upload reads without text parsing
+def parquet_schema():
+    return pa.schema([
+        ("transaction_id", pa.binary(16)),
+        ("user_id", pa.int32()),
+        ("product_id", pa.int32()),
+        ("timestamp", pa.timestamp("us")),
+        ("transaction_amount", pa.decimal128(12, 2)),
+    ])
+
+def parquet_table(rows: List[Any], schema):
+    transaction_ids, user_ids, product_ids, timestamps, amounts = zip(*rows)
+    return pa.table([
+        pa.array([transaction_id.bytes for transaction_id in transaction_ids], pa.binary(16)),
+        pa.array(user_ids, pa.int32()),
+        pa.array(product_ids, pa.int32()),
+        pa.array(timestamps, pa.timestamp("us")),
+        pa.array(amounts, pa.decimal128(12, 2)),
+    ], schema=schema)
+
+#one row group per cursor partition, encoded in a worker thread
+async def stream_parquet(user_id: Optional[int], product_id: Optional[int], start: Optional[datetime], end: Optional[datetime]) -> AsyncIterator[bytes]:
+    schema = parquet_schema()
+    sink = ParquetSink()
+    writer = pq.ParquetWriter(sink, schema)
+
+    def write(rows: List[Any]) -> bytes:
+        writer.write_table(parquet_table(rows, schema))
+        return sink.take()
+
+    async for rows in stream_partitions(user_id, product_id, start, end):
+        yield await asyncio.to_thread(write, rows)
+    #footer, an export with no rows is still a valid empty file
+    writer.close()
+    yield sink.take()
+
+def stream_export(format: str, user_id: Optional[int], product_id: Optional[int], start: Optional[datetime], end: Optional[datetime]) -> AsyncIterator[bytes]:
+    if format == "ndjson":
+        return stream_ndjson(user_id, product_id, start, end)
+    if format == "parquet":
+        return stream_parquet(user_id, product_id, start, end)
+    return stream_csv(user_id, product_id, start, end)
@@ -0,0 +1,62 @@
+import os
+from collections import OrderedDict
+from typing import Iterable, Set
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.models import User, Product
+
+#per-worker cache of user/product ids known to exist in the DB, so uploads only send INSERT ... ON CONFLICT DO NOTHING for ids it hasn't seen
+#ids are only added after the upload transaction has committed, so a rollback can never leave an id in here that isn't in the DB
+#assumes users/products are never deleted behind the app's back (the FKs are RESTRICT), anything that does delete them must call clear()
+
+#max ids per cache, least recently used ones are evicted beyond this
+id_cache_size = int(os.getenv("ID_CACHE_SIZE", "100000"))
+#warm the caches with a bulk SELECT at startup, otherwise they fill lazily as uploads commit
+id_cache_warm = os.getenv("ID_CACHE_WARM", "0") == "1"
+
+class IdCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        #OrderedDict as an LRU set, most recently used at the end
+        self.ids: OrderedDict[int, None] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, id: int) -> bool:
+        return id in self.ids
+
+    #ids that are not known yet, known ones are marked as recently used
+    def missing(self, ids: Iterable[int]) -> Set[int]:
+        unseen: Set[int] = set()
+        for id in ids:
+            if id in self.ids:
+                self.ids.move_to_end(id)
+            else:
+                unseen.add(id)
+        return unseen
+
+    #only call once the ids are committed
+    def add(self, ids: Iterable[int]) -> None:
+        for id in ids:
+            self.ids[id] = None
+            self.ids.move_to_end(id)
+        while len(self.ids) > self.max_size:
+            self.ids.popitem(last=False)
+
+    def clear(self) -> None:
+        self.ids.clear()
+
+user_id_cache = IdCache(id_cache_size)
+product_id_cache = IdCache(id_cache_size)
+
+def clear_id_caches() -> None:
+    user_id_cache.clear()
+    product_id_cache.clear()
+
+#one SELECT per table, capped at the cache size
+async def warm_id_caches(session: AsyncSession) -> None:
+    users = await session.execute(select(User.id).limit(id_cache_size))
+    user_id_cache.add(users.scalars())
+    products = await session.execute(select(Product.id).limit(id_cache_size))
+    product_id_cache.add(products.scalars())
@@ -0,0 +1,327 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import date
+from typing import Awaitable, BinaryIO, Callable, Iterator, List, Optional, Set
+import numpy as np
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import AsyncSessionLocal
+from models.schemas import UploadData
+from services.upload_services import (
+    upsert_users,
+    upsert_products,
+    insert_transactions,
+    upsert_inserted_totals,
+    InsertedTotals,
+    create_staging_table,
+    drop_staging_tables,
+    copy_to_staging,
+    merge_staging,
+)
+from services.id_cache import user_id_cache, product_id_cache
+from services.summary_cache import get_summary_cache
+from services.partitions import ensure_month_partitions
+from models.models import transactions_partitioned
+from services.csv_parser import ParsedBatch, headers, read_header, iter_chunks, parse_chunk, chunk_bytes
+from services.columnar import open_record_batches, check_columns, iter_record_batches
+
+logger = logging.getLogger(__name__)
+
+#upload pipeline: a producer reads + parses chunks in a worker thread and puts them on a bounded queue, a writer drains the queue into the session
+#so parsing chunk N+1 overlaps with the DB write of chunk N, and the event loop is never blocked by parsing
+
+#number of rows to insert in one batch, for faster performance, for each insert operation
+batch_size = 2000
+
+#how many parsed chunks may wait for the writer, when full the producer stops reading (backpressure), so memory is bounded by queue_depth * chunk size
+queue_depth = int(os.getenv("UPLOAD_QUEUE_DEPTH", "4"))
+#bytes of CSV parsed per chunk
+upload_chunk_bytes = int(os.getenv("UPLOAD_CHUNK_BYTES", str(chunk_bytes)))
+
+#sharded ingest uses one pooled connection per shard plus one to publish, keep it within DB_POOL_SIZE (database.py)
+max_shards = int(os.getenv("UPLOAD_MAX_SHARDS", "8"))
+
+#per-stage timings in seconds
+@dataclass
+class PipelineTimings:
+    #reading + parsing, in the worker thread
+    parse: float = 0.0
+    #DB writes, in the writer (summed over shards in sharded mode)
+    write: float = 0.0
+    #writer idle, waiting for the parser
+    write_wait: float = 0.0
+    #producer blocked on a full queue
+    backpressure: float = 0.0
+    commit: float = 0.0
+    total: float = 0.0
+
+    #Server-Timing header value, durations in milliseconds
+    def server_timing(self) -> str:
+        return ", ".join(f"{name};dur={value * 1000:.1f}" for name, value in vars(self).items())
+
+#running counters, read by background import jobs while the upload is in progress
+@dataclass
+class IngestProgress:
+    rows_parsed: int = 0
+    #rows handed to the DB, inserted directly or COPYed into staging
+    rows_written: int = 0
+    #only known per batch in insert mode, in copy/sharded mode they are filled in by the final merge
+    rows_inserted: int = 0
+    duplicates_ignored: int = 0
+
+#queue items are parsed batches, None at end of file, or the exception the producer hit
+QueueItem = ParsedBatch | Exception | None
+
+async def check_header(stream: BinaryIO) -> None:
+    normalised_headers = await asyncio.to_thread(read_header, stream)
+
+    #check the header
+    if normalised_headers is None:
+        raise HTTPException(status_code=400, detail="Missing CSV header")
+
+    if normalised_headers != headers:
+        raise HTTPException(status_code=400, detail=f"Invalid CSV header. Expected: {headers}, got: {normalised_headers}")
+
+#checks the header/columns and returns a lazy iterator of parsed batches, nothing is parsed until the producer pulls from it
+#format is "csv", or "parquet" / "arrow" for the columnar formats, which skip text parsing entirely
+async def open_batches(stream: BinaryIO, format: str = "csv") -> Iterator[ParsedBatch]:
+    if format == "csv":
+        await check_header(stream)
+        return (parse_chunk(*item) for item in iter_chunks(stream, upload_chunk_bytes))
+    names, record_batches = await asyncio.to_thread(open_record_batches, stream, format)
+    check_columns(names)
+    return iter_record_batches(record_batches)
+
+#pulls parsed batches in a worker thread, deliver() hands each item to the writer(s) and blocks while they are full
+async def produce(batches: Iterator[ParsedBatch], deliver: Callable[[QueueItem], Awaitable[None]], timings: PipelineTimings, progress: IngestProgress) -> None:
+    #runs in the worker thread, file reads are blocking and parsing is CPU-bound
+    def next_batch() -> Optional[ParsedBatch]:
+        batch = next(batches, None)
+        if batch is None:
+            return None
+        if batch.errors:
+            line_number, detail = batch.errors[0]
+            raise HTTPException(status_code=400, detail=f"Error in row {line_number}: {detail}")
+        return batch
+
+    while True:
+        parse_started = time.perf_counter()
+        try:
+            batch = await asyncio.to_thread(next_batch)
+        except Exception as error:
+            #hand it to the writer, which raises it inside the transaction so everything rolls back
+            await deliver(error)
+            return
+        timings.parse += time.perf_counter() - parse_started
+        if batch is not None:
+            progress.rows_parsed += len(batch)
+
+        put_started = time.perf_counter()
+        #None tells the writer the file is done
+        await deliver(batch)
+        timings.backpressure += time.perf_counter() - put_started
+        if batch is None:
+            return
+
+async def next_item(queue: asyncio.Queue, timings: PipelineTimings) -> Optional[ParsedBatch]:
+    wait_started = time.perf_counter()
+    item = await queue.get()
+    timings.write_wait += time.perf_counter() - wait_started
+    if isinstance(item, Exception):
+        raise item
+    return item
+
+#stream must be positioned at the start of the file, returns the upload result and the stage timings
+#progress, if given, is updated as the upload goes, format is the file format, see open_batches
+async def ingest_csv(session: AsyncSession, stream: BinaryIO, mode: str = "insert", depth: Optional[int] = None, shards: int = 4, progress: Optional[IngestProgress] = None, format: str = "csv") -> tuple[UploadData, PipelineTimings]:
+    progress = progress or IngestProgress()
+    if mode == "sharded":
+        return await ingest_csv_sharded(session, stream, shards, depth, progress, format)
+
+    started = time.perf_counter()
+    timings = PipelineTimings()
+    batches = await open_batches(stream, format)
+
+    queue: asyncio.Queue[QueueItem] = asyncio.Queue(maxsize=depth or queue_depth)
+
+    rows_inserted: int = 0
+    users_upserted: int = 0
+    duplicates_ignored: int = 0
+    products_upserted: int = 0
+    staged_count: int = 0
+    #ids written by this upload, they go into the id caches only once the transaction has committed
+    pending_user_ids: Set[int] = set()
+    pending_product_ids: Set[int] = set()
+    #every user with rows in the file, their cached summaries are invalidated after the commit
+    touched_user_ids: Set[int] = set()
+    #months with rows in the file, when transactions is partitioned
+    touched_months: Set[date] = set()
+    #insert mode rollups and sketch bins, written once after the last batch
+    inserted_totals = InsertedTotals()
+
+    producer = asyncio.create_task(produce(batches, queue.put, timings, progress))
+    try:
+        async with session.begin():
+            if mode == "copy":
+                await create_staging_table(session)
+
+            while (batch := await next_item(queue, timings)) is not None:
+                write_started = time.perf_counter()
+                if transactions_partitioned:
+                    touched_months.update(batch.months())
+                if mode == "copy":
+                    #users and products are merged from the staging table, the ids are only collected for the id caches
+                    staged_count += await copy_to_staging(session, batch)
+                    progress.rows_written = staged_count
+                    touched_user_ids.update(np.unique(batch.user_id).tolist())
+                    pending_product_ids.update(np.unique(batch.product_id).tolist())
+                else:
+                    touched_user_ids.update(np.unique(batch.user_id).tolist())
+                    #insert or update users, products and transactions in batches
+                    for start in range(0, len(batch), batch_size):
+                        transactions_batch = batch.to_rows(start, start + batch_size)
+                        #skip ids already upserted by this upload or known from earlier committed uploads, they would be a no-op round-trip
+                        user_ids_batch: Set[int] = user_id_cache.missing({row["user_id"] for row in transactions_batch} - pending_user_ids)
+                        product_ids_batch: Set[int] = product_id_cache.missing({row["product_id"] for row in transactions_batch} - pending_product_ids)
+                        pending_user_ids.update(user_ids_batch)
+                        pending_product_ids.update(product_ids_batch)
+
+                        users_upserted += await upsert_users(session, user_ids_batch)
+                        products_upserted += await upsert_products(session, product_ids_batch)
+                        #don't upsert transacitons, need to record duplicates ignored
+                        inserted, duplicates = await insert_transactions(session, transactions_batch, inserted_totals)
+                        rows_inserted += inserted
+                        duplicates_ignored += duplicates
+                        progress.rows_written += len(transactions_batch)
+                        progress.rows_inserted, progress.duplicates_ignored = rows_inserted, duplicates_ignored
+                timings.write += time.perf_counter() - write_started
+
+            write_started = time.perf_counter()
+            if mode == "copy":
+                #this transaction hasn't touched users/products/transactions yet, so the partitions can be attached without waiting on it
+                await ensure_month_partitions(touched_months)
+                #merge everything in one go
+                users_upserted, products_upserted, rows_inserted, duplicates_ignored = await merge_staging(session, staged_count)
+                progress.rows_inserted, progress.duplicates_ignored = rows_inserted, duplicates_ignored
+            else:
+                await upsert_inserted_totals(session, inserted_totals)
+            timings.write += time.perf_counter() - write_started
+            commit_started = time.perf_counter()
+        timings.commit = time.perf_counter() - commit_started
+        #every touched user exists once committed, whether this upload inserted it or not
+        user_id_cache.add(touched_user_ids)
+        product_id_cache.add(pending_product_ids)
+        get_summary_cache().invalidate_users(touched_user_ids)
+        #insert mode rows of new months went to the DEFAULT partition, they move to their own partition now
+        await ensure_month_partitions(touched_months)
+    finally:
+        #writer failed or a row was rejected, stop reading the rest of the file
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
+
+    timings.total = time.perf_counter() - started
+    logger.info("upload pipeline (%s): %s", mode, timings.server_timing())
+
+    #return uploade results based on schema
+    return UploadData(
+        row_count=rows_inserted + duplicates_ignored,
+        user_count=users_upserted,
+        product_count=products_upserted,
+        transaction_count=rows_inserted,
+        duplicates_ignored=duplicates_ignored,
+    ), timings
+
+#sharded ingest: rows are split by transaction_id hash and COPYed concurrently into one UNLOGGED staging table per shard, each on its own pooled connection
+#the shards are then published by one merge in one transaction on the request session, so the upload is still all-or-nothing and duplicates are counted exactly
+async def ingest_csv_sharded(session: AsyncSession, stream: BinaryIO, shards: int, depth: Optional[int] = None, progress: Optional[IngestProgress] = None, format: str = "csv") -> tuple[UploadData, PipelineTimings]:
+    progress = progress or IngestProgress()
+    started = time.perf_counter()
+    timings = PipelineTimings()
+    batches = await open_batches(stream, format)
+
+    shards = max(1, min(shards, max_shards))
+    upload_key = uuid.uuid4().hex[:12]
+    tables: List[str] = [f"staging_{upload_key}_{shard}" for shard in range(shards)]
+    queues: List[asyncio.Queue[QueueItem]] = [asyncio.Queue(maxsize=depth or queue_depth) for _ in range(shards)]
+    touched_user_ids: Set[int] = set()
+    pending_product_ids: Set[int] = set()
+    touched_months: Set[date] = set()
+
+    async def deliver(item: QueueItem) -> None:
+        if not isinstance(item, ParsedBatch):
+            #end of file or an error, every shard needs to see it
+            for queue in queues:
+                await queue.put(item)
+            return
+        touched_user_ids.update(np.unique(item.user_id).tolist())
+        pending_product_ids.update(np.unique(item.product_id).tolist())
+        if transactions_partitioned:
+            touched_months.update(item.months())
+        keys = item.shard_keys(shards)
+        for shard, queue in enumerate(queues):
+            await queue.put(item.take(np.flatnonzero(keys == shard)))
+
+    #each shard commits its own staging table, nothing is visible in the real tables until the publish below
+    async def write_shard(table: str, queue: asyncio.Queue) -> int:
+        staged = 0
+        async with AsyncSessionLocal() as shard_session:
+            async with shard_session.begin():
+                await create_staging_table(shard_session, table, temporary=False)
+                while (batch := await next_item(queue, timings)) is not None:
+                    write_started = time.perf_counter()
+                    staged += await copy_to_staging(shard_session, batch, table)
+                    progress.rows_written += len(batch)
+                    timings.write += time.perf_counter() - write_started
+        return staged
+
+    producer = asyncio.create_task(produce(batches, deliver, timings, progress))
+    writers = [asyncio.create_task(write_shard(table, queue)) for table, queue in zip(tables, queues)]
+    try:
+        #fail fast: the first shard error cancels everything else
+        done, pending = await asyncio.wait(writers, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if task.exception() is not None:
+                raise task.exception()
+        staged_count = sum(task.result() for task in writers)
+
+        write_started = time.perf_counter()
+        #before the publish transaction takes any locks
+        await ensure_month_partitions(touched_months)
+        async with session.begin():
+            users_upserted, products_upserted, rows_inserted, duplicates_ignored = await merge_staging(session, staged_count, tables)
+            progress.rows_inserted, progress.duplicates_ignored = rows_inserted, duplicates_ignored
+            #dropped in the same transaction, so a published upload never leaves staging behind
+            await drop_staging_tables(session, tables)
+            timings.write += time.perf_counter() - write_started
+            commit_started = time.perf_counter()
+        timings.commit = time.perf_counter() - commit_started
+        user_id_cache.add(touched_user_ids)
+        product_id_cache.add(pending_product_ids)
+        get_summary_cache().invalidate_users(touched_user_ids)
+    except BaseException:
+        for task in [producer, *writers]:
+            task.cancel()
+        await asyncio.gather(producer, *writers, return_exceptions=True)
+        #shard transactions may have committed their staging tables already
+        async with AsyncSessionLocal() as cleanup_session:
+            async with cleanup_session.begin():
+                await drop_staging_tables(cleanup_session, tables)
+        raise
+    finally:
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
+
+    timings.total = time.perf_counter() - started
+    logger.info("upload pipeline (sharded x%d): %s", shards, timings.server_timing())
+
+    return UploadData(
+        row_count=rows_inserted + duplicates_ignored,
+        user_count=users_upserted,
+        product_count=products_upserted,
+        transaction_count=rows_inserted,
+        duplicates_ignored=duplicates_ignored,
+    ), timings
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import BinaryIO, Optional, Set
+from fastapi import HTTPException
+from database import AsyncSessionLocal
+from models.schemas import UploadData
+from services.ingest import IngestProgress, ingest_csv
+from services.compression import open_upload
+from services.columnar import columnar_format
+from services.metrics import observe_upload
+
+logger = logging.getLogger(__name__)
+
+#background imports: POST /upload/?async=true copies the upload to a temp file, returns a job id straight away, and the normal ingest runs here
+#at most import_job_concurrency imports run at once per worker, the rest wait in line (status "queued")
+#jobs live in memory, per worker, same as the summary cache, with several uvicorn workers poll with sticky routing or a single worker
+
+import_job_concurrency = int(os.getenv("IMPORT_JOB_CONCURRENCY", "2"))
+#finished jobs kept for polling, oldest dropped first
+import_job_history = int(os.getenv("IMPORT_JOB_HISTORY", "1000"))
+
+@dataclass
+class ImportJob:
+    id: str
+    #decides how the spooled file is decompressed / read
+    filename: str
+    mode: str
+    shards: int
+    #queued, running, succeeded, failed
+    status: str = "queued"
+    progress: IngestProgress = field(default_factory=IngestProgress)
+    created_at: datetime = field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    #perf_counter when it started, for throughput
+    started: Optional[float] = None
+    elapsed: float = 0.0
+    result: Optional[UploadData] = None
+    error: Optional[str] = None
+
+    #rows parsed per second since the job started running
+    def rows_per_second(self) -> float:
+        elapsed = self.elapsed if self.finished_at else (time.perf_counter() - self.started if self.started else 0.0)
+        return self.progress.rows_parsed / elapsed if elapsed > 0 else 0.0
+
+class ImportJobQueue:
+    def __init__(self, concurrency: int, history: int):
+        self.history = history
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.jobs: OrderedDict[str, ImportJob] = OrderedDict()
+        #strong refs, otherwise the event loop may garbage collect a running task
+        self.tasks: Set[asyncio.Task] = set()
+
+    def get(self, job_id: str) -> Optional[ImportJob]:
+        return self.jobs.get(job_id)
+
+    #takes ownership of stream (positioned at the start of the file) and closes it when done
+    def submit(self, stream: BinaryIO, filename: str, mode: str, shards: int) -> ImportJob:
+        job = ImportJob(id=uuid.uuid4().hex, filename=filename, mode=mode, shards=shards)
+        self.jobs[job.id] = job
+        self.trim()
+        task = asyncio.create_task(self.run(job, stream))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return job
+
+    async def run(self, job: ImportJob, stream: BinaryIO) -> None:
+        try:
+            async with self.semaphore:
+                job.status = "running"
+                job.started_at = datetime.utcnow()
+                job.started = time.perf_counter()
+                async with AsyncSessionLocal() as session:
+                    format = columnar_format(job.filename) or "csv"
+                    job.result, timings = await ingest_csv(
+                        session,
+                        open_upload(job.filename, stream),
+                        job.mode,
+                        shards=job.shards,
+                        progress=job.progress,
+                        format=format,
+                    )
+                observe_upload(job.mode, format, timings, job.result)
+                job.status = "succeeded"
+        except HTTPException as error:
+            #same message the synchronous upload would have returned
+            job.status = "failed"
+            job.error = error.detail
+        except Exception as error:
+            logger.exception("import job %s failed", job.id)
+            job.status = "failed"
+            job.error = str(error) or type(error).__name__
+        finally:
+            job.finished_at = datetime.utcnow()
+            if job.started is not None:
+                job.elapsed = time.perf_counter() - job.started
+            stream.close()
+
+    #drop the oldest finished jobs beyond the history size, queued/running ones are always kept
+    def trim(self) -> None:
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished_at is not None]
+        for job_id in finished[:max(0, len(self.jobs) - self.history)]:
+            del self.jobs[job_id]
+
+    #app shutdown, running imports roll back
+    async def cancel_all(self) -> None:
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+import_jobs = ImportJobQueue(import_job_concurrency, import_job_history)
+
+#the request's upload file is closed once the response is sent, so the job gets its own copy on disk
+async def spool_upload(source: BinaryIO) -> BinaryIO:
+    def copy() -> BinaryIO:
+        target = tempfile.TemporaryFile()
+        shutil.copyfileobj(source, target, 1024 * 1024)
+        target.seek(0)
+        return target
+    return await asyncio.to_thread(copy)
@@ -0,0 +1,289 @@
+import bisect
+import os
+import threading
+import time
+from functools import wraps
+from typing import Callable, Dict, List, Sequence, Tuple
+
+#in-process metrics, exposed in the Prometheus text format by GET /metrics
+#METRICS_ENABLED=0 (default): every metric is the same no-op object, timers are shared null contexts, the engine gets no event listeners
+#and the decorated functions are returned unwrapped, so the hot paths pay at most one empty method call
+metrics_enabled = os.getenv("METRICS_ENABLED", "0") == "1"
+
+#seconds, from sub-millisecond queries to multi-minute uploads
+default_buckets = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+LabelValues = Tuple[str, ...]
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        #observations come from the event loop and from parser threads
+        self.lock = threading.Lock()
+
+    def key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        return []
+
+    def render(self) -> str:
+        header = f"# HELP {self.name} {self.documentation}\n# TYPE {self.name} {self.kind}\n"
+        return header + "".join(f"{line}\n" for line in self.samples())
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = list(self.values.items())
+        return [f"{self.name}{format_labels(self.labelnames, key)} {format_value(value)}" for key, value in values]
+
+#read when /metrics is scraped, e.g. the connection pools' current state, one reader per label values
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.readers: Dict[LabelValues, Callable[[], float]] = {}
+
+    def add(self, read: Callable[[], float], **labels: str) -> None:
+        self.readers[self.key(labels)] = read
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{format_labels(self.labelnames, key)} {format_value(read())}" for key, read in list(self.readers.items())]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = default_buckets):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        #per label values: count per bucket (not cumulative, +Inf last), sum
+        self.values: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self.key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+            counts[index] += 1
+            total[0] += value
+
+    #times the block into the histogram
+    def time(self, **labels: str) -> "Timer":
+        return Timer(self, labels)
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = [(key, list(counts), total[0]) for key, (counts, total) in self.values.items()]
+        lines = []
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="' + format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+class Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: Dict[str, str]):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self) -> "Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+#stands in for every metric and timer when metrics are disabled
+class NullMetric:
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        pass
+
+    def add(self, read: Callable[[], float], **labels: str) -> None:
+        pass
+
+    def observe(self, value: float, **labels: str) -> None:
+        pass
+
+    def time(self, **labels: str) -> "NullMetric":
+        return self
+
+    def __enter__(self) -> "NullMetric":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+null_metric = NullMetric()
+
+registry: Dict[str, Metric] = {}
+
+def register(metric: Metric):
+    if not metrics_enabled:
+        return null_metric
+    registry[metric.name] = metric
+    return metric
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return register(Counter(name, documentation, labelnames))
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = default_buckets) -> Histogram:
+    return register(Histogram(name, documentation, labelnames, buckets))
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return register(Gauge(name, documentation, labelnames))
+
+#the whole registry in the Prometheus text exposition format 0.0.4
+def render() -> str:
+    return "".join(metric.render() for metric in list(registry.values()))
+
+#upload metrics, fed from upload_data, the ingest pipeline and services/upload_services
+upload_seconds = histogram("upload_seconds", "Duration of POST /upload/ requests by ingest mode and file format", ["mode", "format"])
+upload_stage_seconds = histogram("upload_stage_seconds", "Time spent per upload pipeline stage (parse, write, write_wait, backpressure, commit)", ["mode", "stage"])
+upload_rows = counter("upload_rows_total", "Rows of successful uploads by outcome (inserted, duplicate)", ["outcome"])
+upload_statement_seconds = histogram("upload_statement_seconds", "Duration of the upload_services database round-trips", ["function"])
+csv_rows = counter("csv_parsed_rows_total", "CSV rows parsed by the vectorised parser or the per-row transform_row fallback", ["path"])
+
+#engine metrics, see instrument_engine
+db_query_seconds = histogram("db_query_seconds", "Duration of database statements by pool and first SQL keyword", ["pool", "statement"])
+db_pool_checkout_seconds = histogram("db_pool_checkout_seconds", "Time waiting for a pooled connection, including opening a new one", ["pool"])
+db_pool_pre_ping_seconds = histogram("db_pool_pre_ping_seconds", "Duration of the pre-ping run on every pool checkout", ["pool"])
+db_pool_size = gauge("db_pool_size", "Configured size of the connection pool", ["pool"])
+db_pool_checked_out = gauge("db_pool_checked_out", "Connections currently checked out of the pool", ["pool"])
+db_pool_checked_in = gauge("db_pool_checked_in", "Idle connections in the pool", ["pool"])
+#negative while the pool hasn't opened pool_size connections yet
+db_pool_overflow = gauge("db_pool_overflow", "Connections open beyond pool_size", ["pool"])
+
+http_request_seconds = histogram("http_request_seconds", "Duration of HTTP requests by route template and status", ["method", "route", "status"])
+
+#async def in services/upload_services, timed into upload_statement_seconds, unwrapped when metrics are disabled
+def timed_statement(function):
+    if not metrics_enabled:
+        return function
+
+    @wraps(function)
+    async def wrapper(*args, **kwargs):
+        with upload_statement_seconds.time(function=function.__name__):
+            return await function(*args, **kwargs)
+    return wrapper
+
+def observe_upload(mode: str, format: str, timings, result) -> None:
+    if not metrics_enabled:
+        return
+    upload_seconds.observe(timings.total, mode=mode, format=format)
+    for stage, seconds in vars(timings).items():
+        if stage != "total":
+            upload_stage_seconds.observe(seconds, mode=mode, stage=stage)
+    upload_rows.inc(result.transaction_count, outcome="inserted")
+    upload_rows.inc(result.duplicates_ignored, outcome="duplicate")
+
+#statement verb only, so the label set stays small whatever the SQL
+def statement_kind(statement: str) -> str:
+    words = statement.lstrip(" (\n").split(None, 1)
+    return words[0].upper() if words else ""
+
+#query latency from the cursor events, pool checkout wait from the pool class, pre-ping from the dialect, pool size/overflow as scrape-time gauges
+#name is the pool label, write or read
+def instrument_engine(engine, name: str) -> None:
+    if not metrics_enabled:
+        return
+    from sqlalchemy import event
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        db_query_seconds.observe(time.perf_counter() - conn.info["query_started"].pop(), pool=name, statement=statement_kind(statement))
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(context):
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            db_query_seconds.observe(time.perf_counter() - started.pop(), pool=name, statement="ERROR")
+
+    dialect = sync_engine.dialect
+    do_ping = dialect.do_ping
+
+    def timed_ping(dbapi_connection):
+        with db_pool_pre_ping_seconds.time(pool=name):
+            return do_ping(dbapi_connection)
+    dialect.do_ping = timed_ping
+
+    pool = sync_engine.pool
+    db_pool_size.add(lambda: pool.size(), pool=name)
+    db_pool_checked_out.add(lambda: pool.checkedout(), pool=name)
+    db_pool_checked_in.add(lambda: pool.checkedin(), pool=name)
+    db_pool_overflow.add(lambda: pool.overflow(), pool=name)
+
+#the engine's pool class when metrics are enabled, times the wait for a free connection
+def timed_pool_class(name: str):
+    from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+    class TimedAsyncAdaptedQueuePool(AsyncAdaptedQueuePool):
+        def _do_get(self):
+            with db_pool_checkout_seconds.time(pool=name):
+                return super()._do_get()
+
+    return TimedAsyncAdaptedQueuePool
+
+#request latency per route template (/summary/{user_id}, not the raw path), until the response body is fully sent, only added when metrics are enabled
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            #the router puts the matched route into the scope
+            route = getattr(scope.get("route"), "path", "unmatched")
+            http_request_seconds.observe(time.perf_counter() - started, method=scope["method"], route=route, status=str(status))
@@ -0,0 +1,84 @@
+import logging
+import os
+from datetime import date, datetime
+from typing import Iterable, Set
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from database import AsyncSessionLocal
+from models.models import transactions_partitioned
+
+logger = logging.getLogger(__name__)
+
+#monthly range partitions of transactions, only used with TRANSACTIONS_PARTITIONED=1
+#rows of a month without a partition go to the DEFAULT partition, so an insert never fails for lack of a partition
+#uploads ask for the partitions of the months they contain, before their transaction writes to transactions where they can and again after the commit
+#a partition is created empty and attached (SHARE UPDATE EXCLUSIVE on transactions, reads and inserts carry on) in a short transaction on its own connection,
+#rows of that month already in the DEFAULT partition are moved into it first
+
+default_partition = "transactions_default"
+
+#attaching clones the foreign keys, which locks users/products against a concurrent upload's inserts, don't wait long for it,
+#the rows stay in the DEFAULT partition until a later upload (or the next start) creates the partition
+partition_lock_timeout_ms = int(os.getenv("PARTITION_LOCK_TIMEOUT_MS", "500"))
+
+#months known to have a partition, per worker
+known_months: Set[date] = set()
+
+def month_start(value: date | datetime) -> date:
+    return date(value.year, value.month, 1)
+
+def next_month(month: date) -> date:
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+def partition_name(month: date) -> str:
+    return f"transactions_y{month.year:04d}m{month.month:02d}"
+
+#runs at startup: a check that the flag matches the existing table, the DEFAULT partition itself comes from the baseline migration
+async def init_partitions(conn: AsyncConnection) -> None:
+    relkind = (await conn.execute(text("SELECT relkind::text FROM pg_class WHERE oid = 'transactions'::regclass"))).scalar_one()
+    if relkind != "p":
+        raise RuntimeError("TRANSACTIONS_PARTITIONED=1 but the existing transactions table is not partitioned, it has to be migrated first")
+
+#create the missing partition of one month, inside the caller's transaction
+async def create_month_partition(session: AsyncSession, month: date) -> None:
+    name = partition_name(month)
+    if (await session.execute(text("SELECT to_regclass(:name)"), {"name": name})).scalar() is not None:
+        return
+    await session.execute(text(f"CREATE TABLE {name} (LIKE transactions)"))
+    #same column order as the parent, so SELECT * lines up
+    await session.execute(text(
+        f"WITH moved AS (DELETE FROM {default_partition} WHERE timestamp >= :low AND timestamp < :high RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    ), {"low": datetime.combine(month, datetime.min.time()), "high": datetime.combine(next_month(month), datetime.min.time())})
+    await session.execute(text(
+        f"ALTER TABLE transactions ATTACH PARTITION {name} FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')"
+    ))
+
+#never raises for a lock timeout or conflict, the rows are safe in the DEFAULT partition either way
+async def ensure_month_partitions(months: Iterable[date]) -> None:
+    if not transactions_partitioned:
+        return
+    missing = sorted(set(months) - known_months)
+    if not missing:
+        return
+    try:
+        async with AsyncSessionLocal() as session:
+            async with session.begin():
+                await session.execute(text(f"SET LOCAL lock_timeout = {partition_lock_timeout_ms}"))
+                #one worker creates partitions at a time
+                await session.execute(text("SELECT pg_advisory_xact_lock(hashtext('transactions_partitions'))"))
+                for month in missing:
+                    await create_month_partition(session, month)
+    except DBAPIError as error:
+        logger.warning("could not create transactions partitions %s, rows stay in %s for now: %s", [partition_name(month) for month in missing], default_partition, error)
+        return
+    known_months.update(missing)
+
+#months of the rows sitting in the DEFAULT partition, e.g. after partition creation timed out
+async def split_default_partition() -> None:
+    if not transactions_partitioned:
+        return
+    async with AsyncSessionLocal() as session:
+        months = (await session.execute(text(f"SELECT DISTINCT date_trunc('month', timestamp) FROM {default_partition}"))).scalars().all()
+    await ensure_month_partitions(month_start(month) for month in months)
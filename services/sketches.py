@@ -0,0 +1,255 @@
+import math
+import os
+from collections import Counter
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Sequence
+from sqlalchemy import select, func, case, cast, null, union_all, literal_column, any_, bindparam, Float, Integer, BigInteger, DateTime, Numeric
+from sqlalchemy.dialects.postgresql import insert, aggregate_order_by, ARRAY
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+from models.models import Transaction, UserAmountSketch, AmountSketch
+from services.metrics import timed_statement
+from services.statements import FixedStatement
+from services.summary_services import window_floor, window_ceiling
+
+#approximate summaries from mergeable sketches of transaction_amount, per user per month (user_amount_sketches) and per month over all users (amount_sketches)
+#the sketch is a DDSketch: an amount goes to bin ceil(log_gamma(|amount|)), every value in a bin is within sketch_relative_accuracy of the bin's estimate,
+#and two sketches merge by adding the counts of equal bins, so months, users and uploads merge by summing counts per bin
+#a sketch is one row, its non-empty bins and their counts as two arrays in bin order plus the count/sum/min/max of its amounts,
+#so count/sum/min/max/mean of a window are exact, only the percentiles are approximate
+#one row per month holds every bin of the month whatever the number of transactions
+#AMOUNT_SKETCHES=1 maintains them on upload and lets approx=true use them, off by default since it costs every upload an extra merge
+amount_sketches_enabled = os.getenv("AMOUNT_SKETCHES", "0") == "1"
+
+#fixed for the life of the tables, the bins already written were computed with it
+sketch_relative_accuracy = 0.01
+gamma = (1 + sketch_relative_accuracy) / (1 - sketch_relative_accuracy)
+log_gamma = math.log(gamma)
+#keeps the bin numbers of positive amounts positive (log of amounts under 1 is negative), negative amounts mirror them below 0, and 0 is bin 0
+#so bins sort in the same order as the amounts they hold
+bin_offset = 100_000
+
+percentiles = {"p50": 0.5, "p95": 0.95, "p99": 0.99}
+
+#the bin as a SQL expression, from the numeric amount
+def bin_of(amount):
+    magnitude = cast(func.ceil(func.ln(cast(func.abs(amount), Float)) / log_gamma), Integer) + bin_offset
+    return case((amount > 0, magnitude), (amount < 0, -magnitude), else_=0)
+
+#the bin's estimate, the value every amount in it is within sketch_relative_accuracy of
+def bin_value(bin: int) -> float:
+    if bin == 0:
+        return 0.0
+    estimate = 2 * gamma ** (abs(bin) - bin_offset) / (gamma + 1)
+    return estimate if bin > 0 else -estimate
+
+#the bin of every row an insert mode batch inserted, for the per-upload sums of upload_services.InsertedTotals, NULL unless AMOUNT_SKETCHES=1
+def inserted_bin(amount):
+    return bin_of(amount) if amount_sketches_enabled else null()
+
+#user_id, bucket (month), bin, count, amount_sum, amount_min, amount_max of rows (user_id, timestamp, transaction_amount), the input of merge_sketches
+def binned(rows):
+    keyed = select(
+        rows.c.user_id,
+        func.date_trunc("month", rows.c.timestamp).label("bucket"),
+        bin_of(rows.c.transaction_amount).label("bin"),
+        rows.c.transaction_amount,
+    ).subquery("keyed")
+    return select(
+        keyed.c.user_id,
+        keyed.c.bucket,
+        keyed.c.bin,
+        func.count().label("count"),
+        func.sum(keyed.c.transaction_amount).label("amount_sum"),
+        func.min(keyed.c.transaction_amount).label("amount_min"),
+        func.max(keyed.c.transaction_amount).label("amount_max"),
+    ).group_by(keyed.c.user_id, keyed.c.bucket, keyed.c.bin).cte("binned")
+
+#bins or counts of the existing row and the excluded one merged, for the SET of ON CONFLICT DO UPDATE
+#both arrays are aggregated in bin order, so they stay aligned
+def merged_array(table, name: str):
+    entries = union_all(*(
+        select(func.unnest(literal_column(f"{source}.bins")).label("bin"), func.unnest(literal_column(f"{source}.counts")).label("count"))
+        for source in (table.__tablename__, "excluded")
+    )).subquery("entries")
+    merged = select(entries.c.bin, cast(func.sum(entries.c["count"]), BigInteger).label("count")).group_by(entries.c.bin).subquery("merged")
+    return select(func.array_agg(aggregate_order_by(merged.c[name], merged.c.bin))).scalar_subquery()
+
+#INSERT ... SELECT one sketch per keys ... ON CONFLICT DO UPDATE merging it into the existing one, like upload_services.rollup_inserted
+#rows are per user, month and bin like binned(...), amount_sketches adds up the bins of all users
+def merge_sketches(table, rows, keys: Sequence[str], *conditions):
+    columns = [rows.c[key] for key in keys]
+    per_bin = (
+        select(
+            *columns,
+            rows.c.bin,
+            cast(func.sum(rows.c["count"]), BigInteger).label("count"),
+            func.sum(rows.c.amount_sum).label("amount_sum"),
+            func.min(rows.c.amount_min).label("amount_min"),
+            func.max(rows.c.amount_max).label("amount_max"),
+        )
+        .where(*conditions)
+        .group_by(*columns, rows.c.bin)
+        .subquery("per_bin")
+    )
+    columns = [per_bin.c[key] for key in keys]
+    sql = insert(table).from_select(
+        [*keys, "bins", "counts", "transaction_count", "amount_sum", "amount_min", "amount_max"],
+        select(
+            *columns,
+            func.array_agg(aggregate_order_by(per_bin.c.bin, per_bin.c.bin)),
+            func.array_agg(aggregate_order_by(per_bin.c["count"], per_bin.c.bin)),
+            cast(func.sum(per_bin.c["count"]), BigInteger),
+            func.sum(per_bin.c.amount_sum),
+            func.min(per_bin.c.amount_min),
+            func.max(per_bin.c.amount_max),
+        )
+        .group_by(*columns)
+        #same lock order in concurrent uploads, so they can't deadlock on each other's sketches
+        .order_by(*columns),
+    )
+    return sql.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={
+            "bins": merged_array(table, "bin"),
+            "counts": merged_array(table, "count"),
+            "transaction_count": table.transaction_count + sql.excluded.transaction_count,
+            "amount_sum": table.amount_sum + sql.excluded.amount_sum,
+            "amount_min": func.least(table.amount_min, sql.excluded.amount_min),
+            "amount_max": func.greatest(table.amount_max, sql.excluded.amount_max),
+        },
+    )
+
+#rows as binned(...) merged into both sketch tables, as CTEs of the statement they are added to
+def merge_ctes(rows) -> list:
+    return [
+        merge_sketches(UserAmountSketch, rows, ["user_id", "bucket"]).cte("user_sketched"),
+        merge_sketches(AmountSketch, rows, ["bucket"]).cte("all_sketched"),
+    ]
+
+#the rows returned by an INSERT ... RETURNING user_id, timestamp, transaction_amount CTE, added to both sketch tables as more CTEs of the same statement
+#empty unless AMOUNT_SKETCHES=1
+def sketch_inserted(inserted) -> list:
+    if not amount_sketches_enabled:
+        return []
+    return merge_ctes(binned(inserted))
+
+#the bins an insert mode upload summed over its batches (upload_services.InsertedTotals.bins), bound as one array per column
+uploaded_bins = select(
+    func.unnest(bindparam("user_ids", type_=ARRAY(Integer))).label("user_id"),
+    func.unnest(bindparam("buckets", type_=ARRAY(DateTime))).label("bucket"),
+    func.unnest(bindparam("bins", type_=ARRAY(Integer))).label("bin"),
+    func.unnest(bindparam("counts", type_=ARRAY(BigInteger))).label("count"),
+    func.unnest(bindparam("sums", type_=ARRAY(Numeric(20, 2)))).label("amount_sum"),
+    func.unnest(bindparam("mins", type_=ARRAY(Numeric(12, 2)))).label("amount_min"),
+    func.unnest(bindparam("maxes", type_=ARRAY(Numeric(12, 2)))).label("amount_max"),
+).cte("uploaded_bins")
+upsert_bins_query = FixedStatement(select(func.count()).select_from(uploaded_bins).add_cte(*merge_ctes(uploaded_bins)))
+
+#bins: (user_id, month, bin) -> [count, sum, min, max], written to both sketch tables in one statement
+@timed_statement
+async def upsert_bins(session: AsyncSession, bins: Dict[tuple[int, datetime, int], list]) -> None:
+    if not bins:
+        return
+    keys = sorted(bins)
+    await upsert_bins_query.execute(
+        session,
+        user_ids=[user_id for user_id, _, _ in keys],
+        buckets=[bucket for _, bucket, _ in keys],
+        bins=[bin for _, _, bin in keys],
+        counts=[bins[key][0] for key in keys],
+        sums=[bins[key][1] for key in keys],
+        mins=[bins[key][2] for key in keys],
+        maxes=[bins[key][3] for key in keys],
+    )
+
+#build the sketches from transactions when they are empty, e.g. first start after they were introduced or turned on, no-op otherwise
+async def backfill_sketches(conn: AsyncConnection) -> None:
+    if not amount_sketches_enabled:
+        return
+    rows = binned(Transaction.__table__)
+    #the NOT EXISTS is evaluated once up front, so on every later start this costs a single index probe
+    await conn.execute(merge_sketches(UserAmountSketch, rows, ["user_id", "bucket"], ~select(UserAmountSketch.bucket).correlate(None).exists()))
+    await conn.execute(merge_sketches(AmountSketch, rows, ["bucket"], ~select(AmountSketch.bucket).correlate(None).exists()))
+
+def floor_month(value: datetime) -> datetime:
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def ceil_month(value: datetime) -> datetime:
+    floored = floor_month(value)
+    if floored == value:
+        return floored
+    return floored.replace(year=floored.year + floored.month // 12, month=floored.month % 12 + 1)
+
+#sketches are per month, an approximate summary covers the whole months the window touches: start down to the 1st, end up to the next 1st
+def approx_window(start: Optional[datetime], end: Optional[datetime]) -> tuple[Optional[datetime], Optional[datetime]]:
+    return (floor_month(start) if start else None, ceil_month(end) if end else None)
+
+def window_bounds(start: Optional[datetime], end: Optional[datetime]) -> Dict[str, datetime]:
+    start, end = approx_window(start, end)
+    return {"start": start or window_floor, "end": end or window_ceiling}
+
+#(count, min, max, mean, {p50, p95, p99}) of sketch rows (bins, counts, count, sum, min, max)
+#a percentile is the estimate of the bin holding that rank, clamped to the window's min/max
+def summarise(rows: Iterable[Sequence]) -> tuple[int, Optional[Decimal], Optional[Decimal], Optional[Decimal], Dict[str, Optional[Decimal]]]:
+    rows = list(rows)
+    total = sum(count for _, _, count, _, _, _ in rows)
+    if not total:
+        return 0, None, None, None, {name: None for name in percentiles}
+
+    counts: Counter = Counter()
+    for bins, bin_counts, *_ in rows:
+        for bin, count in zip(bins, bin_counts):
+            counts[bin] += count
+    amount_sum = sum(amount_sum for _, _, _, amount_sum, _, _ in rows)
+    minimum = min(amount_min for _, _, _, _, amount_min, _ in rows)
+    maximum = max(amount_max for _, _, _, _, _, amount_max in rows)
+
+    values = {}
+    for name, quantile in percentiles.items():
+        #0-based rank of the percentile, the same lower-nearest-rank the exact percentile_disc would pick
+        rank = math.ceil(quantile * total) - 1
+        seen = 0
+        for bin in sorted(counts):
+            seen += counts[bin]
+            if seen > rank:
+                estimate = Decimal(bin_value(bin)).quantize(Decimal("0.01"))
+                values[name] = min(max(estimate, minimum), maximum)
+                break
+    return total, minimum, maximum, amount_sum / total, values
+
+def sketch_rows(table, *conditions, by_user: bool = False):
+    keys = [table.user_id] if by_user else []
+    return select(
+        *keys,
+        table.bins,
+        table.counts,
+        table.transaction_count,
+        table.amount_sum,
+        table.amount_min,
+        table.amount_max,
+    ).where(
+        *conditions,
+        table.bucket >= bindparam("start", type_=DateTime),
+        table.bucket < bindparam("end", type_=DateTime),
+    )
+
+user_sketches_query = FixedStatement(sketch_rows(UserAmountSketch, UserAmountSketch.user_id == bindparam("user_id", type_=Integer)))
+batch_sketches_query = FixedStatement(sketch_rows(UserAmountSketch, UserAmountSketch.user_id == any_(bindparam("user_ids", type_=ARRAY(Integer))), by_user=True))
+all_sketches_query = FixedStatement(sketch_rows(AmountSketch))
+
+async def fetch_approx_summary(session: AsyncSession, user_id: int, start: Optional[datetime], end: Optional[datetime]):
+    result = await user_sketches_query.execute(session, user_id=user_id, **window_bounds(start, end))
+    return summarise(result)
+
+#{user_id: summarise(...)}, users without data are left out
+async def fetch_approx_batch_summary(session: AsyncSession, user_ids: List[int], start: Optional[datetime], end: Optional[datetime]):
+    result = await batch_sketches_query.execute(session, user_ids=user_ids, **window_bounds(start, end))
+    rows: Dict[int, list] = {}
+    for user_id, *row in result:
+        rows.setdefault(user_id, []).append(row)
+    return {user_id: summarise(user_rows) for user_id, user_rows in rows.items()}
+
+async def fetch_approx_overall_summary(session: AsyncSession, start: Optional[datetime], end: Optional[datetime]):
+    result = await all_sketches_query.execute(session, **window_bounds(start, end))
+    return summarise(result)
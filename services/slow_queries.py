@@ -0,0 +1,159 @@
+import asyncio
+import collections
+import itertools
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Sequence, Set
+from sqlalchemy import pool
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+logger = logging.getLogger(__name__)
+
+#statements slower than SLOW_QUERY_MS are kept in a ring buffer with their plan, served at GET /debug/slow-queries
+#the plan is captured after the statement has finished, on a connection of its own, so the slow request isn't delayed further
+#a read-only statement is re-run with EXPLAIN (ANALYZE, BUFFERS) in a read-only transaction, anything that writes is only planned (plain EXPLAIN),
+#so nothing is executed twice. COPY goes around SQLAlchemy and is never captured
+
+#0 (default) disables the capture, no event listeners are attached then
+slow_query_ms = float(os.getenv("SLOW_QUERY_MS", "0"))
+slow_query_buffer = int(os.getenv("SLOW_QUERY_BUFFER", "100"))
+#the same SQL is explained at most once per interval, the other captures of it only keep the duration
+slow_query_explain_interval = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", "60"))
+slow_query_explain_timeout_ms = int(os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT_MS", "10000"))
+
+slow_queries_enabled = slow_query_ms > 0
+
+@dataclass
+class SlowQuery:
+    id: int
+    captured_at: datetime
+    duration_ms: float
+    statement: str
+    #types only, the values never leave the request
+    parameters: List[str]
+    executemany: bool
+    #pending, explained, analyzed, skipped or failed
+    plan_status: str = "pending"
+    plan: Optional[str] = None
+    #indexes the plan reads, e.g. to spot /summary no longer using ix_transactions_user_ts
+    indexes: List[str] = field(default_factory=list)
+    plan_error: Optional[str] = None
+
+def redact(parameters: Any) -> List[str]:
+    if isinstance(parameters, dict):
+        return [f"{name}: {type(value).__name__}" for name, value in parameters.items()]
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return []
+
+index_pattern = re.compile(r" using (\S+)", re.IGNORECASE)
+
+def plan_indexes(plan: str) -> List[str]:
+    return sorted(set(index_pattern.findall(plan)))
+
+class SlowQueryLog:
+    def __init__(self, size: int):
+        self.entries: Deque[SlowQuery] = collections.deque(maxlen=size)
+        self.ids = itertools.count(1)
+        #statement -> when it was last explained
+        self.explained_at: Dict[str, float] = {}
+        #explains in flight, one at a time, captures during one are not explained
+        self.explaining = False
+        self.tasks: Set[asyncio.Task] = set()
+        self.explain_engine: Optional[AsyncEngine] = None
+
+    def list(self, limit: Optional[int] = None) -> List[SlowQuery]:
+        entries = list(reversed(self.entries))
+        return entries[:limit] if limit else entries
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.explained_at.clear()
+
+    def capture(self, statement: str, parameters: Any, duration: float, executemany: bool) -> None:
+        entry = SlowQuery(
+            id=next(self.ids),
+            captured_at=datetime.utcnow(),
+            duration_ms=round(duration * 1000, 3),
+            statement=statement,
+            parameters=redact(parameters[0] if executemany and parameters else parameters),
+            executemany=executemany,
+        )
+        self.entries.append(entry)
+        logger.warning("slow query (%.1f ms): %s", entry.duration_ms, " ".join(statement.split())[:200])
+
+        now = time.monotonic()
+        if executemany or self.explaining or now - self.explained_at.get(statement, -slow_query_explain_interval) < slow_query_explain_interval:
+            entry.plan_status = "skipped"
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            entry.plan_status = "skipped"
+            return
+        self.explaining = True
+        self.explained_at[statement] = now
+        task = loop.create_task(self.explain(entry, statement, parameters))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def explain(self, entry: SlowQuery, statement: str, parameters: Any) -> None:
+        try:
+            #no pool: connections are only needed for the odd slow statement, and the app's pool is never drawn from
+            if self.explain_engine is None:
+                from database import DATABASE_URL
+                self.explain_engine = create_async_engine(DATABASE_URL, poolclass=pool.NullPool)
+            async with self.explain_engine.connect() as conn:
+                driver_connection = (await conn.get_raw_connection()).driver_connection
+                arguments: Sequence[Any] = parameters if isinstance(parameters, (list, tuple)) else ()
+                entry.plan, entry.plan_status = await explain_statement(driver_connection, statement, arguments)
+                entry.indexes = plan_indexes(entry.plan)
+        except Exception as error:
+            #e.g. a statement on a TEMP staging table, which only the uploading connection can see
+            entry.plan_status = "failed"
+            entry.plan_error = str(error)
+        finally:
+            self.explaining = False
+
+#(plan text, status), statement is in the driver's own form ($1, $2, ...) with its positional arguments
+async def explain_statement(driver_connection, statement: str, arguments: Sequence[Any]) -> tuple[str, str]:
+    async with driver_connection.transaction(readonly=True):
+        await driver_connection.execute(f"SET LOCAL statement_timeout = {slow_query_explain_timeout_ms}")
+        try:
+            async with driver_connection.transaction():
+                rows = await driver_connection.fetch(f"EXPLAIN (ANALYZE, BUFFERS) {statement}", *arguments)
+            return "\n".join(row[0] for row in rows), "analyzed"
+        except Exception as error:
+            #25006 read_only_sql_transaction: it writes, plan it without running it
+            if getattr(error, "sqlstate", None) != "25006":
+                raise
+        rows = await driver_connection.fetch(f"EXPLAIN {statement}", *arguments)
+        return "\n".join(row[0] for row in rows), "explained"
+
+slow_query_log = SlowQueryLog(slow_query_buffer)
+
+#hooks the engine's cursor events, no-op unless SLOW_QUERY_MS is set
+def capture_slow_queries(engine: AsyncEngine) -> None:
+    if not slow_queries_enabled:
+        return
+    from sqlalchemy import event
+    threshold = slow_query_ms / 1000
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("slow_query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info["slow_query_started"].pop()
+        if duration >= threshold:
+            slow_query_log.capture(statement, parameters, duration, executemany)
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def handle_error(context):
+        if context.connection is not None and context.connection.info.get("slow_query_started"):
+            context.connection.info["slow_query_started"].pop()
@@ -0,0 +1,28 @@
+from typing import Any, Dict, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+
+#a statement of fixed shape, built once at import and compiled once per dialect, then run with exec_driver_sql
+#per call that skips building the select, computing its cache key and the compiled-cache lookup, only the parameters are bound
+#asyncpg still prepares it once per connection (prepared_statement_cache_size, see database.py) and reuses it after that
+#result rows come back as the driver returns them (Decimal, int, datetime), there are no SQLAlchemy result processors on this path
+
+class FixedStatement:
+    def __init__(self, statement):
+        self.statement = statement
+        #(dialect class, paramstyle) -> (SQL, positional parameter names or None, default values e.g. of literals)
+        self.compiled: Dict[Any, Tuple[str, Any, Dict[str, Any]]] = {}
+
+    def compile_for(self, dialect) -> Tuple[str, Any, Dict[str, Any]]:
+        key = (type(dialect), dialect.paramstyle)
+        compiled = self.compiled.get(key)
+        if compiled is None:
+            result = self.statement.compile(dialect=dialect)
+            names = tuple(result.positiontup) if result.positional else None
+            compiled = self.compiled[key] = (str(result), names, dict(result.params))
+        return compiled
+
+    async def execute(self, session: AsyncSession, **parameters: Any):
+        conn = await session.connection()
+        sql, names, defaults = self.compile_for(conn.dialect)
+        values = {**defaults, **parameters}
+        return await conn.exec_driver_sql(sql, tuple(values[name] for name in names) if names is not None else values)
@@ -0,0 +1,164 @@
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+#cache in front of the summary queries, keyed by (user_id, start, end)
+#results only change when an upload inserts rows for that user, so uploads invalidate exactly the users they touched
+#the in-process backend is per worker, with several uvicorn workers the other workers only catch up after the TTL, a shared backend can be plugged in with set_summary_cache
+
+#(count, min, max, mean), count 0 is cached too, it is answered with a 404
+SummaryValue = Tuple[int, Optional[Decimal], Optional[Decimal], Optional[Decimal]]
+SummaryKey = Tuple[int, Optional[datetime], Optional[datetime]]
+
+summary_cache_backend = os.getenv("SUMMARY_CACHE_BACKEND", "memory")
+summary_cache_ttl = float(os.getenv("SUMMARY_CACHE_TTL", "300"))
+summary_cache_size = int(os.getenv("SUMMARY_CACHE_SIZE", "10000"))
+
+#interface a backend must implement
+class SummaryCache(ABC):
+    #current generation of a user, read it BEFORE running the query and hand it to set()
+    @abstractmethod
+    def generation(self, user_id: int) -> int: ...
+
+    #None on a miss
+    @abstractmethod
+    def get(self, key: SummaryKey) -> Optional[SummaryValue]: ...
+
+    #must not store anything if the user was invalidated since generation was read, the value may predate the upload
+    @abstractmethod
+    def set(self, key: SummaryKey, value: SummaryValue, generation: int) -> None: ...
+
+    #call after the upload has committed
+    @abstractmethod
+    def invalidate_users(self, user_ids: Iterable[int]) -> None: ...
+
+    @abstractmethod
+    def clear(self) -> None: ...
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]: ...
+
+#TTL + LRU dict, per worker
+class InProcessSummaryCache(SummaryCache):
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        #key -> (expires at, generation, value), most recently used at the end
+        self.entries: OrderedDict[SummaryKey, Tuple[float, int, SummaryValue]] = OrderedDict()
+        #keys per user, so invalidation doesn't scan the whole cache
+        self.keys_by_user: Dict[int, set] = {}
+        self.generations: Dict[int, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def generation(self, user_id: int) -> int:
+        return self.generations.get(user_id, 0)
+
+    def get(self, key: SummaryKey) -> Optional[SummaryValue]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, generation, value = entry
+        if expires_at < time.monotonic() or generation != self.generation(key[0]):
+            self.remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key: SummaryKey, value: SummaryValue, generation: int) -> None:
+        if generation != self.generation(key[0]):
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, generation, value)
+        self.entries.move_to_end(key)
+        self.keys_by_user.setdefault(key[0], set()).add(key)
+        while len(self.entries) > self.max_size:
+            oldest = next(iter(self.entries))
+            self.remove(oldest)
+            self.evictions += 1
+
+    def invalidate_users(self, user_ids: Iterable[int]) -> None:
+        for user_id in user_ids:
+            self.generations[user_id] = self.generation(user_id) + 1
+            for key in self.keys_by_user.pop(user_id, ()):
+                if self.entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def remove(self, key: SummaryKey) -> None:
+        self.entries.pop(key, None)
+        keys = self.keys_by_user.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.keys_by_user[key[0]]
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.keys_by_user.clear()
+        #bump every generation seen so far, so in-flight queries can't repopulate
+        for user_id in self.generations:
+            self.generations[user_id] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "memory",
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+#backend that never stores anything, SUMMARY_CACHE_BACKEND=none
+class NullSummaryCache(SummaryCache):
+    def __init__(self):
+        self.misses = 0
+
+    def generation(self, user_id: int) -> int:
+        return 0
+
+    def get(self, key: SummaryKey) -> Optional[SummaryValue]:
+        self.misses += 1
+        return None
+
+    def set(self, key: SummaryKey, value: SummaryValue, generation: int) -> None:
+        pass
+
+    def invalidate_users(self, user_ids: Iterable[int]) -> None:
+        pass
+
+    def clear(self) -> None:
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": "none", "size": 0, "hits": 0, "misses": self.misses, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+def build_summary_cache(backend: str) -> SummaryCache:
+    if backend == "memory":
+        return InProcessSummaryCache(summary_cache_size, summary_cache_ttl)
+    if backend == "none":
+        return NullSummaryCache()
+    raise ValueError(f"Unknown SUMMARY_CACHE_BACKEND: {backend}")
+
+summary_cache: SummaryCache = build_summary_cache(summary_cache_backend)
+
+def get_summary_cache() -> SummaryCache:
+    return summary_cache
+
+#plug in another backend, e.g. a shared one, at startup
+def set_summary_cache(cache: SummaryCache) -> None:
+    global summary_cache
+    summary_cache = cache
@@ -0,0 +1,260 @@
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Optional, List, Dict
+from sqlalchemy import select, func, union_all, cast, literal_column, any_, bindparam, true, BigInteger, Integer, DateTime, text
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession, AsyncConnection
+from models.models import Transaction, UserDailyRollup
+from services.summary_cache import get_summary_cache
+from services.statements import FixedStatement
+
+#rollup bucket width, must match the date_trunc('day', ...) in upload_services.inserted_rollups
+bucket_width = timedelta(days=1)
+
+def floor_bucket(value: datetime) -> datetime:
+    return value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def ceil_bucket(value: datetime) -> datetime:
+    floored = floor_bucket(value)
+    return floored if floored == value else floored + bucket_width
+
+#split [start, end) into whole buckets answered from the rollups and partial edges scanned from transactions
+#returns (first whole bucket, end of whole buckets, raw ranges), a None bound means unbounded, first > end means no whole buckets
+def split_window(start: Optional[datetime], end: Optional[datetime]) -> tuple[Optional[datetime], Optional[datetime], list[tuple[Optional[datetime], Optional[datetime]]]]:
+    rollup_start = ceil_bucket(start) if start else None
+    rollup_end = floor_bucket(end) if end else None
+
+    #window inside a single bucket, nothing whole to read from the rollups
+    if rollup_start and rollup_end and rollup_start >= rollup_end:
+        return rollup_start, rollup_end, [(start, end)]
+
+    raw_ranges: list[tuple[Optional[datetime], Optional[datetime]]] = []
+    if start and start < rollup_start:
+        raw_ranges.append((start, rollup_start))
+    if end and rollup_end < end:
+        raw_ranges.append((rollup_end, end))
+    return rollup_start, rollup_end, raw_ranges
+
+#every window maps onto the same bound parameters: whole buckets [rollup_start, rollup_end) from the rollups, plus two edge ranges from transactions
+#a part the window doesn't need gets an empty range and an open end the lowest/highest timestamp, so the statement text never depends on the window
+#and one prepared statement per shape serves every request
+window_floor = datetime(1, 1, 1)
+window_ceiling = datetime(9999, 12, 31)
+
+def window_parameters(start: Optional[datetime], end: Optional[datetime]) -> Dict[str, datetime]:
+    rollup_start, rollup_end, raw_ranges = split_window(start, end)
+    parameters = {"rollup_start": rollup_start or window_floor, "rollup_end": rollup_end or window_ceiling}
+    #window inside a single bucket
+    if parameters["rollup_start"] >= parameters["rollup_end"]:
+        parameters["rollup_end"] = parameters["rollup_start"]
+    edges = raw_ranges + [(window_floor, window_floor)] * (2 - len(raw_ranges))
+    for edge, (raw_start, raw_end) in zip(("first", "second"), edges):
+        parameters[f"{edge}_start"] = raw_start or window_floor
+        parameters[f"{edge}_end"] = raw_end or window_ceiling
+    return parameters
+
+def window_bound(name: str):
+    return bindparam(name, type_=DateTime)
+
+#the rollup part and the two edge parts, each giving (count, sum, min, max), grouped by rollup_group/raw_group ({name: expression}, e.g. user_id or period) if given
+def summary_parts(rollup_condition, raw_condition, rollup_group: Optional[dict] = None, raw_group: Optional[dict] = None) -> list:
+    rollup_group, raw_group = rollup_group or {}, raw_group or {}
+    parts = [
+        select(
+            *[expression.label(name) for name, expression in rollup_group.items()],
+            func.sum(UserDailyRollup.transaction_count).label("total"),
+            func.sum(UserDailyRollup.amount_sum).label("amount_sum"),
+            func.min(UserDailyRollup.amount_min).label("min_amount"),
+            func.max(UserDailyRollup.amount_max).label("max_amount"),
+        ).where(
+            rollup_condition,
+            UserDailyRollup.bucket >= window_bound("rollup_start"),
+            UserDailyRollup.bucket < window_bound("rollup_end"),
+        ).group_by(*rollup_group.values())
+    ]
+    for edge in ("first", "second"):
+        #served by ix_transactions_user_ts, an empty range is a single index probe
+        parts.append(
+            select(
+                *[expression.label(name) for name, expression in raw_group.items()],
+                func.count().label("total"),
+                func.sum(Transaction.transaction_amount).label("amount_sum"),
+                func.min(Transaction.transaction_amount).label("min_amount"),
+                func.max(Transaction.transaction_amount).label("max_amount"),
+            ).where(
+                raw_condition,
+                Transaction.timestamp >= window_bound(f"{edge}_start"),
+                Transaction.timestamp < window_bound(f"{edge}_end"),
+            ).group_by(*raw_group.values())
+        )
+    return parts
+
+user_id_parameter = bindparam("user_id", type_=Integer)
+user_ids_parameter = bindparam("user_ids", type_=ARRAY(Integer))
+
+#count/min/max/mean for one user over [start, end), same numbers as aggregating the raw rows
+#mean is sum / count in SQL, which is exactly how PostgreSQL computes avg(numeric), so it matches the old avg() to the last digit
+def summary_statement():
+    parts = union_all(*summary_parts(UserDailyRollup.user_id == user_id_parameter, Transaction.user_id == user_id_parameter)).subquery()
+    total = func.sum(parts.c.total)
+    return select(
+        cast(func.coalesce(total, 0), BigInteger).label("total"),
+        func.min(parts.c.min_amount).label("min_amount"),
+        func.max(parts.c.max_amount).label("max_amount"),
+        (func.sum(parts.c.amount_sum) / func.nullif(total, 0)).label("mean_amount"),
+    )
+
+summary_query = FixedStatement(summary_statement())
+
+#answered from the summary cache when possible, uploads invalidate the users they touch
+async def fetch_summary(session: AsyncSession, user_id: int, start: Optional[datetime], end: Optional[datetime]) -> tuple[int, Optional[Decimal], Optional[Decimal], Optional[Decimal]]:
+    cache = get_summary_cache()
+    key = (user_id, start, end)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    #read before the query, so an upload committing meanwhile stops us caching a stale result
+    generation = cache.generation(user_id)
+    result = await summary_query.execute(session, user_id=user_id, **window_parameters(start, end))
+    total, min_amount, max_amount, mean_amount = result.one()
+    cache.set(key, (total, min_amount, max_amount, mean_amount), generation)
+    return total, min_amount, max_amount, mean_amount
+
+#same as summary_statement, for many users at once, one row per user that has data
+#user ids are bound as one array parameter (= ANY), so the statement text is the same whatever the number of users
+def batch_summary_statement():
+    parts = union_all(*summary_parts(
+        UserDailyRollup.user_id == any_(user_ids_parameter), Transaction.user_id == any_(user_ids_parameter),
+        rollup_group={"user_id": UserDailyRollup.user_id}, raw_group={"user_id": Transaction.user_id},
+    )).subquery()
+    total = func.sum(parts.c.total)
+    return select(
+        parts.c.user_id,
+        cast(total, BigInteger).label("total"),
+        func.min(parts.c.min_amount).label("min_amount"),
+        func.max(parts.c.max_amount).label("max_amount"),
+        (func.sum(parts.c.amount_sum) / func.nullif(total, 0)).label("mean_amount"),
+    ).group_by(parts.c.user_id).having(total > 0)
+
+batch_summary_query = FixedStatement(batch_summary_statement())
+
+#{user_id: (count, min, max, mean)}, users without data are left out
+#cached users are answered from the summary cache, only the misses go to the grouped query
+async def fetch_batch_summary(session: AsyncSession, user_ids: List[int], start: Optional[datetime], end: Optional[datetime]) -> Dict[int, tuple[int, Optional[Decimal], Optional[Decimal], Optional[Decimal]]]:
+    cache = get_summary_cache()
+    results = {}
+    generations = {}
+    for user_id in user_ids:
+        cached = cache.get((user_id, start, end))
+        if cached is None:
+            generations[user_id] = cache.generation(user_id)
+        elif cached[0]:
+            results[user_id] = cached
+
+    if generations:
+        result = await batch_summary_query.execute(session, user_ids=list(generations), **window_parameters(start, end))
+        fetched = {user_id: (total, min_amount, max_amount, mean_amount) for user_id, total, min_amount, max_amount, mean_amount in result}
+        for user_id, generation in generations.items():
+            #users without rows are cached as a zero count, same as the single-user path
+            value = fetched.get(user_id, (0, None, None, None))
+            cache.set((user_id, start, end), value, generation)
+            if value[0]:
+                results[user_id] = value
+    return results
+
+#same as summary_statement over all users, the edges scan every user's transactions in them
+def overall_summary_statement():
+    parts = union_all(*summary_parts(true(), true())).subquery()
+    total = func.sum(parts.c.total)
+    return select(
+        cast(func.coalesce(total, 0), BigInteger).label("total"),
+        func.min(parts.c.min_amount).label("min_amount"),
+        func.max(parts.c.max_amount).label("max_amount"),
+        (func.sum(parts.c.amount_sum) / func.nullif(total, 0)).label("mean_amount"),
+    )
+
+overall_summary_query = FixedStatement(overall_summary_statement())
+
+async def fetch_overall_summary(session: AsyncSession, start: Optional[datetime], end: Optional[datetime]) -> tuple[int, Optional[Decimal], Optional[Decimal], Optional[Decimal]]:
+    result = await overall_summary_query.execute(session, **window_parameters(start, end))
+    total, min_amount, max_amount, mean_amount = result.one()
+    return total, min_amount, max_amount, mean_amount
+
+#count/min/max/mean per day, week (ISO, starting Monday) or month, one row per period with data, in time order
+#whole days come from the rollups (a day never straddles a week or month), only the partial edge days are scanned from transactions
+def series_statement(interval: str):
+    #a literal keeps GROUP BY and the select list on the same expression, one statement per interval
+    unit = literal_column(f"'{interval}'")
+    periods = union_all(*summary_parts(
+        UserDailyRollup.user_id == user_id_parameter, Transaction.user_id == user_id_parameter,
+        rollup_group={"period": func.date_trunc(unit, UserDailyRollup.bucket)}, raw_group={"period": func.date_trunc(unit, Transaction.timestamp)},
+    )).subquery()
+    total = func.sum(periods.c.total)
+    return select(
+        periods.c.period,
+        cast(total, BigInteger).label("total"),
+        func.min(periods.c.min_amount).label("min_amount"),
+        func.max(periods.c.max_amount).label("max_amount"),
+        (func.sum(periods.c.amount_sum) / func.nullif(total, 0)).label("mean_amount"),
+    ).group_by(periods.c.period).having(total > 0).order_by(periods.c.period)
+
+#interval is validated by the router
+series_queries = {interval: FixedStatement(series_statement(interval)) for interval in ("day", "week", "month")}
+
+async def fetch_series(session: AsyncSession, user_id: int, interval: str, start: Optional[datetime], end: Optional[datetime]) -> List[tuple[datetime, int, Optional[Decimal], Optional[Decimal], Optional[Decimal]]]:
+    result = await series_queries[interval].execute(session, user_id=user_id, **window_parameters(start, end))
+    return [tuple(row) for row in result]
+
+#count/min/max/mean for one product over [start, end), served by ix_transactions_product_ts
+#an open end is bound as the lowest/highest timestamp, so there is one statement whatever the window
+product_summary_query = FixedStatement(
+    select(
+        func.count().label("total"),
+        func.min(Transaction.transaction_amount).label("min_amount"),
+        func.max(Transaction.transaction_amount).label("max_amount"),
+        func.avg(Transaction.transaction_amount).label("mean_amount"),
+    ).where(
+        Transaction.product_id == bindparam("product_id", type_=Integer),
+        Transaction.timestamp >= window_bound("start"),
+        Transaction.timestamp < window_bound("end"),
+    )
+)
+
+async def fetch_product_summary(session: AsyncSession, product_id: int, start: Optional[datetime], end: Optional[datetime]) -> tuple[int, Optional[Decimal], Optional[Decimal], Optional[Decimal]]:
+    result = await product_summary_query.execute(session, product_id=product_id, start=start or window_floor, end=end or window_ceiling)
+    total, min_amount, max_amount, mean_amount = result.one()
+    return total, min_amount, max_amount, mean_amount
+
+#top products by revenue (sum of amounts) or by transaction count, ranked and cut in the DB, only `limit` rows come back
+#ties are broken by product_id so the ranking is stable
+def top_products_statement(by: str, limit: int, start: Optional[datetime], end: Optional[datetime]):
+    conditions = []
+    if start:
+        conditions.append(Transaction.timestamp >= start)
+    if end:
+        conditions.append(Transaction.timestamp < end)
+    total = func.count().label("total")
+    revenue = func.sum(Transaction.transaction_amount).label("revenue")
+    order = revenue if by == "revenue" else total
+    return (
+        select(Transaction.product_id, total, revenue)
+        .where(*conditions)
+        .group_by(Transaction.product_id)
+        .order_by(order.desc(), Transaction.product_id)
+        .limit(limit)
+    )
+
+async def fetch_top_products(session: AsyncSession, by: str, limit: int, start: Optional[datetime], end: Optional[datetime]) -> List[tuple[int, int, Decimal]]:
+    result = await session.execute(top_products_statement(by, limit, start, end))
+    return [tuple(row) for row in result]
+
+#rebuild the rollups from transactions when the table is empty, e.g. first start after the rollups were introduced
+#the NOT EXISTS is evaluated once up front, so on every later start this costs a single index probe
+async def backfill_rollups(conn: AsyncConnection) -> None:
+    await conn.execute(text(
+        "INSERT INTO user_daily_rollups (user_id, bucket, transaction_count, amount_sum, amount_min, amount_max) "
+        "SELECT user_id, date_trunc('day', timestamp), count(*), sum(transaction_amount), min(transaction_amount), max(transaction_amount) "
+        "FROM transactions WHERE NOT EXISTS (SELECT 1 FROM user_daily_rollups) "
+        "GROUP BY 1, 2"
+    ))
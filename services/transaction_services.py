@@ -0,0 +1,55 @@
+import base64
+import uuid
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+from fastapi import HTTPException
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.models import Transaction, transactions_compact
+
+#keyset pagination of a user's transactions on (timestamp, id), oldest first
+#a page starts right after the last row of the previous one instead of skipping OFFSET rows, so page 1000 costs the same as page 1
+
+#breaks ties between rows with the same timestamp, the compact layout has no serial id
+tiebreak = Transaction.transaction_id if transactions_compact else Transaction.id
+
+#opaque to clients, urlsafe base64 of "<timestamp iso>|<id>"
+def encode_cursor(timestamp: datetime, id: int | uuid.UUID) -> str:
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{id}".encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int | uuid.UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        timestamp, id = raw.split("|")
+        return datetime.fromisoformat(timestamp), uuid.UUID(id) if transactions_compact else int(id)
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f"Invalid cursor: {cursor}")
+
+#one page plus one extra row, the extra row only tells whether there is a next page
+def transaction_page_statement(user_id: int, after: Optional[Tuple[datetime, int | uuid.UUID]], limit: int, start: Optional[datetime], end: Optional[datetime]):
+    conditions = [Transaction.user_id == user_id]
+    if start:
+        conditions.append(Transaction.timestamp >= start)
+    if end:
+        conditions.append(Transaction.timestamp < end)
+    if after:
+        after_timestamp, after_id = after
+        #the plain timestamp bound lets the ix_transactions_user_ts range scan start at the cursor, the row comparison breaks ties on id
+        conditions.append(Transaction.timestamp >= after_timestamp)
+        conditions.append(tuple_(Transaction.timestamp, tiebreak) > tuple_(after_timestamp, after_id))
+    return (
+        select(tiebreak.label("tiebreak"), Transaction.transaction_id, Transaction.product_id, Transaction.timestamp, Transaction.transaction_amount)
+        .where(*conditions)
+        .order_by(Transaction.timestamp, tiebreak)
+        .limit(limit + 1)
+    )
+
+#(rows of the page, cursor of the next page or None)
+async def fetch_transaction_page(session: AsyncSession, user_id: int, after: Optional[str], limit: int, start: Optional[datetime], end: Optional[datetime]) -> Tuple[List[Any], Optional[str]]:
+    result = await session.execute(transaction_page_statement(user_id, decode_cursor(after) if after else None, limit, start, end))
+    rows = result.all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(last.timestamp, last.tiebreak)
@@ -1,13 +1,20 @@
+import io
 import uuid
+from dataclasses import dataclass, field
 from datetime import datetime
 from decimal import Decimal, InvalidOperation
-from typing import List, Dict, Any, Set
+from typing import List, Dict, Any, Set, Optional
 from fastapi import HTTPException               
+from sqlalchemy import text, select, func, literal_column, values, column, bindparam, Integer, BigInteger, DateTime, Numeric
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID, ARRAY
 from sqlalchemy.ext.asyncio import AsyncSession
 
 #using insert here rather than sqlalchemy.sql.insert because want to use On Conflict Do Nothing, which is a PostgreSql-specific feature
 from sqlalchemy.dialects.postgresql import insert
-from models.models import User, Product, Transaction
+from models.models import User, Product, Transaction, TransactionKey, UserDailyRollup, transactions_partitioned
+from services.metrics import timed_statement
+from services.statements import FixedStatement
+from services.sketches import sketch_inserted, inserted_bin, upsert_bins, floor_month
 
 #parsed from csv.DictReader, which gives Dict[str, str]
 def transform_row(row:Dict[str, str]):
@@ -57,46 +64,303 @@ def transform_row(row:Dict[str, str]):
         "transaction_amount": transaction_amount,
     }
 
+#INSERT INTO users (id) SELECT unnest($1::INTEGER[]) ON CONFLICT (id) DO NOTHING
+#the ids are bound as one array, so the SQL is the same for every batch size and is compiled and prepared once, not once per distinct count
+#insert is imported from sqlalchemy.dialects.postgresql
+#.on_conflict_do_nothing for if a row with the same id already exists, just skip it. Don’t throw an error.
+upsert_users_query = FixedStatement(
+    insert(User)
+    .from_select(["id"], select(func.unnest(bindparam("ids", type_=ARRAY(Integer)))))
+    .on_conflict_do_nothing(index_elements=[User.id])
+)
+
+upsert_products_query = FixedStatement(
+    insert(Product)
+    .from_select(["id"], select(func.unnest(bindparam("ids", type_=ARRAY(Integer)))))
+    .on_conflict_do_nothing(index_elements=[Product.id])
+)
+
+@timed_statement
 async def upsert_users(session: AsyncSession, user_ids: Set[int]) -> int:
     if not user_ids:
         return 0
-    sql = (
-        #insert is imported from sqlalchemy.dialects.postgresql
-        #insert to User table
-        #INSERT INTO users (id) VALUES (101), (102), (103)
-        #.on_conflict_do_nothing for if a row with the same id already exists, just skip it. Don’t throw an error.
-        insert(User)
-        .values([{"id": user_id} for user_id in user_ids])
-        .on_conflict_do_nothing(index_elements=[User.id])
-    )
-
-    result = await session.execute(sql)
+    result = await upsert_users_query.execute(session, ids=list(user_ids))
     return result.rowcount or 0
 
 #upsert products
+@timed_statement
 async def upsert_products(session: AsyncSession, product_ids: Set[int]) -> int:
     if not product_ids:
         return 0
-    sql = (
-        insert(Product)
-        .values([{"id": product_id} for product_id in product_ids])
-        .on_conflict_do_nothing(index_elements=[Product.id])
+    result = await upsert_products_query.execute(session, ids=list(product_ids))
+    return result.rowcount or 0
+
+    
+#INSERT INTO user_daily_rollups (user_id, bucket, count, sum, min, max) SELECT ... ON CONFLICT DO UPDATE adding them to the existing buckets
+def upsert_rollup_rows(rows):
+    sql = insert(UserDailyRollup).from_select(["user_id", "bucket", "transaction_count", "amount_sum", "amount_min", "amount_max"], rows)
+    return sql.on_conflict_do_update(
+        index_elements=[UserDailyRollup.user_id, UserDailyRollup.bucket],
+        set_={
+            "transaction_count": UserDailyRollup.transaction_count + sql.excluded.transaction_count,
+            "amount_sum": UserDailyRollup.amount_sum + sql.excluded.amount_sum,
+            "amount_min": func.least(UserDailyRollup.amount_min, sql.excluded.amount_min),
+            "amount_max": func.greatest(UserDailyRollup.amount_max, sql.excluded.amount_max),
+        },
     )
 
-    result = await session.execute(sql)
+#user_id, bucket, count, sum, min, max per user and day of the rows returned by an INSERT ... RETURNING user_id, timestamp, transaction_amount CTE
+#only rows that were really inserted come back from RETURNING, so duplicates are never counted twice
+def inserted_rollups(inserted):
+    #literal, not a bound parameter, otherwise GROUP BY sees two different $n parameters and rejects the select
+    bucket = func.date_trunc(literal_column("'day'"), inserted.c.timestamp)
+    return (
+        select(
+            inserted.c.user_id,
+            bucket,
+            func.count(),
+            func.sum(inserted.c.transaction_amount),
+            func.min(inserted.c.transaction_amount),
+            func.max(inserted.c.transaction_amount),
+        )
+        .group_by(inserted.c.user_id, bucket)
+        #same lock order in concurrent uploads, so they can't deadlock on each other's buckets
+        .order_by(inserted.c.user_id, bucket)
+    )
+
+#user_id, day, sketch bin, count, sum, min, max of the rows an insert mode batch inserted, summed into InsertedTotals
+#the bin is NULL unless AMOUNT_SKETCHES=1, every user and day is then a single group like in inserted_rollups
+def inserted_totals(inserted):
+    keyed = select(
+        inserted.c.user_id,
+        func.date_trunc(literal_column("'day'"), inserted.c.timestamp).label("bucket"),
+        inserted_bin(inserted.c.transaction_amount).label("bin"),
+        inserted.c.transaction_amount,
+    ).subquery("keyed")
+    return select(
+        keyed.c.user_id,
+        keyed.c.bucket,
+        keyed.c.bin,
+        func.count(),
+        func.sum(keyed.c.transaction_amount),
+        func.min(keyed.c.transaction_amount),
+        func.max(keyed.c.transaction_amount),
+    ).group_by(keyed.c.user_id, keyed.c.bucket, keyed.c.bin)
+
+#rolls the inserted rows up into user_daily_rollups as another CTE of the same statement, for the merges that insert a whole upload at once
+def rollup_inserted(inserted):
+    return upsert_rollup_rows(inserted_rollups(inserted)).cte("rolled_up")
+
+#[transaction_count, amount_sum, amount_min, amount_max] added into total, the same merge ON CONFLICT does in the tables
+def add_total(totals: Dict[tuple, list], key: tuple, count: int, amount_sum: Decimal, amount_min: Decimal, amount_max: Decimal) -> None:
+    total = totals.get(key)
+    if total is None:
+        totals[key] = [count, amount_sum, amount_min, amount_max]
+    else:
+        total[0] += count
+        total[1] += amount_sum
+        total[2] = min(total[2], amount_min)
+        total[3] = max(total[3], amount_max)
+
+#the rollups and sketch bins of the rows an insert mode upload has inserted so far
+#every batch statement returns the totals of its own rows, they are summed here and written once by upsert_inserted_totals before the commit,
+#so a rollup bucket or sketch is updated once per upload instead of once for every batch that has rows in it
+@dataclass
+class InsertedTotals:
+    #(user_id, day) -> [transaction_count, amount_sum, amount_min, amount_max]
+    rollups: Dict[tuple[int, datetime], list] = field(default_factory=dict)
+    #(user_id, month, bin) -> [transaction_count, amount_sum, amount_min, amount_max], empty unless AMOUNT_SKETCHES=1
+    bins: Dict[tuple[int, datetime, int], list] = field(default_factory=dict)
+
+    #rows of inserted_totals, returns the number of inserted transactions
+    def add(self, rows) -> int:
+        inserted = 0
+        for user_id, bucket, bin, *total in rows:
+            inserted += total[0]
+            add_total(self.rollups, (user_id, bucket), *total)
+            if bin is not None:
+                add_total(self.bins, (user_id, floor_month(bucket), bin), *total)
+        return inserted
+
+#the totals are bound as one array per column, so the statement is compiled and prepared once, like upsert_users_query
+upsert_rollups_query = FixedStatement(upsert_rollup_rows(select(
+    func.unnest(bindparam("user_ids", type_=ARRAY(Integer))),
+    func.unnest(bindparam("buckets", type_=ARRAY(DateTime))),
+    func.unnest(bindparam("counts", type_=ARRAY(BigInteger))),
+    func.unnest(bindparam("sums", type_=ARRAY(Numeric(20, 2)))),
+    func.unnest(bindparam("mins", type_=ARRAY(Numeric(12, 2)))),
+    func.unnest(bindparam("maxes", type_=ARRAY(Numeric(12, 2)))),
+)))
+
+@timed_statement
+async def upsert_rollups(session: AsyncSession, totals: Dict[tuple[int, datetime], list]) -> int:
+    if not totals:
+        return 0
+    #sorted, the same lock order as inserted_rollups
+    keys = sorted(totals)
+    result = await upsert_rollups_query.execute(
+        session,
+        user_ids=[user_id for user_id, _ in keys],
+        buckets=[bucket for _, bucket in keys],
+        counts=[totals[key][0] for key in keys],
+        sums=[totals[key][1] for key in keys],
+        mins=[totals[key][2] for key in keys],
+        maxes=[totals[key][3] for key in keys],
+    )
     return result.rowcount or 0
 
-    
-async def insert_transactions(session: AsyncSession, rows: List[Dict[str, Any]]) -> tuple[int, int]:
+async def upsert_inserted_totals(session: AsyncSession, totals: InsertedTotals) -> None:
+    await upsert_rollups(session, totals.rollups)
+    await upsert_bins(session, totals.bins)
+
+transaction_columns = ["transaction_id", "user_id", "product_id", "timestamp", "transaction_amount"]
+
+#partitioned transactions have no unique index on transaction_id, so the ids are claimed in transaction_keys first and only the claimed rows are inserted
+#rows is a CTE with the transaction columns, it must not repeat a transaction_id
+def insert_claimed(rows):
+    claimed = (
+        insert(TransactionKey)
+        .from_select(["transaction_id"], select(rows.c.transaction_id))
+        .on_conflict_do_nothing(index_elements=[TransactionKey.transaction_id])
+        .returning(TransactionKey.transaction_id)
+        .cte("claimed")
+    )
+    return (
+        insert(Transaction)
+        .from_select(transaction_columns, select(*(rows.c[name] for name in transaction_columns)).where(rows.c.transaction_id.in_(select(claimed.c.transaction_id))))
+        .returning(Transaction.user_id, Transaction.timestamp, Transaction.transaction_amount)
+        .cte("inserted")
+    )
+
+#the rollups and sketch bins of the inserted rows are added to totals, the caller writes them with upsert_inserted_totals
+@timed_statement
+async def insert_transactions(session: AsyncSession, rows: List[Dict[str, Any]], totals: InsertedTotals) -> tuple[int, int]:
     if not rows:
         return (0, 0)
-    sql = (
+    if transactions_partitioned:
+        return await insert_transactions_partitioned(session, rows, totals)
+    inserted = (
         insert(Transaction)
         .values(rows)
         .on_conflict_do_nothing(index_elements=[Transaction.transaction_id])
+        .returning(Transaction.user_id, Transaction.timestamp, Transaction.transaction_amount)
+        .cte("inserted")
     )
-
-    result = await session.execute(sql)
-    inserted_count = result.rowcount or 0
+    #one round-trip: insert and return the totals of what was inserted
+    result = await session.execute(inserted_totals(inserted))
+    inserted_count = totals.add(result)
     duplicates_ignored = len(rows) - inserted_count
     return (inserted_count, duplicates_ignored)
+
+async def insert_transactions_partitioned(session: AsyncSession, rows: List[Dict[str, Any]], totals: InsertedTotals) -> tuple[int, int]:
+    #first occurrence of each transaction_id, the one ON CONFLICT DO NOTHING would keep
+    unique_rows: Dict[uuid.UUID, Dict[str, Any]] = {}
+    for row in rows:
+        unique_rows.setdefault(row["transaction_id"], row)
+    batch = values(
+        column("transaction_id", PG_UUID(as_uuid=True)),
+        column("user_id", Integer),
+        column("product_id", Integer),
+        column("timestamp", DateTime),
+        column("transaction_amount", Numeric(12, 2)),
+        name="batch",
+    ).data([tuple(row[name] for name in transaction_columns) for row in unique_rows.values()])
+    #a CTE, so the parameters are bound once for both inserts
+    inserted = insert_claimed(select(batch).cte("batch_rows"))
+    result = await session.execute(inserted_totals(inserted))
+    inserted_count = totals.add(result)
+    return (inserted_count, len(rows) - inserted_count)
+
+#COPY-based ingest: rows are streamed into a temporary staging table with binary COPY, then merged into the real tables with set-based INSERT ... SELECT
+#amounts are staged as integer cents, the columnar parser produces them that way and it keeps the binary COPY rows fixed width
+staging_table = "staging_transactions"
+staging_columns = ["transaction_id", "user_id", "product_id", "timestamp", "amount_cents"]
+
+#the asyncpg connection underneath the session, needed for COPY which SQLAlchemy doesn't expose
+async def get_driver_connection(session: AsyncSession):
+    conn = await session.connection()
+    raw = await conn.get_raw_connection()
+    return raw.driver_connection
+
+async def create_staging_table(session: AsyncSession, table: str = staging_table, temporary: bool = True, logged: bool = False) -> None:
+    #must go through session.execute (not the raw asyncpg connection), because SQLAlchemy only starts the DB transaction on its first statement, so anything copied before this would be autocommitted
+    #TEMP + ON COMMIT DROP, table is private to this connection and disappears on commit or rollback, so nothing leaks back into the pool
+    #UNLOGGED is for staging that other connections must see (sharded ingest), the caller drops it with drop_staging_tables
+    #logged is for staging that must survive a server crash (resumable upload sessions), UNLOGGED tables are emptied by crash recovery
+    kind = "TEMP" if temporary else ("" if logged else "UNLOGGED")
+    on_commit = " ON COMMIT DROP" if temporary else ""
+    await session.execute(text(
+        f"CREATE {kind} TABLE {table} ("
+        "transaction_id uuid NOT NULL, "
+        "user_id integer NOT NULL, "
+        "product_id integer NOT NULL, "
+        "timestamp timestamp NOT NULL, "
+        "amount_cents bigint NOT NULL"
+        f"){on_commit}"
+    ))
+
+async def drop_staging_tables(session: AsyncSession, tables: List[str]) -> None:
+    if tables:
+        await session.execute(text(f"DROP TABLE IF EXISTS {', '.join(tables)}"))
+
+#batch is a services.csv_parser.ParsedBatch
+@timed_statement
+async def copy_to_staging(session: AsyncSession, batch, table: str = staging_table) -> int:
+    if not len(batch):
+        return 0
+    driver_connection = await get_driver_connection(session)
+    #binary COPY straight from the parsed columns, no SQL compiling, parameter binding or per-row Python objects
+    await driver_connection.copy_to_table(
+        table,
+        #bytes would be taken as a file path by asyncpg, so hand it a file-like object
+        source=io.BytesIO(batch.copy_payload()),
+        columns=staging_columns,
+        format="binary",
+    )
+    return len(batch)
+
+#merge everything staged so far, returns (users inserted, products inserted, transactions inserted, duplicates ignored)
+#with several staging tables (one per shard) everything is merged by one statement per target table, so the counts stay exact
+@timed_statement
+async def merge_staging(session: AsyncSession, staged_count: int, tables: Optional[List[str]] = None) -> tuple[int, int, int, int]:
+    if not staged_count:
+        return (0, 0, 0, 0)
+    tables = tables or [staging_table]
+
+    #UNION, not UNION ALL, so each id is offered once
+    user_ids = " UNION ".join(f"SELECT user_id FROM {table}" for table in tables)
+    product_ids = " UNION ".join(f"SELECT product_id FROM {table}" for table in tables)
+    #shards are split by transaction_id, so duplicates always sit in the same table and UNION ALL is enough
+    #cents / 100 is exact in numeric, so the stored amount is identical to Decimal(...).quantize(Decimal("0.01"))
+    rows = " UNION ALL ".join(
+        f"SELECT transaction_id, user_id, product_id, timestamp, amount_cents / 100.0 AS transaction_amount FROM {table}" for table in tables
+    )
+
+    users = await session.execute(text(
+        f"INSERT INTO users (id) {user_ids} ON CONFLICT (id) DO NOTHING"
+    ))
+    products = await session.execute(text(
+        f"INSERT INTO products (id) {product_ids} ON CONFLICT (id) DO NOTHING"
+    ))
+    #duplicates inside the file and against existing rows are both skipped by ON CONFLICT DO NOTHING, same as insert_transactions
+    if transactions_partitioned:
+        staged = text(rows).columns(
+            column("transaction_id", PG_UUID(as_uuid=True)),
+            column("user_id", Integer),
+            column("product_id", Integer),
+            column("timestamp", DateTime),
+            column("transaction_amount", Numeric),
+        ).subquery("staged")
+        #one row per transaction_id, then claimed in transaction_keys like insert_transactions
+        unique_staged = select(staged).distinct(staged.c.transaction_id).cte("unique_staged")
+        inserted = insert_claimed(unique_staged)
+    else:
+        inserted = text(
+            "INSERT INTO transactions (transaction_id, user_id, product_id, timestamp, transaction_amount) "
+            f"{rows} ON CONFLICT (transaction_id) DO NOTHING "
+            "RETURNING user_id, timestamp, transaction_amount"
+        ).columns(user_id=Integer, timestamp=DateTime, transaction_amount=Numeric).cte("inserted")
+    transactions = await session.execute(select(func.count()).select_from(inserted).add_cte(rollup_inserted(inserted), *sketch_inserted(inserted)))
+
+    inserted_count = transactions.scalar_one()
+    return (users.rowcount or 0, products.rowcount or 0, inserted_count, staged_count - inserted_count)
@@ -0,0 +1,155 @@
+import asyncio
+import io
+import os
+import uuid
+from typing import Optional, Set, Tuple
+from fastapi import HTTPException
+from sqlalchemy import select, delete, text, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from models.models import UploadSession
+from models.schemas import UploadData
+from services.upload_services import create_staging_table, drop_staging_tables, copy_to_staging, merge_staging
+from services.id_cache import user_id_cache, product_id_cache
+from services.summary_cache import get_summary_cache
+from services.partitions import ensure_month_partitions, month_start
+from models.models import transactions_partitioned
+from services.csv_parser import ParsedBatch, headers, read_header, split_lines, parse_chunk
+
+#resumable chunked uploads: create a session, PUT consecutive byte ranges, then commit
+#every PUT is parsed and COPYed into the session's staging table in one transaction together with the new offset, so a chunk is either fully acknowledged or not at all
+#a client that loses its connection asks for the session's offset and re-sends from there, the commit publishes everything with one merge, same as mode=copy
+
+#largest body accepted by one PUT, the chunk is held in memory while it is parsed
+upload_session_max_chunk_bytes = int(os.getenv("UPLOAD_SESSION_MAX_CHUNK_BYTES", str(64 * 1024 * 1024)))
+#open sessions untouched for this long are dropped when the next session is created
+upload_session_ttl = float(os.getenv("UPLOAD_SESSION_TTL", str(24 * 3600)))
+#committed sessions are kept this long after their commit, so a client can still look up a session it committed, then deleted the same way
+upload_session_retention = float(os.getenv("UPLOAD_SESSION_RETENTION", str(7 * 24 * 3600)))
+
+def session_staging_table(upload_id: uuid.UUID) -> str:
+    return f"staging_upload_{upload_id.hex}"
+
+#row-locked, so concurrent PUTs/commits of the same session are serialised
+async def lock_upload_session(session: AsyncSession, upload_id: uuid.UUID) -> UploadSession:
+    result = await session.execute(select(UploadSession).where(UploadSession.id == upload_id).with_for_update())
+    upload = result.scalar_one_or_none()
+    if upload is None:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    if upload.status != "open":
+        raise HTTPException(status_code=409, detail=f"Upload session is {upload.status}")
+    return upload
+
+async def get_upload_session(session: AsyncSession, upload_id: uuid.UUID) -> UploadSession:
+    upload = await session.get(UploadSession, upload_id)
+    if upload is None:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    return upload
+
+def idle_for(seconds: float):
+    return UploadSession.updated_at < func.now() - func.make_interval(0, 0, 0, 0, 0, 0, seconds)
+
+#drop abandoned sessions and their staging tables, and committed sessions past their retention, so upload_sessions doesn't grow with every upload
+#the cutoffs are computed by the database, updated_at is set from its now() and a naive utcnow() here is off by the server's timezone
+async def expire_upload_sessions(session: AsyncSession) -> None:
+    result = await session.execute(
+        select(UploadSession).where(UploadSession.status == "open", idle_for(upload_session_ttl)).with_for_update(skip_locked=True)
+    )
+    for upload in result.scalars():
+        await drop_staging_tables(session, [session_staging_table(upload.id)])
+        await session.delete(upload)
+    #their staging tables were dropped by the commit
+    await session.execute(delete(UploadSession).where(UploadSession.status == "committed", idle_for(upload_session_retention)))
+
+async def create_upload_session(session: AsyncSession) -> UploadSession:
+    async with session.begin():
+        await expire_upload_sessions(session)
+        upload = UploadSession(id=uuid.uuid4(), status="open", received_bytes=0, next_line=1, pending=b"", staged_rows=0)
+        session.add(upload)
+        #logged, an acknowledged chunk must survive a server restart
+        await create_staging_table(session, session_staging_table(upload.id), temporary=False, logged=True)
+    return upload
+
+#runs in a worker thread, returns the parsed complete lines (None if there are none yet) and the new (pending, next_line)
+#final=True parses the pending bytes too, the last line of a file may have no newline
+def parse_session_chunk(pending: bytes, next_line: int, data: bytes, final: bool = False) -> Tuple[Optional[ParsedBatch], bytes, int]:
+    data = pending + data
+    if next_line == 1:
+        header_end = data.find(b"\n")
+        if header_end == -1 and not final:
+            return None, data, next_line
+        normalised_headers = read_header(io.BytesIO(data))
+        if normalised_headers is None:
+            raise HTTPException(status_code=400, detail="Missing CSV header")
+        if normalised_headers != headers:
+            raise HTTPException(status_code=400, detail=f"Invalid CSV header. Expected: {headers}, got: {normalised_headers}")
+        data = data[header_end + 1:] if header_end != -1 else b""
+        next_line = 2
+
+    chunk, pending = (data, b"") if final else split_lines(data)
+    if not chunk:
+        return None, pending, next_line
+    batch = parse_chunk(chunk, next_line)
+    if batch.errors:
+        line_number, detail = batch.errors[0]
+        raise HTTPException(status_code=400, detail=f"Error in row {line_number}: {detail}")
+    return batch, pending, next_line + chunk.count(b"\n")
+
+#acknowledge the bytes [offset, offset + len(data)), the offset must be exactly what has been received so far
+async def append_upload_chunk(session: AsyncSession, upload_id: uuid.UUID, offset: int, data: bytes) -> UploadSession:
+    async with session.begin():
+        upload = await lock_upload_session(session, upload_id)
+        if offset != upload.received_bytes:
+            #e.g. a retried chunk that was already acknowledged, the client resumes from received_bytes
+            raise HTTPException(status_code=409, detail=f"Expected offset {upload.received_bytes}, got {offset}")
+
+        batch, pending, next_line = await asyncio.to_thread(parse_session_chunk, upload.pending, upload.next_line, data)
+        if batch is not None:
+            upload.staged_rows += await copy_to_staging(session, batch, session_staging_table(upload.id))
+        upload.pending = pending
+        upload.next_line = next_line
+        upload.received_bytes += len(data)
+        upload.updated_at = func.now()
+    await session.refresh(upload)
+    return upload
+
+#parse what is left, merge the staging table into the real tables and drop it, all in one transaction
+async def commit_upload_session(session: AsyncSession, upload_id: uuid.UUID) -> UploadData:
+    table: str = session_staging_table(upload_id)
+    async with session.begin():
+        upload = await lock_upload_session(session, upload_id)
+        batch, _, _ = await asyncio.to_thread(parse_session_chunk, upload.pending, upload.next_line, b"", True)
+        if batch is not None:
+            upload.staged_rows += await copy_to_staging(session, batch, table)
+
+        #for the id caches and summary cache invalidation once committed
+        touched_user_ids: Set[int] = set((await session.execute(text(f"SELECT DISTINCT user_id FROM {table}"))).scalars())
+        product_ids: Set[int] = set((await session.execute(text(f"SELECT DISTINCT product_id FROM {table}"))).scalars())
+        touched_months = set()
+        if transactions_partitioned:
+            #only the session row and its staging table are locked so far, attaching the partitions can't wait on this transaction
+            months = (await session.execute(text(f"SELECT DISTINCT date_trunc('month', timestamp) FROM {table}"))).scalars()
+            touched_months = {month_start(month) for month in months}
+            await ensure_month_partitions(touched_months)
+
+        users_upserted, products_upserted, rows_inserted, duplicates_ignored = await merge_staging(session, upload.staged_rows, [table])
+        await drop_staging_tables(session, [table])
+        upload.status = "committed"
+        upload.pending = b""
+        upload.updated_at = func.now()
+    user_id_cache.add(touched_user_ids)
+    product_id_cache.add(product_ids)
+    get_summary_cache().invalidate_users(touched_user_ids)
+
+    return UploadData(
+        row_count=rows_inserted + duplicates_ignored,
+        user_count=users_upserted,
+        product_count=products_upserted,
+        transaction_count=rows_inserted,
+        duplicates_ignored=duplicates_ignored,
+    )
+
+async def abort_upload_session(session: AsyncSession, upload_id: uuid.UUID) -> None:
+    async with session.begin():
+        upload = await lock_upload_session(session, upload_id)
+        await drop_staging_tables(session, [session_staging_table(upload.id)])
+        await session.delete(upload)
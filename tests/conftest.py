@@ -14,16 +14,17 @@ from httpx import AsyncClient, ASGITransport
 from sqlalchemy import text
 import pytest_asyncio
 from asgi_lifespan import LifespanManager
-from database import engine, Base
-import models.models
+from database import engine
 from main import app
+from migrations.runner import upgrade_to_head
+from services.id_cache import clear_id_caches
+from services.summary_cache import get_summary_cache
 
 #autouse means run this fixture automatically even if the test doesn’t request it, scope="session" means run once per test session
 @pytest_asyncio.fixture(autouse=True, scope="session")
 async def ensure_tables_created():
-    #guarantees tables exist before any tests run
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    #guarantees tables exist before any tests run, through the same alembic revisions as a deployment
+    await asyncio.to_thread(upgrade_to_head)
     yield
 
 @pytest_asyncio.fixture
@@ -46,7 +47,18 @@ async def db_cleanup():
     #clean tables before each test, order matters due to foreign keys due to restrictions
     async with engine.begin() as conn:
         #delete child first, then parents, avoid TRUNCATE CASCADE for safety
+        await conn.execute(text("DELETE FROM user_daily_rollups;"))
+        await conn.execute(text("DELETE FROM user_amount_sketches;"))
+        await conn.execute(text("DELETE FROM amount_sketches;"))
         await conn.execute(text("DELETE FROM transactions;"))
+        await conn.execute(text("DELETE FROM transaction_keys;"))
         await conn.execute(text("DELETE FROM users;"))
         await conn.execute(text("DELETE FROM products;"))
+        #staging tables of resumable upload sessions left open by a test
+        for (upload_id,) in await conn.execute(text("SELECT id FROM upload_sessions WHERE status = 'open'")):
+            await conn.execute(text(f"DROP TABLE IF EXISTS staging_upload_{upload_id.hex}"))
+        await conn.execute(text("DELETE FROM upload_sessions;"))
+    #users/products were deleted behind the app's back, so the known-id caches are stale
+    clear_id_caches()
+    get_summary_cache().clear()
     yield
\ No newline at end of file
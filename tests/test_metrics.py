@@ -0,0 +1,29 @@
+from pathlib import Path
+import pytest
+
+#METRICS_ENABLED=1: an upload and a summary show up in the histograms, otherwise /metrics is not served
+@pytest.mark.asyncio
+async def test_metrics(client):
+    from services.metrics import metrics_enabled
+
+    csv_path = Path(__file__).resolve().parents[1] / "data" / "test_data.csv"
+    resp = await client.post("/upload/", params={"mode": "copy"}, files={"file": (csv_path.name, csv_path.read_bytes(), "text/csv")})
+    assert resp.status_code == 200, resp.text
+    await client.get("/summary/709")
+
+    resp = await client.get("/metrics")
+    if not metrics_enabled:
+        assert resp.status_code == 404
+        return
+
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = resp.text
+    assert "# TYPE upload_stage_seconds histogram" in body
+    assert 'upload_stage_seconds_count{mode="copy",stage="parse"}' in body
+    assert 'upload_statement_seconds_bucket{function="merge_staging",le="+Inf"}' in body
+    assert 'csv_parsed_rows_total{path="vectorised"}' in body
+    assert 'http_request_seconds_count{method="GET",route="/summary/{user_id}",status=' in body
+    assert 'db_query_seconds_count{pool="write",statement="INSERT"}' in body
+    assert 'db_pool_checkout_seconds_count{pool="write"}' in body
+    assert 'db_pool_size{pool="write"} 10' in body
@@ -0,0 +1,77 @@
+import pytest
+
+#the concurrent index helpers of migrations/indexes.py on a partitioned table, like transactions with TRANSACTIONS_PARTITIONED=1:
+#every partition gets its own index built concurrently, attached to an index on the parent, and dropping removes them all
+@pytest.mark.asyncio
+async def test_index_helpers_partitioned():
+    from alembic import context
+    from alembic.operations import Operations
+    from alembic.runtime.environment import EnvironmentContext
+    from alembic.script import ScriptDirectory
+    from sqlalchemy import text
+    from database import engine
+    from migrations.indexes import create_index_concurrently, drop_index_concurrently
+    from migrations.runner import alembic_config
+
+    table = "migration_test_events"
+
+    def indexes(connection) -> dict:
+        rows = connection.execute(text(
+            "SELECT c.relname, c.relkind::text, i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+            "WHERE i.indrelid IN (SELECT to_regclass(:table) UNION ALL SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(:table))"
+        ), {"table": table})
+        return {name: (kind, valid) for name, kind, valid in rows}
+
+    def migrate(connection) -> tuple[dict, dict]:
+        config = alembic_config()
+        #the same context alembic sets up for a revision, without running any
+        with EnvironmentContext(config, ScriptDirectory.from_config(config)):
+            context.configure(connection=connection)
+            with context.begin_transaction():
+                return run_helpers(connection)
+
+    def run_helpers(connection) -> tuple[dict, dict]:
+        with Operations.context(context.get_context()):
+            create_index_concurrently("ix_migration_test_user_ts", table, ["user_id", "ts"])
+            #a second run finds everything in place
+            create_index_concurrently("ix_migration_test_user_ts", table, ["user_id", "ts"])
+            created = indexes(connection)
+            drop_index_concurrently("ix_migration_test_user_ts")
+            return created, indexes(connection)
+
+    async with engine.connect() as conn:
+        await conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+        await conn.execute(text(f"CREATE TABLE {table} (user_id integer NOT NULL, ts timestamp NOT NULL) PARTITION BY RANGE (ts)"))
+        await conn.execute(text(f"CREATE TABLE {table}_y2025m01 PARTITION OF {table} FOR VALUES FROM ('2025-01-01') TO ('2025-02-01')"))
+        await conn.execute(text(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT"))
+        await conn.commit()
+        try:
+            created, dropped = await conn.run_sync(migrate)
+        finally:
+            await conn.execute(text(f"DROP TABLE IF EXISTS {table}"))
+            await conn.commit()
+
+    assert created == {
+        "ix_migration_test_user_ts": ("I", True),
+        f"{table}_default_ix_migration_test_user_ts": ("i", True),
+        f"{table}_y2025m01_ix_migration_test_user_ts": ("i", True),
+    }
+    assert dropped == {}
+
+#the tests run on a database built by the alembic revisions, it must have exactly the tables, columns and indexes the models declare
+@pytest.mark.asyncio
+async def test_migrations_match_models():
+    from alembic.autogenerate import compare_metadata
+    from alembic.migration import MigrationContext
+    from database import engine, Base
+    import models.models
+
+    #monthly partitions of transactions (TRANSACTIONS_PARTITIONED=1) and their indexes are created at runtime, not declared
+    def declared(name, type_, parent_names) -> bool:
+        return type_ != "table" or name in Base.metadata.tables
+
+    def differences(connection) -> list:
+        return compare_metadata(MigrationContext.configure(connection, opts={"include_name": declared}), Base.metadata)
+
+    async with engine.connect() as conn:
+        assert await conn.run_sync(differences) == []
@@ -0,0 +1,120 @@
+import json
+from datetime import date
+from pathlib import Path
+import pytest
+from models.models import transactions_partitioned
+
+#TRANSACTIONS_PARTITIONED=1 only, the flag is read when the models are imported, CI runs the whole suite once more with it set
+pytestmark = pytest.mark.skipif(not transactions_partitioned, reason="transactions is not partitioned")
+
+header = b"transaction_id,user_id,product_id,timestamp,transaction_amount\n"
+
+async def partitions_of(*transaction_ids: str) -> dict:
+    from sqlalchemy import text
+    from database import engine
+    async with engine.connect() as conn:
+        rows = await conn.execute(text(
+            "SELECT transaction_id::text, tableoid::regclass::text FROM transactions WHERE transaction_id::text = ANY(:ids)"
+        ), {"ids": list(transaction_ids)})
+        return dict(rows.all())
+
+#an upload creates the partitions of the months it contains, rows land in their month's partition, not in DEFAULT
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", ["insert", "copy"])
+async def test_upload_creates_month_partitions(client, mode):
+    csv_path = Path(__file__).resolve().parents[1] / "data" / "duplicate_data.csv"
+    resp = await client.post("/upload/", params={"mode": mode}, files={"file": (csv_path.name, csv_path.read_bytes(), "text/csv")})
+    assert resp.status_code == 200, resp.text
+    assert resp.json()["duplicates_ignored"] == 1
+
+    assert await partitions_of("410ada24-9860-40c0-8a30-798ecdb7d517", "0d472245-e037-43b3-a591-e2817fe6180a") == {
+        "410ada24-9860-40c0-8a30-798ecdb7d517": "transactions_y2025m07",
+        "0d472245-e037-43b3-a591-e2817fe6180a": "transactions_y2025m03",
+    }
+    assert (await client.get("/summary/670", params={"start": "2025-07-01", "end": "2025-08-01"})).json()["transaction_count"] == 1
+
+#rows that ended up in DEFAULT, e.g. when creating their partition timed out, are moved into the partition once it is created
+@pytest.mark.asyncio
+async def test_rows_moved_out_of_default_partition(client):
+    from sqlalchemy import text
+    from database import engine
+    from services.partitions import default_partition, known_months, split_default_partition
+
+    month = date(2031, 5, 1)
+    async with engine.begin() as conn:
+        #left over from an earlier run on the same database
+        await conn.execute(text("DROP TABLE IF EXISTS transactions_y2031m05"))
+        await conn.execute(text("INSERT INTO users (id) VALUES (901)"))
+        await conn.execute(text("INSERT INTO products (id) VALUES (902)"))
+        await conn.execute(text(
+            "INSERT INTO transactions (transaction_id, user_id, product_id, timestamp, transaction_amount) "
+            "VALUES ('8c1b4a52-8d0e-4f43-9d1e-0f6a6b1d2c31', 901, 902, '2031-05-17 10:00:00', 12.50)"
+        ))
+    known_months.discard(month)
+    assert await partitions_of("8c1b4a52-8d0e-4f43-9d1e-0f6a6b1d2c31") == {"8c1b4a52-8d0e-4f43-9d1e-0f6a6b1d2c31": default_partition}
+
+    await split_default_partition()
+
+    assert await partitions_of("8c1b4a52-8d0e-4f43-9d1e-0f6a6b1d2c31") == {"8c1b4a52-8d0e-4f43-9d1e-0f6a6b1d2c31": "transactions_y2031m05"}
+    assert month in known_months
+    async with engine.connect() as conn:
+        assert (await conn.execute(text(f"SELECT count(*) FROM {default_partition}"))).scalar_one() == 0
+
+#transaction_id has no unique index across partitions, transaction_keys still turns a repeat in another month into a duplicate
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", ["insert", "copy"])
+async def test_duplicate_transaction_id_across_months(client, mode):
+    from sqlalchemy import text
+    from database import engine
+
+    first = header + b"5a0c9a3e-2a47-4c3f-9a51-6f1c2f7d8e01,670,137,2025-01-15 08:00:00,10.00\n"
+    #the same id in two other months, once in another upload and once twice in the same file
+    second = (
+        header
+        + b"5a0c9a3e-2a47-4c3f-9a51-6f1c2f7d8e01,670,137,2025-06-15 08:00:00,20.00\n"
+        + b"7f3e2d1c-0b9a-4876-8543-21fedcba9876,670,137,2025-02-10 08:00:00,30.00\n"
+        + b"7f3e2d1c-0b9a-4876-8543-21fedcba9876,670,137,2025-09-10 08:00:00,40.00\n"
+    )
+    resp = await client.post("/upload/", params={"mode": mode}, files={"file": ("first.csv", first, "text/csv")})
+    assert resp.status_code == 200, resp.text
+    resp = await client.post("/upload/", params={"mode": mode}, files={"file": ("second.csv", second, "text/csv")})
+    assert resp.status_code == 200, resp.text
+    assert (resp.json()["transaction_count"], resp.json()["duplicates_ignored"]) == (1, 2)
+
+    #the first occurrence is kept
+    assert await partitions_of("5a0c9a3e-2a47-4c3f-9a51-6f1c2f7d8e01", "7f3e2d1c-0b9a-4876-8543-21fedcba9876") == {
+        "5a0c9a3e-2a47-4c3f-9a51-6f1c2f7d8e01": "transactions_y2025m01",
+        "7f3e2d1c-0b9a-4876-8543-21fedcba9876": "transactions_y2025m02",
+    }
+    async with engine.connect() as conn:
+        assert (await conn.execute(text("SELECT count(*) FROM transactions"))).scalar_one() == 2
+        assert (await conn.execute(text("SELECT count(*) FROM transaction_keys"))).scalar_one() == 2
+
+#the summary statement only scans the partitions its window touches
+@pytest.mark.asyncio
+async def test_summary_plan_prunes_partitions(client):
+    from datetime import datetime
+    from database import engine
+    from services.summary_services import summary_query, window_parameters
+
+    payload = (
+        header
+        + b"1c6f0f54-4a4e-4c5b-b6de-3a2f9e1b7c01,670,137,2025-03-02 05:30:00,10.00\n"
+        + b"1c6f0f54-4a4e-4c5b-b6de-3a2f9e1b7c02,670,137,2025-07-02 05:30:00,20.00\n"
+    )
+    resp = await client.post("/upload/", files={"file": ("months.csv", payload, "text/csv")})
+    assert resp.status_code == 200, resp.text
+
+    def relations(plan: dict) -> set:
+        found = {plan["Relation Name"]} if "Relation Name" in plan else set()
+        for child in plan.get("Plans", []):
+            found |= relations(child)
+        return found
+
+    #a window inside a day is answered from transactions alone, the unused edge is an empty range at window_floor, which prunes to nothing
+    async with engine.connect() as conn:
+        sql, names, defaults = summary_query.compile_for(conn.dialect)
+        values = {**defaults, "user_id": 670, **window_parameters(datetime(2025, 3, 2, 5), datetime(2025, 3, 2, 6))}
+        explained = (await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}", tuple(values[name] for name in names))).scalar_one()
+    scanned = relations((json.loads(explained) if isinstance(explained, str) else explained)[0]["Plan"])
+    assert scanned - {"user_daily_rollups"} == {"transactions_y2025m03"}
@@ -0,0 +1,33 @@
+import asyncio
+from pathlib import Path
+import pytest
+
+#SLOW_QUERY_MS set low enough (e.g. 0.001) to catch everything: the summary edge scan is captured with an analyzed plan, values redacted
+@pytest.mark.asyncio
+async def test_slow_queries(client):
+    from services.slow_queries import slow_queries_enabled
+
+    resp = await client.get("/debug/slow-queries")
+    if not slow_queries_enabled:
+        assert resp.status_code == 404
+        return
+
+    csv_path = Path(__file__).resolve().parents[1] / "data" / "test_data.csv"
+    resp = await client.post("/upload/", files={"file": (csv_path.name, csv_path.read_bytes(), "text/csv")})
+    assert resp.status_code == 200, resp.text
+    assert (await client.delete("/debug/slow-queries")).status_code == 204
+
+    await client.get("/summary/709", params={"start": "2025-01-01 12:00:00", "end": "2025-06-01 12:00:00"})
+    #the plan is captured in the background
+    for _ in range(50):
+        entries = (await client.get("/debug/slow-queries")).json()
+        if entries and all(entry["plan_status"] != "pending" for entry in entries):
+            break
+        await asyncio.sleep(0.1)
+
+    scans = [entry for entry in entries if "FROM transactions" in entry["statement"]]
+    assert scans
+    assert scans[0]["plan_status"] == "analyzed"
+    assert "Buffers" in scans[0]["plan"] or "actual time" in scans[0]["plan"]
+    assert "709" not in scans[0]["parameters"]
+    assert "int" in scans[0]["parameters"]
@@ -1,7 +1,8 @@
 import io
 import uuid
 import csv
-from decimal import Decimal
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
 import pytest
 from pathlib import Path
 
@@ -62,3 +63,313 @@ async def test_summary_end_less_start(client):
     req = await client.get("/summary/1", params={"start": "202501-01"})
     assert req.status_code == 422
     assert "Invalid datetime format:" in req.text
+
+#the rollup-based answer must equal aggregating the raw rows, for windows with and without partial days at the edges
+@pytest.mark.asyncio
+async def test_summary_matches_raw_rows(client):
+    from sqlalchemy import select, func
+    from database import engine
+    from models.models import Transaction
+
+    payload = (
+        b"transaction_id,user_id,product_id,timestamp,transaction_amount\n"
+        + b"".join(
+            f"{uuid.UUID(int=i)},1,{i % 3 + 1},2025-03-{i % 5 + 1:02d} {i % 24:02d}:{i * 7 % 60:02d}:00,{i * 37 % 1000 / 7:.2f}\n".encode()
+            for i in range(1, 120)
+        )
+    )
+    upload = await client.post("/upload/", files={"file": ("many.csv", payload, "text/csv")})
+    assert upload.status_code == 200, upload.text
+
+    windows = [
+        (None, None),
+        ("2025-03-02", None),
+        (None, "2025-03-04"),
+        ("2025-03-02", "2025-03-04"),
+        ("2025-03-01T05:30:00", "2025-03-04T12:00:00"),
+        ("2025-03-02T01:00:00", "2025-03-02T20:00:00"),
+        ("2025-03-02T20:00:00", "2025-03-03T04:00:00"),
+        ("2025-03-03T00:00:00", "2025-03-03T23:59:59"),
+    ]
+    for start, end in windows:
+        conditions = [Transaction.user_id == 1]
+        if start:
+            conditions.append(Transaction.timestamp >= datetime.fromisoformat(start))
+        if end:
+            conditions.append(Transaction.timestamp < datetime.fromisoformat(end))
+        async with engine.connect() as conn:
+            count, minimum, maximum, mean = (await conn.execute(select(
+                func.count(), func.min(Transaction.transaction_amount), func.max(Transaction.transaction_amount), func.avg(Transaction.transaction_amount),
+            ).where(*conditions))).one()
+
+        params = {key: value for key, value in (("start", start), ("end", end)) if value}
+        req = await client.get("/summary/1", params=params)
+        assert req.status_code == 200, (params, req.text)
+        data = req.json()
+        assert data["transaction_count"] == count, params
+        assert Decimal(data["minimum"]) == minimum, params
+        assert Decimal(data["maximum"]) == maximum, params
+        assert data["mean"] == format(mean.quantize(Decimal("0.01"), rounding=ROUND_HALF_UP), ".2f"), params
+
+#a second upload of the same rows must not change the rollups, duplicates are not counted twice
+@pytest.mark.asyncio
+async def test_summary_rollups_ignore_duplicates(client):
+    csv_path = Path(__file__).resolve().parents[1] / "data" / "duplicate_data.csv"
+    payload = csv_path.read_bytes()
+    for mode in ("insert", "copy", "insert"):
+        upload = await client.post("/upload/", params={"mode": mode}, files={"file": (csv_path.name, payload, "text/csv")})
+        assert upload.status_code == 200, upload.text
+
+    req = await client.get("/summary/670")
+    assert req.status_code == 200, req.text
+    assert req.json()["transaction_count"] == 1
+    assert req.json()["mean"] == "215.05"
+
+#insert mode sums the rollups of every batch and writes them once per upload, a day spread over several batches must still add up to the transactions
+@pytest.mark.asyncio
+async def test_summary_rollups_across_batches(client, monkeypatch):
+    from sqlalchemy import text
+    from database import engine
+    import services.ingest
+    monkeypatch.setattr(services.ingest, "batch_size", 3)
+
+    #two users, two days, five rows each per day, interleaved so every batch touches several buckets
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(["transaction_id", "user_id", "product_id", "timestamp", "transaction_amount"])
+    for index in range(20):
+        writer.writerow([uuid.uuid4(), 1 + index % 2, 1, f"2025-03-{10 + index // 10:02d} {index % 24:02d}:00:00", f"{10 + index * 3.25:.2f}"])
+    payload = output.getvalue().encode()
+    upload = await client.post("/upload/", params={"mode": "insert"}, files={"file": ("rollups.csv", payload, "text/csv")})
+    assert upload.status_code == 200, upload.text
+
+    async with engine.connect() as conn:
+        rollups = (await conn.execute(text(
+            "SELECT user_id, bucket, transaction_count, amount_sum, amount_min, amount_max FROM user_daily_rollups ORDER BY 1, 2"
+        ))).all()
+        expected = (await conn.execute(text(
+            "SELECT user_id, date_trunc('day', timestamp), count(*), sum(transaction_amount), min(transaction_amount), max(transaction_amount) "
+            "FROM transactions GROUP BY 1, 2 ORDER BY 1, 2"
+        ))).all()
+    assert [row.transaction_count for row in rollups] == [5, 5, 5, 5]
+    assert rollups == expected
+
+#batch endpoint returns the same numbers as the single-user endpoint, and reports users without data per-user
+@pytest.mark.asyncio
+async def test_summary_batch(client):
+    csv_path = Path(__file__).resolve().parents[1] / "data" / "test_summary_data.csv"
+    payload = csv_path.read_bytes()
+    upload = await client.post("/upload/", files={"file": (csv_path.name, payload, "text/csv")})
+    assert upload.status_code == 200, upload.text
+
+    req = await client.post("/summary/batch", json={"user_ids": [617, 1, 999999, 1], "start": "2025-02-21", "end": "2025-07-02"})
+    assert req.status_code == 200, req.text
+    data = req.json()
+    assert [summary["user_id"] for summary in data["summaries"]] == [617, 1]
+    assert data["missing_user_ids"] == [999999]
+
+    single = await client.get("/summary/1", params={"start": "2025-02-21", "end": "2025-07-02"})
+    assert data["summaries"][1] == single.json()
+
+    #same validation as the single-user endpoint
+    req = await client.post("/summary/batch", json={"user_ids": [1], "start": "2025-01-03", "end": "2025-01-02"})
+    assert req.status_code == 422
+    req = await client.post("/summary/batch", json={"user_ids": []})
+    assert req.status_code == 422
+
+#repeated calls are served from the cache, an upload for the user invalidates it
+@pytest.mark.asyncio
+async def test_summary_cache_invalidated_by_upload(client):
+    csv_path = Path(__file__).resolve().parents[1] / "data" / "test_summary_data.csv"
+    payload = csv_path.read_bytes()
+    upload = await client.post("/upload/", files={"file": (csv_path.name, payload, "text/csv")})
+    assert upload.status_code == 200, upload.text
+
+    before = (await client.get("/summary/cache/stats")).json()
+    first = await client.get("/summary/1")
+    second = await client.get("/summary/1")
+    assert first.json() == second.json()
+    after = (await client.get("/summary/cache/stats")).json()
+    assert after["misses"] == before["misses"] + 1
+    assert after["hits"] == before["hits"] + 1
+
+    #new row for user 1, the next call must see it
+    extra = b"transaction_id,user_id,product_id,timestamp,transaction_amount\n3f0b8c1e-0000-4000-8000-000000000001,1,137,2025-08-01 00:00:00,1000.00\n"
+    upload = await client.post("/upload/", files={"file": ("extra.csv", extra, "text/csv")})
+    assert upload.status_code == 200, upload.text
+    third = await client.get("/summary/1")
+    assert third.json()["transaction_count"] == 4
+    assert third.json()["maximum"] == "1000.00"
+    assert (await client.get("/summary/cache/stats")).json()["invalidations"] >= 1
+
+    #a user that got no rows in the upload keeps its cached entry
+    await client.get("/summary/617")
+    hits = (await client.get("/summary/cache/stats")).json()["hits"]
+    await client.get("/summary/617")
+    assert (await client.get("/summary/cache/stats")).json()["hits"] == hits + 1
+
+#the batch endpoint reads through the same cache
+@pytest.mark.asyncio
+async def test_summary_batch_uses_cache(client):
+    csv_path = Path(__file__).resolve().parents[1] / "data" / "test_summary_data.csv"
+    payload = csv_path.read_bytes()
+    upload = await client.post("/upload/", files={"file": (csv_path.name, payload, "text/csv")})
+    assert upload.status_code == 200, upload.text
+
+    single = await client.get("/summary/1")
+    hits = (await client.get("/summary/cache/stats")).json()["hits"]
+    req = await client.post("/summary/batch", json={"user_ids": [1, 617, 424242]})
+    assert req.status_code == 200, req.text
+    assert req.json()["summaries"][0] == single.json()
+    assert req.json()["missing_user_ids"] == [424242]
+    assert (await client.get("/summary/cache/stats")).json()["hits"] == hits + 1
+
+#buckets add up to the plain summary over the same window, and respect the exclusive end
+@pytest.mark.asyncio
+async def test_summary_series(client):
+    csv_path = Path(__file__).resolve().parents[1] / "data" / "test_summary_data.csv"
+    payload = csv_path.read_bytes()
+    upload = await client.post("/upload/", files={"file": (csv_path.name, payload, "text/csv")})
+    assert upload.status_code == 200, upload.text
+
+    req = await client.get("/summary/1/series", params={"interval": "month"})
+    assert req.status_code == 200, req.text
+    data = req.json()
+    assert data["interval"] == "month"
+    assert [bucket["bucket_start"] for bucket in data["buckets"]] == ["2025-02-01T00:00:00", "2025-07-01T00:00:00", "2025-09-01T00:00:00"]
+    assert [bucket["transaction_count"] for bucket in data["buckets"]] == [1, 1, 1]
+    assert data["buckets"][1]["mean"] == "215.05"
+
+    #partial edge days: 2025-07-01 03:44:36 is excluded by an end at 03:00
+    req = await client.get("/summary/1/series", params={"interval": "week", "start": "2025-02-21T12:00:00", "end": "2025-07-01T03:00:00"})
+    assert req.status_code == 200, req.text
+    buckets = req.json()["buckets"]
+    assert len(buckets) == 1
+    #2025-02-21 is a Friday, weeks start on Monday
+    assert buckets[0]["bucket_start"] == "2025-02-17T00:00:00"
+    assert buckets[0]["minimum"] == "180.84"
+
+    req = await client.get("/summary/1/series", params={"interval": "year"})
+    assert req.status_code == 422
+    req = await client.get("/summary/1/series", params={"start": "2026-01-01"})
+    assert req.status_code == 404
+
+@pytest.mark.asyncio
+async def test_product_summary(client):
+    payload = (
+        b"transaction_id,user_id,product_id,timestamp,transaction_amount\n"
+        b"410ada24-9860-40c0-8a30-798ecdb7d517,1,137,2025-07-01 03:44:36.960871,215.05\n"
+        b"0d472245-e037-43b3-a591-e2817fe6180a,617,137,2025-03-20 01:10:32.337956,42.86\n"
+        b"0268277c-f01c-409a-a05a-0971397c10c3,1,139,2025-02-21 23:11:52.325994,180.84\n"
+        b"ba0c46c6-65d4-4cfb-b4b9-f2705a2d6b44,2,139,2025-09-05 08:26:33.838509,45.97\n"
+        b"b68ef00c-ef72-441f-940d-009d73e17009,847,149,2025-01-07 01:55:52.861075,194.12\n"
+        b"c68ef00c-ef72-441f-940d-009d73e17009,847,149,2025-01-08 01:55:52.861075,1.00\n"
+    )
+    upload = await client.post("/upload/", files={"file": ("products.csv", payload, "text/csv")})
+    assert upload.status_code == 200, upload.text
+
+    req = await client.get("/summary/product/137")
+    assert req.status_code == 200, req.text
+    data = req.json()
+    assert data["product_id"] == 137
+    assert data["transaction_count"] == 2
+    assert data["minimum"] == "42.86"
+    assert data["maximum"] == "215.05"
+    assert data["mean"] == "128.96"
+
+    req = await client.get("/summary/product/137", params={"end": "2025-07-01"})
+    assert req.json()["transaction_count"] == 1
+
+    req = await client.get("/summary/product/999999")
+    assert req.status_code == 404
+
+    #revenue: 137 = 257.91, 139 = 226.81, 149 = 195.12
+    req = await client.get("/summary/products/top", params={"limit": 2})
+    assert req.status_code == 200, req.text
+    assert [(p["product_id"], p["revenue"]) for p in req.json()["products"]] == [(137, "257.91"), (139, "226.81")]
+
+    #by count, ties broken by product_id
+    req = await client.get("/summary/products/top", params={"by": "count", "start": "2025-01-01", "end": "2025-08-01"})
+    assert [(p["product_id"], p["transaction_count"]) for p in req.json()["products"]] == [(137, 2), (149, 2), (139, 1)]
+
+#summary routes run on the read pool, in READ ONLY transactions unless DB_READ_POOL_SIZE=0 shares the write pool
+@pytest.mark.asyncio
+async def test_read_session_is_read_only():
+    from sqlalchemy import text
+    from database import ReadSessionLocal, engine, read_engine
+
+    async with ReadSessionLocal() as session:
+        read_only = (await session.execute(text("SHOW transaction_read_only"))).scalar_one()
+    assert read_only == ("off" if read_engine is engine else "on")
+
+#every window is answered by the same statement text, only the bound parameters change
+@pytest.mark.asyncio
+async def test_summary_statement_shape_is_fixed(client):
+    from services.summary_services import summary_query, window_parameters
+
+    windows = [(None, None), ("2025-03-02", None), (None, "2025-03-04"), ("2025-03-02T01:00:00", "2025-03-02T20:00:00")]
+    for start, end in windows:
+        params = {key: value for key, value in (("start", start), ("end", end)) if value}
+        req = await client.get("/summary/1", params=params)
+        assert req.status_code in (200, 404), req.text
+    assert len(summary_query.compiled) == 1
+    assert {tuple(window_parameters(None, None)), tuple(window_parameters(datetime(2025, 3, 2, 1), datetime(2025, 3, 2, 20)))} == {
+        ("rollup_start", "rollup_end", "first_start", "first_end", "second_start", "second_end"),
+    }
+
+#approx=true: count/min/max/mean of whole months match the exact answer, percentiles are within the sketch's 1% of the exact ones
+@pytest.mark.asyncio
+async def test_summary_approx(client, monkeypatch):
+    import math
+    import routers.summary
+    import services.sketches
+
+    #approx=true is refused while the sketches are off (AMOUNT_SKETCHES=0, the default)
+    monkeypatch.setattr(routers.summary, "amount_sketches_enabled", False)
+    disabled = await client.get("/summary/1", params={"approx": "true"})
+    assert disabled.status_code == 400, disabled.text
+    monkeypatch.setattr(services.sketches, "amount_sketches_enabled", True)
+    monkeypatch.setattr(routers.summary, "amount_sketches_enabled", True)
+
+    amounts = [(Decimal(i * 37 % 1000) / 7 + Decimal("0.01")).quantize(Decimal("0.01")) for i in range(1, 200)]
+    rows = [
+        f"{uuid.UUID(int=i)},{i % 2 + 1},1,2025-{3 + i % 3 // 2:02d}-{i % 5 + 1:02d} {i % 24:02d}:00:00,{amount}\n".encode()
+        for i, amount in enumerate(amounts, start=1)
+    ]
+    #two uploads over the same months, one per write path, so the sketches are merged on conflict as well as created
+    for part, mode in ((rows[:100], "insert"), (rows[100:], "copy")):
+        payload = b"transaction_id,user_id,product_id,timestamp,transaction_amount\n" + b"".join(part)
+        upload = await client.post("/upload/", params={"mode": mode}, files={"file": ("approx.csv", payload, "text/csv")})
+        assert upload.status_code == 200, upload.text
+
+    def assert_close(approximate, values, quantile):
+        exact = sorted(values)[math.ceil(quantile * len(values)) - 1]
+        assert abs(Decimal(approximate) - exact) <= exact * Decimal("0.01") + Decimal("0.01"), (quantile, approximate, exact)
+
+    user_amounts = [amount for i, amount in enumerate(amounts, start=1) if i % 2 + 1 == 1]
+    exact = (await client.get("/summary/1")).json()
+    approx = (await client.get("/summary/1", params={"approx": "true"})).json()
+    assert approx["approximate"] is True
+    for key in ("transaction_count", "minimum", "maximum", "mean"):
+        assert approx[key] == exact[key], key
+    for name, quantile in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+        assert_close(approx[name], user_amounts, quantile)
+    assert "p50" not in exact
+
+    #a window inside a month is widened to the whole month
+    approx = (await client.get("/summary/1", params={"approx": "true", "start": "2025-03-02T05:00:00", "end": "2025-03-02T06:00:00"})).json()
+    assert (approx["start_date"], approx["end_date"]) == ("2025-03-01T00:00:00", "2025-04-01T00:00:00")
+    march = (await client.get("/summary/1", params={"start": "2025-03-01", "end": "2025-04-01"})).json()
+    assert 0 < approx["transaction_count"] == march["transaction_count"] < exact["transaction_count"]
+
+    batch = (await client.post("/summary/batch", json={"user_ids": [1, 2, 3], "approx": True})).json()
+    assert [summary["user_id"] for summary in batch["summaries"]] == [1, 2]
+    assert batch["missing_user_ids"] == [3]
+    assert batch["summaries"][0]["p50"] == (await client.get("/summary/1", params={"approx": "true"})).json()["p50"]
+
+    #all users, exact and from the monthly all-users sketch
+    overall = (await client.get("/summary/all")).json()
+    overall_approx = (await client.get("/summary/all", params={"approx": "true"})).json()
+    assert overall["transaction_count"] == overall_approx["transaction_count"] == len(amounts)
+    assert (overall["minimum"], overall["maximum"], overall["mean"]) == (overall_approx["minimum"], overall_approx["maximum"], overall_approx["mean"])
+    assert_close(overall_approx["p95"], amounts, 0.95)
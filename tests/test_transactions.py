@@ -0,0 +1,96 @@
+import io
+import csv
+import json
+from pathlib import Path
+import pytest
+
+async def upload_summary_data(client):
+    csv_path = Path(__file__).resolve().parents[1] / "data" / "test_summary_data.csv"
+    upload = await client.post("/upload/", files={"file": (csv_path.name, csv_path.read_bytes(), "text/csv")})
+    assert upload.status_code == 200, upload.text
+    return csv_path
+
+#the CSV export has the upload's header and formats, so it can be uploaded again
+@pytest.mark.asyncio
+async def test_export_csv(client):
+    csv_path = await upload_summary_data(client)
+
+    resp = await client.get("/transactions/export", params={"user_id": 1})
+    assert resp.status_code == 200, resp.text
+    assert resp.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(resp.text)))
+    expected = [row for row in csv.DictReader(io.StringIO(csv_path.read_text())) if row["user_id"] == "1"]
+    assert sorted(rows, key=lambda row: row["transaction_id"]) == sorted(expected, key=lambda row: row["transaction_id"])
+
+    #same start/end rules as /summary, end is exclusive
+    resp = await client.get("/transactions/export", params={"user_id": 1, "start": "2025-02-21", "end": "2025-07-01"})
+    assert [row["transaction_id"] for row in csv.DictReader(io.StringIO(resp.text))] == ["0268277c-f01c-409a-a05a-0971397c10c3"]
+
+    resp = await client.get("/transactions/export", params={"start": "2025-01-03", "end": "2025-01-02"})
+    assert resp.status_code == 422
+
+    #re-uploading the export only finds duplicates
+    resp = await client.get("/transactions/export")
+    upload = await client.post("/upload/", files={"file": ("export.csv", resp.content, "text/csv")})
+    assert upload.status_code == 200, upload.text
+    assert upload.json()["duplicates_ignored"] == 5
+
+@pytest.mark.asyncio
+async def test_export_ndjson_and_parquet(client):
+    await upload_summary_data(client)
+
+    resp = await client.get("/transactions/export", params={"product_id": 137, "format": "ndjson"})
+    assert resp.status_code == 200, resp.text
+    assert [json.loads(line) for line in resp.text.splitlines()] == [{
+        "transaction_id": "410ada24-9860-40c0-8a30-798ecdb7d517",
+        "user_id": 1,
+        "product_id": 137,
+        "timestamp": "2025-07-01 03:44:36.960871",
+        "transaction_amount": "215.05",
+    }]
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    resp = await client.get("/transactions/export", params={"format": "parquet"})
+    assert resp.status_code == 200, resp.text
+    table = pq.read_table(pa.BufferReader(resp.content))
+    assert table.num_rows == 5
+    assert table.column_names == ["transaction_id", "user_id", "product_id", "timestamp", "transaction_amount"]
+
+    #the Parquet export is a valid upload too
+    upload = await client.post("/upload/", files={"file": ("export.parquet", resp.content, "application/octet-stream")})
+    assert upload.status_code == 200, upload.text
+    assert upload.json()["duplicates_ignored"] == 5
+
+#walking the pages with next_cursor gives every row once, in (timestamp, id) order, also when timestamps tie
+@pytest.mark.asyncio
+async def test_list_transactions_keyset_pages(client):
+    import uuid
+    payload = (
+        b"transaction_id,user_id,product_id,timestamp,transaction_amount\n"
+        + b"".join(f"{uuid.UUID(int=i)},5,1,2025-03-{i // 4 + 1:02d} 12:00:00,{i}.50\n".encode() for i in range(1, 24))
+    )
+    upload = await client.post("/upload/", files={"file": ("data.csv", payload, "text/csv")})
+    assert upload.status_code == 200, upload.text
+
+    seen = []
+    params = {"user_id": 5, "limit": 5}
+    while True:
+        resp = await client.get("/transactions", params=params)
+        assert resp.status_code == 200, resp.text
+        page = resp.json()
+        assert len(page["transactions"]) <= 5
+        seen += page["transactions"]
+        if "next_cursor" not in page:
+            break
+        params["after"] = page["next_cursor"]
+    assert [row["transaction_id"] for row in seen] == [str(uuid.UUID(int=i)) for i in range(1, 24)]
+    assert seen[0]["transaction_amount"] == "1.50"
+
+    #window, same rules as /summary
+    resp = await client.get("/transactions", params={"user_id": 5, "start": "2025-03-02", "end": "2025-03-03"})
+    assert [row["transaction_id"] for row in resp.json()["transactions"]] == [str(uuid.UUID(int=i)) for i in range(4, 8)]
+
+    resp = await client.get("/transactions", params={"user_id": 5, "after": "not a cursor"})
+    assert resp.status_code == 422
+    assert "Invalid cursor" in resp.text
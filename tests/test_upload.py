@@ -85,3 +85,452 @@ async def test_upload_duplicates_ignored_on_second_upload(client):
 
 
 
+#COPY mode must report exactly the same counts as the default insert mode
+@pytest.mark.asyncio
+async def test_upload_copy_mode_duplicates(client):
+    csv_path = Path(__file__).resolve().parents[1] / "data" / "duplicate_data.csv"
+    payload = csv_path.read_bytes()
+
+    resp1 = await client.post("/upload/", params={"mode": "copy"}, files={"file": (csv_path.name, payload, "text/csv")})
+    assert resp1.status_code == 200, resp1.text
+    d1 = resp1.json()
+    assert d1["row_count"] == 3
+    assert d1["transaction_count"] == 2
+    assert d1["duplicates_ignored"] == 1
+    assert d1["user_count"] == 2
+    assert d1["product_count"] == 2
+
+    resp2 = await client.post("/upload/", params={"mode": "copy"}, files={"file": (csv_path.name, payload, "text/csv")})
+    assert resp2.status_code == 200, resp2.text
+    d2 = resp2.json()
+    assert d2["transaction_count"] == 0
+    assert d2["duplicates_ignored"] == 3
+    assert d2["user_count"] == 0
+    assert d2["product_count"] == 0
+
+@pytest.mark.asyncio
+async def test_upload_copy_mode_matches_insert_mode(client):
+    csv_path = Path(__file__).resolve().parents[1] / "data" / "test_data.csv"
+    payload = csv_path.read_bytes()
+
+    resp_copy = await client.post("/upload/", params={"mode": "copy"}, files={"file": (csv_path.name, payload, "text/csv")})
+    assert resp_copy.status_code == 200, resp_copy.text
+
+    #queried back through the summary endpoint, the copied rows must be the same as inserted ones
+    summary = await client.get("/summary/670")
+    assert summary.status_code == 200, summary.text
+    assert summary.json()["maximum"] == "215.05"
+
+    #everything is already there, so insert mode sees only duplicates
+    resp_insert = await client.post("/upload/", files={"file": (csv_path.name, payload, "text/csv")})
+    assert resp_insert.status_code == 200, resp_insert.text
+    assert resp_insert.json()["duplicates_ignored"] == resp_copy.json()["transaction_count"]
+
+@pytest.mark.asyncio
+async def test_upload_copy_mode_bad_row_rolls_back(client):
+    csv_path = Path(__file__).resolve().parents[1] / "data" / "bad_uuid_data.csv"
+    payload = csv_path.read_bytes()
+    resp = await client.post("/upload/", params={"mode": "copy"}, files={"file": (csv_path.name, payload, "text/csv")})
+    assert resp.status_code == 400
+    assert "Invalid UUID" in resp.text
+
+#rows outside the canonical format go through transform_row, so they are accepted or rejected exactly as before
+@pytest.mark.asyncio
+async def test_upload_non_canonical_rows(client):
+    payload = (
+        b"transaction_id,user_id,product_id,timestamp,transaction_amount\r\n"
+        b"410ADA24-9860-40C0-8A30-798ECDB7D517,670,137,2025-07-01 03:44:36.9,215.05\r\n"
+        b"\r\n"
+        b"\"0d472245-e037-43b3-a591-e2817fe6180a\",670, 473 ,2025-3-20 1:10:32,42.855\r\n"
+    )
+    resp = await client.post("/upload/", files={"file": ("edge.csv", payload, "text/csv")})
+    assert resp.status_code == 200, resp.text
+    assert resp.json()["transaction_count"] == 2
+
+    summary = await client.get("/summary/670")
+    assert summary.status_code == 200, summary.text
+    #42.855 is rounded half-even by Decimal.quantize, same as transform_row
+    assert summary.json()["minimum"] == "42.86"
+    assert summary.json()["maximum"] == "215.05"
+
+#error messages keep the csv line number of the bad row, blank lines included
+@pytest.mark.asyncio
+async def test_upload_row_error_line_number(client):
+    payload = (
+        b"transaction_id,user_id,product_id,timestamp,transaction_amount\n"
+        b"410ada24-9860-40c0-8a30-798ecdb7d517,670,137,2025-07-01 03:44:36.960871,215.05\n"
+        b"\n"
+        b"0d472245-e037-43b3-a591-e2817fe6180a,617,473,2025-02-30 01:10:32,42.86\n"
+    )
+    resp = await client.post("/upload/", files={"file": ("bad.csv", payload, "text/csv")})
+    assert resp.status_code == 400
+    assert "Error in row 4: Invalid timestamp format" in resp.text
+
+#amounts past numeric(12, 2) are row errors, not a 500 from overflowing the int64 cents or the column
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", ["insert", "copy"])
+@pytest.mark.parametrize("amount", ["1e20", "10000000000", "-10000000000.00", "\"1e20\""])
+async def test_upload_row_error_amount_out_of_range(client, mode, amount):
+    payload = (
+        b"transaction_id,user_id,product_id,timestamp,transaction_amount\n"
+        b"410ada24-9860-40c0-8a30-798ecdb7d517,670,137,2025-07-01 03:44:36.960871,9999999999.99\n"
+        + f"0d472245-e037-43b3-a591-e2817fe6180a,617,473,2025-02-20 01:10:32,{amount}\n".encode()
+    )
+    resp = await client.post("/upload/", params={"mode": mode}, files={"file": ("big.csv", payload, "text/csv")})
+    assert resp.status_code == 400, resp.text
+    assert "Error in row 3: Invalid transaction_amount" in resp.text
+
+#tiny chunks and a queue of 1 force many parse/write hand-overs and constant backpressure
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", ["insert", "copy"])
+async def test_upload_pipeline_small_chunks(client, monkeypatch, mode):
+    import services.ingest
+    monkeypatch.setattr(services.ingest, "upload_chunk_bytes", 100)
+    monkeypatch.setattr(services.ingest, "queue_depth", 1)
+
+    csv_path = Path(__file__).resolve().parents[1] / "data" / "duplicate_data.csv"
+    payload = csv_path.read_bytes()
+    resp = await client.post("/upload/", params={"mode": mode}, files={"file": (csv_path.name, payload, "text/csv")})
+    assert resp.status_code == 200, resp.text
+    assert resp.json()["transaction_count"] == 2
+    assert resp.json()["duplicates_ignored"] == 1
+
+    #per-stage timings are reported in the Server-Timing header
+    server_timing = resp.headers["Server-Timing"]
+    for stage in ("parse", "write", "write_wait", "backpressure", "commit", "total"):
+        assert f"{stage};dur=" in server_timing
+
+#sharded mode: exact counts and nothing left behind in staging
+@pytest.mark.asyncio
+async def test_upload_sharded_mode(client):
+    from sqlalchemy import text
+    from database import engine
+
+    csv_path = Path(__file__).resolve().parents[1] / "data" / "duplicate_data.csv"
+    payload = csv_path.read_bytes()
+    resp1 = await client.post("/upload/", params={"mode": "sharded", "shards": 3}, files={"file": (csv_path.name, payload, "text/csv")})
+    assert resp1.status_code == 200, resp1.text
+    assert resp1.json() == {"row_count": 3, "user_count": 2, "product_count": 2, "transaction_count": 2, "duplicates_ignored": 1}
+
+    resp2 = await client.post("/upload/", params={"mode": "sharded", "shards": 3}, files={"file": (csv_path.name, payload, "text/csv")})
+    assert resp2.status_code == 200, resp2.text
+    assert resp2.json()["duplicates_ignored"] == 3
+
+    async with engine.connect() as conn:
+        leftovers = await conn.execute(text("SELECT count(*) FROM pg_tables WHERE tablename LIKE 'staging\\_%'"))
+        assert leftovers.scalar_one() == 0
+
+#a bad row rolls back every shard
+@pytest.mark.asyncio
+async def test_upload_sharded_mode_bad_row(client):
+    from sqlalchemy import text
+    from database import engine
+
+    csv_path = Path(__file__).resolve().parents[1] / "data" / "bad_uuid_data.csv"
+    payload = csv_path.read_bytes()
+    resp = await client.post("/upload/", params={"mode": "sharded", "shards": 2}, files={"file": (csv_path.name, payload, "text/csv")})
+    assert resp.status_code == 400
+    assert "Invalid UUID" in resp.text
+
+    async with engine.connect() as conn:
+        assert (await conn.execute(text("SELECT count(*) FROM transactions"))).scalar_one() == 0
+        leftovers = await conn.execute(text("SELECT count(*) FROM pg_tables WHERE tablename LIKE 'staging\\_%'"))
+        assert leftovers.scalar_one() == 0
+
+#ids are cached only after commit: a failed upload must not mark its ids as known, a successful one must
+@pytest.mark.asyncio
+async def test_upload_id_cache_after_rollback_and_commit(client):
+    from services.id_cache import user_id_cache, product_id_cache
+
+    bad = (Path(__file__).resolve().parents[1] / "data" / "bad_uuid_data.csv").read_bytes()
+    #valid row first, then the bad one, so the first row's ids were already sent before the rollback
+    bad = bad.replace(b"NOT-A-UUID,670,137", b"0d472245-e037-43b3-a591-e2817fe61800,1,2")
+    bad = bad + b"NOT-A-UUID,3,4,2025-07-01 03:44:36.960871,215.05\n"
+    resp = await client.post("/upload/", files={"file": ("bad.csv", bad, "text/csv")})
+    assert resp.status_code == 400
+    assert 1 not in user_id_cache and 617 not in user_id_cache
+    assert 2 not in product_id_cache
+
+    csv_path = Path(__file__).resolve().parents[1] / "data" / "test_data.csv"
+    payload = csv_path.read_bytes()
+    resp = await client.post("/upload/", files={"file": (csv_path.name, payload, "text/csv")})
+    assert resp.status_code == 200, resp.text
+    assert 670 in user_id_cache and 137 in product_id_cache
+
+    #second upload with only cached ids still reports exact counts
+    resp = await client.post("/upload/", files={"file": (csv_path.name, payload, "text/csv")})
+    assert resp.status_code == 200, resp.text
+    assert resp.json()["user_count"] == 0
+    assert resp.json()["product_count"] == 0
+    assert resp.json()["transaction_count"] == 0
+
+#resumable upload: chunks cut mid-line, a retried chunk is rejected with the offset to resume from, commit publishes everything at once
+@pytest.mark.asyncio
+async def test_upload_session_resumable(client):
+    from sqlalchemy import text
+    from database import engine
+
+    csv_path = Path(__file__).resolve().parents[1] / "data" / "test_data.csv"
+    payload = csv_path.read_bytes()
+    expected = (await client.post("/upload/", params={"mode": "copy"}, files={"file": (csv_path.name, payload, "text/csv")})).json()
+    async with engine.begin() as conn:
+        await conn.execute(text("DELETE FROM user_daily_rollups"))
+        await conn.execute(text("DELETE FROM user_amount_sketches"))
+        await conn.execute(text("DELETE FROM amount_sketches"))
+        await conn.execute(text("DELETE FROM transactions"))
+        #TRANSACTIONS_PARTITIONED=1 dedups against the claimed ids, not the transactions table
+        await conn.execute(text("DELETE FROM transaction_keys"))
+
+    resp = await client.post("/upload/sessions")
+    assert resp.status_code == 201, resp.text
+    upload_id = resp.json()["upload_id"]
+    assert resp.json()["offset"] == 0
+
+    #odd chunk size, so the header and rows are split across chunks
+    chunk = 37
+    for offset in range(0, len(payload), chunk):
+        resp = await client.put(f"/upload/sessions/{upload_id}", params={"offset": offset}, content=payload[offset:offset + chunk])
+        assert resp.status_code == 200, resp.text
+        assert resp.json()["offset"] == min(offset + chunk, len(payload))
+
+        #a retry of an acknowledged chunk
+        if offset == chunk:
+            retry = await client.put(f"/upload/sessions/{upload_id}", params={"offset": offset}, content=payload[offset:offset + chunk])
+            assert retry.status_code == 409
+            assert f"Expected offset {offset + chunk}" in retry.text
+
+    #nothing is visible before the commit
+    assert (await client.get("/summary/670")).status_code == 404
+    status = await client.get(f"/upload/sessions/{upload_id}")
+    assert status.json()["offset"] == len(payload)
+
+    resp = await client.post(f"/upload/sessions/{upload_id}/commit")
+    assert resp.status_code == 200, resp.text
+    assert resp.json()["transaction_count"] == expected["transaction_count"]
+    assert resp.json()["duplicates_ignored"] == expected["duplicates_ignored"]
+    assert (await client.get("/summary/670")).json()["maximum"] == "215.05"
+
+    #a committed session takes no more chunks
+    resp = await client.put(f"/upload/sessions/{upload_id}", params={"offset": len(payload)}, content=b"")
+    assert resp.status_code == 409
+    async with engine.connect() as conn:
+        leftovers = await conn.execute(text("SELECT count(*) FROM pg_tables WHERE tablename LIKE 'staging\\_%'"))
+        assert leftovers.scalar_one() == 0
+
+#a bad chunk is rejected without moving the offset, abort drops the staging table
+@pytest.mark.asyncio
+async def test_upload_session_bad_chunk_and_abort(client):
+    from sqlalchemy import text
+    from database import engine
+
+    payload = (Path(__file__).resolve().parents[1] / "data" / "bad_uuid_data.csv").read_bytes()
+    upload_id = (await client.post("/upload/sessions")).json()["upload_id"]
+    resp = await client.put(f"/upload/sessions/{upload_id}", params={"offset": 0}, content=payload)
+    assert resp.status_code == 400
+    assert "Invalid UUID" in resp.text
+    assert (await client.get(f"/upload/sessions/{upload_id}")).json()["offset"] == 0
+
+    resp = await client.put(f"/upload/sessions/{upload_id}", params={"offset": 0}, content=b"bad,header\n")
+    assert resp.status_code == 400
+    assert "Invalid CSV header" in resp.text
+
+    assert (await client.delete(f"/upload/sessions/{upload_id}")).status_code == 204
+    assert (await client.get(f"/upload/sessions/{upload_id}")).status_code == 404
+    async with engine.connect() as conn:
+        leftovers = await conn.execute(text("SELECT count(*) FROM pg_tables WHERE tablename LIKE 'staging\\_%'"))
+        assert leftovers.scalar_one() == 0
+
+#sessions idle for longer than UPLOAD_SESSION_TTL are dropped with their staging tables when the next one is created, fresher ones are kept
+@pytest.mark.asyncio
+async def test_upload_session_expiry(client):
+    from sqlalchemy import text
+    from database import engine
+    from services.upload_sessions import upload_session_ttl, session_staging_table
+
+    stale, fresh = [uuid.UUID((await client.post("/upload/sessions")).json()["upload_id"]) for _ in range(2)]
+    async with engine.begin() as conn:
+        for upload_id, age in ((stale, upload_session_ttl + 60), (fresh, upload_session_ttl - 60)):
+            await conn.execute(text("UPDATE upload_sessions SET updated_at = now() - make_interval(secs => :age) WHERE id = :id"), {"age": age, "id": upload_id})
+
+    latest = (await client.post("/upload/sessions")).json()["upload_id"]
+    assert (await client.get(f"/upload/sessions/{stale}")).status_code == 404
+    async with engine.connect() as conn:
+        assert (await conn.execute(text("SELECT to_regclass(:table)"), {"table": session_staging_table(stale)})).scalar_one() is None
+    for upload_id in (fresh, latest):
+        assert (await client.get(f"/upload/sessions/{upload_id}")).status_code == 200
+        assert (await client.delete(f"/upload/sessions/{upload_id}")).status_code == 204
+
+#committed sessions are deleted once they are older than UPLOAD_SESSION_RETENTION, when the next session is created, newer ones stay readable
+@pytest.mark.asyncio
+async def test_upload_session_retention(client):
+    from sqlalchemy import text
+    from database import engine
+    from services.upload_sessions import upload_session_retention
+
+    payload = (Path(__file__).resolve().parents[1] / "data" / "duplicate_data.csv").read_bytes()
+    committed = []
+    for _ in range(2):
+        upload_id = (await client.post("/upload/sessions")).json()["upload_id"]
+        assert (await client.put(f"/upload/sessions/{upload_id}", params={"offset": 0}, content=payload)).status_code == 200
+        assert (await client.post(f"/upload/sessions/{upload_id}/commit")).status_code == 200
+        committed.append(uuid.UUID(upload_id))
+    old, recent = committed
+    async with engine.begin() as conn:
+        for upload_id, age in ((old, upload_session_retention + 60), (recent, upload_session_retention - 60)):
+            await conn.execute(text("UPDATE upload_sessions SET updated_at = now() - make_interval(secs => :age) WHERE id = :id"), {"age": age, "id": upload_id})
+
+    latest = (await client.post("/upload/sessions")).json()["upload_id"]
+    assert (await client.get(f"/upload/sessions/{old}")).status_code == 404
+    assert (await client.get(f"/upload/sessions/{recent}")).json()["status"] == "committed"
+    assert (await client.delete(f"/upload/sessions/{latest}")).status_code == 204
+
+#async=true returns a job id straight away, the job ends with the same UploadData as a synchronous upload
+@pytest.mark.asyncio
+async def test_upload_async_job(client):
+    import asyncio
+
+    csv_path = Path(__file__).resolve().parents[1] / "data" / "duplicate_data.csv"
+    payload = csv_path.read_bytes()
+    resp = await client.post("/upload/", params={"async": "true"}, files={"file": (csv_path.name, payload, "text/csv")})
+    assert resp.status_code == 202, resp.text
+    job_id = resp.json()["job_id"]
+    assert resp.json()["status"] in ("queued", "running")
+
+    for _ in range(100):
+        job = (await client.get(f"/upload/jobs/{job_id}")).json()
+        if job["status"] in ("succeeded", "failed"):
+            break
+        await asyncio.sleep(0.05)
+    assert job["status"] == "succeeded", job
+    assert job["rows_parsed"] == 3
+    assert job["result"] == {"row_count": 3, "user_count": 2, "product_count": 2, "transaction_count": 2, "duplicates_ignored": 1}
+
+    #a bad row fails the job with the same message
+    bad = (Path(__file__).resolve().parents[1] / "data" / "bad_uuid_data.csv").read_bytes()
+    job_id = (await client.post("/upload/", params={"async": "true", "mode": "copy"}, files={"file": ("bad.csv", bad, "text/csv")})).json()["job_id"]
+    for _ in range(100):
+        job = (await client.get(f"/upload/jobs/{job_id}")).json()
+        if job["status"] in ("succeeded", "failed"):
+            break
+        await asyncio.sleep(0.05)
+    assert job["status"] == "failed"
+    assert "Invalid UUID" in job["error"]
+
+    assert (await client.get("/upload/jobs/unknown")).status_code == 404
+
+#.csv.gz, .csv.zst and Content-Encoding: gzip bodies give the same result as the plain CSV
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", ["insert", "copy"])
+async def test_upload_compressed(client, mode):
+    import gzip
+
+    payload = (Path(__file__).resolve().parents[1] / "data" / "duplicate_data.csv").read_bytes()
+    expected = {"row_count": 3, "user_count": 2, "product_count": 2, "transaction_count": 2, "duplicates_ignored": 1}
+
+    resp = await client.post("/upload/", params={"mode": mode}, files={"file": ("data.csv.gz", gzip.compress(payload), "application/gzip")})
+    assert resp.status_code == 200, resp.text
+    assert resp.json() == expected
+
+    #whole multipart body gzipped by the client
+    body = b"".join([
+        b"--boundary\r\n",
+        b'Content-Disposition: form-data; name="file"; filename="data.csv"\r\n',
+        b"Content-Type: text/csv\r\n\r\n",
+        payload,
+        b"\r\n--boundary--\r\n",
+    ])
+    resp = await client.post(
+        "/upload/",
+        params={"mode": mode},
+        content=gzip.compress(body),
+        headers={"Content-Type": "multipart/form-data; boundary=boundary", "Content-Encoding": "gzip"},
+    )
+    assert resp.status_code == 200, resp.text
+    assert resp.json()["duplicates_ignored"] == 3
+
+    import zstandard
+    resp = await client.post("/upload/", params={"mode": mode}, files={"file": ("data.csv.zst", zstandard.ZstdCompressor().compress(payload), "application/zstd")})
+    assert resp.status_code == 200, resp.text
+    assert resp.json()["duplicates_ignored"] == 3
+
+@pytest.mark.asyncio
+async def test_upload_corrupt_gzip(client):
+    resp = await client.post("/upload/", files={"file": ("data.csv.gz", b"\x1f\x8bnot really gzip", "application/gzip")})
+    assert resp.status_code == 400
+    assert "Unable to decompress upload" in resp.text
+
+#Parquet / Arrow IPC with typed columns give the same result as the CSV, string columns are parsed like CSV fields
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", ["insert", "copy"])
+async def test_upload_columnar(client, mode):
+    from datetime import datetime
+    from decimal import Decimal
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rows = list(csv.DictReader(io.StringIO((Path(__file__).resolve().parents[1] / "data" / "duplicate_data.csv").read_text())))
+    table = pa.table({
+        "transaction_id": pa.array([uuid.UUID(row["transaction_id"]).bytes for row in rows], pa.binary(16)),
+        "user_id": pa.array([int(row["user_id"]) for row in rows], pa.int64()),
+        "product_id": pa.array([int(row["product_id"]) for row in rows], pa.int32()),
+        "timestamp": pa.array([datetime.fromisoformat(row["timestamp"]) for row in rows], pa.timestamp("us")),
+        "transaction_amount": pa.array([Decimal(row["transaction_amount"]) for row in rows], pa.decimal128(12, 2)),
+    })
+
+    parquet = io.BytesIO()
+    pq.write_table(table, parquet)
+    resp = await client.post("/upload/", params={"mode": mode}, files={"file": ("data.parquet", parquet.getvalue(), "application/octet-stream")})
+    assert resp.status_code == 200, resp.text
+    assert resp.json() == {"row_count": 3, "user_count": 2, "product_count": 2, "transaction_count": 2, "duplicates_ignored": 1}
+    assert (await client.get("/summary/670")).json()["maximum"] == "215.05"
+
+    #Arrow IPC file with every column as strings
+    arrow = io.BytesIO()
+    strings = pa.table({name: pa.array([row[name] for row in rows]) for name in rows[0]})
+    with pa.ipc.new_file(arrow, strings.schema) as writer:
+        writer.write_table(strings)
+    resp = await client.post("/upload/", params={"mode": mode}, files={"file": ("data.arrow", arrow.getvalue(), "application/octet-stream")})
+    assert resp.status_code == 200, resp.text
+    assert resp.json()["duplicates_ignored"] == 3
+
+    #same header rule and row errors as the CSV
+    parquet = io.BytesIO()
+    pq.write_table(table.rename_columns(["transaction_id", "user", "product_id", "timestamp", "transaction_amount"]), parquet)
+    resp = await client.post("/upload/", params={"mode": mode}, files={"file": ("data.parquet", parquet.getvalue(), "application/octet-stream")})
+    assert resp.status_code == 400
+    assert "Invalid columns" in resp.text
+
+    bad = strings.set_column(0, "transaction_id", pa.array(["NOT-A-UUID"] + [row["transaction_id"] for row in rows[1:]]))
+    parquet = io.BytesIO()
+    pq.write_table(bad, parquet)
+    resp = await client.post("/upload/", params={"mode": mode}, files={"file": ("data.parquet", parquet.getvalue(), "application/octet-stream")})
+    assert resp.status_code == 400
+    assert "Error in row 1: Invalid UUID" in resp.text
+
+    #integer amounts past numeric(12, 2) are row errors, not wrapped around into the int64 cents
+    for amounts in (pa.array([1, 184467440737095517, 2], pa.int64()), pa.array([1, 2**64 - 1, 2], pa.uint64()), pa.array([1, -2**63, 2], pa.int64())):
+        parquet = io.BytesIO()
+        pq.write_table(table.set_column(4, "transaction_amount", amounts), parquet)
+        resp = await client.post("/upload/", params={"mode": mode}, files={"file": ("data.parquet", parquet.getvalue(), "application/octet-stream")})
+        assert resp.status_code == 400, resp.text
+        assert "Error in row 2: Invalid transaction_amount" in resp.text
+
+#files from the benchmark generator are valid uploads, with exactly the duplicates it put in
+@pytest.mark.asyncio
+@pytest.mark.parametrize("mode", ["insert", "copy"])
+async def test_upload_synthetic(client, mode):
+    import numpy as np
+    from benchmarks.synthetic import generate_batch, to_csv
+    from services.csv_parser import headers
+
+    batch = generate_batch(np.random.default_rng(7), 5000, users=50, products=20, skew=1.2, recency=2.0, duplicate_ratio=0.05)
+    unique = len(np.unique(batch.transaction_id, axis=0))
+    assert unique < len(batch)
+
+    payload = (",".join(headers) + "\n").encode() + to_csv(batch)
+    resp = await client.post("/upload/", params={"mode": mode}, files={"file": ("synthetic.csv", payload, "text/csv")})
+    assert resp.status_code == 200, resp.text
+    data = resp.json()
+    assert data["row_count"] == len(batch)
+    assert data["transaction_count"] == unique
+    assert data["duplicates_ignored"] == len(batch) - unique